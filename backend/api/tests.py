@@ -1,3 +1,59 @@
-from django.test import TestCase
+import os
+import subprocess
+import sys
 
-# Create your tests here.
+from django.conf import settings
+from django.test import SimpleTestCase
+
+# Thư viện nhận diện chỉ được import trong các hàm xử lý ảnh (employees.face_pipeline và các
+# module liên quan), không được import khi khởi động Django hay phân giải URL
+HEAVY_MODULES = (
+    'cv2', 'deepface', 'tensorflow', 'tf_keras', 'keras', 'torch', 'onnxruntime', 'scipy', 'mtcnn',
+    'retinaface', 'matplotlib',
+)
+
+# Thời gian import tối đa (mili giây) của django.setup() cộng phân giải toàn bộ URL
+IMPORT_BUDGET_MS = int(os.getenv('IMPORT_BUDGET_MS', '3000'))
+
+STARTUP_SCRIPT = (
+    "import django; django.setup(); "
+    "from django.urls import resolve; resolve('/api/attendance/check_in_out/')"
+)
+
+
+class StartupImportTests(SimpleTestCase):
+    """Khởi động Django (migrate, admin, test) không được kéo theo TensorFlow/OpenCV"""
+
+    def _import_times(self):
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get('DJANGO_SETTINGS_MODULE', 'face_checkin.settings'))
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', STARTUP_SCRIPT],
+            cwd=settings.BASE_DIR, env=env, capture_output=True, text=True, timeout=300
+        )
+        self.assertEqual(result.returncode, 0, result.stderr[-2000:])
+
+        # Dòng của -X importtime: "import time: <self us> | <cumulative us> | <tên module>"
+        times = {}
+        for line in result.stderr.splitlines():
+            if not line.startswith('import time:') or 'cumulative' in line:
+                continue
+            _, self_us, cumulative_us, name = (part.strip() for part in line.replace(':', '|', 1).split('|'))
+            times[name.strip()] = (int(self_us), int(cumulative_us))
+        return times
+
+    def test_startup_does_not_import_recognition_libraries(self):
+        times = self._import_times()
+        imported = sorted(
+            name for name in times if name.split('.')[0] in HEAVY_MODULES
+        )
+        self.assertEqual(imported, [], f"Các module nặng bị import khi khởi động: {imported[:20]}")
+
+    def test_startup_import_budget(self):
+        times = self._import_times()
+        total_ms = sum(self_us for self_us, _ in times.values()) / 1000.0
+        slowest = sorted(times.items(), key=lambda item: item[1][1], reverse=True)[:10]
+        self.assertLessEqual(
+            total_ms, IMPORT_BUDGET_MS,
+            f"Import khi khởi động mất {total_ms:.0f} ms (tối đa {IMPORT_BUDGET_MS} ms); "
+            f"chậm nhất: {[(name, cumulative // 1000) for name, (_, cumulative) in slowest]}"
+        )
@@ -2,7 +2,7 @@ from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from employees.views import EmployeeViewSet, DepartmentViewSet, ShiftViewSet, FaceDataViewSet, UserProfileViewSet
 from attendance.views import AttendanceViewSet
-from .views import DashboardViewSet, login, register, change_password
+from .views import DashboardViewSet, login, register, change_password, health
 from django.views.decorators.csrf import csrf_exempt
 
 router = DefaultRouter()
@@ -19,4 +19,5 @@ urlpatterns = [
     path('login/', csrf_exempt(login), name='login'),
     path('register/', register, name='register'),
     path('change-password/', change_password, name='change-password'),
+    path('health/', health, name='health'),
 ] 
\ No newline at end of file
@@ -248,6 +248,19 @@ def change_password(request):
         'token': token.key
     })
 
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def health(request):
+    """API endpoint cho load balancer/Docker healthcheck: 503 cho tới khi nạp xong mô hình nhận diện"""
+    from employees.face_settings import face_setting
+    from employees.face_warmup import readiness
+
+    state = readiness()
+    if not face_setting('WARMUP_ON_STARTUP') and state['status'] == 'idle':
+        # Không nạp trước: mô hình được nạp ở yêu cầu nhận diện đầu tiên
+        return Response({**state, 'status': 'lazy', 'ready': True})
+    return Response(state, status=200 if state['ready'] else 503)
+
 class DashboardViewSet(viewsets.ViewSet):
     """
     ViewSet cho Dashboard, cung cấp các API thống kê
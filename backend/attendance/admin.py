@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Attendance
+from .models import Attendance, Kiosk
 
 @admin.register(Attendance)
 class AttendanceAdmin(admin.ModelAdmin):
@@ -22,3 +22,11 @@ class AttendanceAdmin(admin.ModelAdmin):
     
     working_hours.short_description = "Giờ làm việc"
     status.short_description = "Trạng thái"
+
+
+@admin.register(Kiosk)
+class KioskAdmin(admin.ModelAdmin):
+    list_display = ('name', 'device_key', 'is_active', 'created_at')
+    list_filter = ('is_active', 'departments')
+    search_fields = ('name', 'device_key')
+    filter_horizontal = ('departments',)
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attendance', '0001_initial'),
+        ('employees', '0009_facedata_multiple_templates'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Kiosk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('device_key', models.CharField(max_length=64, unique=True)),
+                ('is_active', models.BooleanField(default=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('departments', models.ManyToManyField(blank=True, related_name='kiosks', to='employees.department')),
+            ],
+        ),
+    ]
@@ -1,5 +1,5 @@
 from django.db import models
-from employees.models import Employee, Shift
+from employees.models import Department, Employee, Shift
 from django.utils import timezone
 import os
 
@@ -54,3 +54,17 @@ class Attendance(models.Model):
             return "Working"
         else:
             return "Completed"
+
+
+class Kiosk(models.Model):
+    """Thiết bị/điểm điểm danh; nhận diện chỉ trong nhân viên thuộc các phòng ban được gán"""
+    name = models.CharField(max_length=100)
+    # Khóa thiết bị gửi kèm mỗi lần điểm danh qua header X-Kiosk-Key hoặc trường kiosk_key
+    device_key = models.CharField(max_length=64, unique=True)
+    # Để trống: kiosk được nhận diện toàn bộ nhân viên
+    departments = models.ManyToManyField(Department, blank=True, related_name='kiosks')
+    is_active = models.BooleanField(default=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    def __str__(self):
+        return self.name
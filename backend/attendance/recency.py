@@ -0,0 +1,172 @@
+import logging
+import math
+import threading
+import time
+from datetime import timedelta
+
+import numpy as np
+from django.utils import timezone
+
+from employees.face_settings import face_setting
+
+logger = logging.getLogger(__name__)
+
+SECONDS_PER_DAY = 24 * 3600
+
+
+class RecencyPrior:
+    """
+    Điểm hoạt động gần đây của từng nhân viên, giảm dần theo hàm mũ.
+
+    Mỗi lần check-in cộng RECENCY_CHECKIN_WEIGHT vào điểm của nhân viên; điểm giảm một nửa sau
+    mỗi RECENCY_HALF_LIFE_DAYS ngày. Chỉ lưu (điểm, thời điểm cập nhật) cho mỗi nhân viên nên
+    điểm tại thời điểm bất kỳ là score * exp(-(now - stamp) / tau), tra cứu bằng numpy cho
+    cả danh sách ứng viên thay vì quét bảng Attendance ở mỗi lần điểm danh.
+
+    Dữ liệu được xây dựng lại từ CSDL ở lần dùng đầu tiên, sau đó mỗi RECENCY_REFRESH_SECONDS
+    được làm mới trên luồng nền (luồng request không chờ CSDL) để gộp các lần check-in do worker
+    khác ghi nhận; giữa hai lần làm mới mỗi worker chỉ thấy thêm các lần check-in của chính nó.
+    """
+
+    def __init__(self, half_life_days=7.0, checkin_weight=0.05):
+        self.tau = half_life_days * SECONDS_PER_DAY / math.log(2)
+        self.checkin_weight = checkin_weight
+        self._lock = threading.Lock()
+        self._slots = {}
+        self._scores = np.zeros(0, dtype=np.float64)
+        self._stamps = np.zeros(0, dtype=np.float64)
+        self._next_refresh = 0.0
+        # Các lần check-in ghi nhận trong lúc đang làm mới (None khi không làm mới): áp dụng lại sau
+        # khi thay dữ liệu nếu truy vấn CSDL không thấy chúng
+        self._recorded_during_refresh = None
+
+    def load(self, employee_ids, check_in_times, now):
+        """Xây dựng lại điểm từ các cặp (employee_id, check_in_time)"""
+        now_ts = now.timestamp()
+        employee_ids = [str(employee_id) for employee_id in employee_ids]
+        keys, inverse = np.unique(np.asarray(employee_ids, dtype=str), return_inverse=True)
+        stamps = np.array([t.timestamp() for t in check_in_times], dtype=np.float64)
+        scores = np.zeros(len(keys), dtype=np.float64)
+        np.add.at(scores, inverse, self.checkin_weight * np.exp(-(now_ts - stamps) / self.tau))
+        with self._lock:
+            self._slots = {key: i for i, key in enumerate(keys.tolist())}
+            self._scores = scores
+            self._stamps = np.full(len(keys), now_ts, dtype=np.float64)
+            if self._recorded_during_refresh:
+                loaded = set(zip(employee_ids, stamps.tolist()))
+                for employee_id, ts in self._recorded_during_refresh:
+                    if (employee_id, ts) not in loaded:
+                        self._add(employee_id, ts)
+
+    def record_check_in(self, employee_id, when):
+        """Cập nhật điểm ngay sau một lần check-in thành công"""
+        ts = when.timestamp()
+        with self._lock:
+            if self._recorded_during_refresh is not None:
+                self._recorded_during_refresh.append((employee_id, ts))
+            self._add(employee_id, ts)
+
+    def _add(self, employee_id, ts):
+        # Gọi khi đang giữ self._lock
+        slot = self._slots.get(employee_id)
+        if slot is None:
+            # Mảng mới thay cả bộ để luồng đọc không thấy trạng thái dở dang
+            slots = dict(self._slots)
+            slots[employee_id] = len(slots)
+            self._scores = np.append(self._scores, self.checkin_weight)
+            self._stamps = np.append(self._stamps, ts)
+            self._slots = slots
+            return
+        decayed = self._scores[slot] * math.exp(-max(0.0, ts - self._stamps[slot]) / self.tau)
+        self._stamps[slot] = ts
+        self._scores[slot] = decayed + self.checkin_weight
+
+    def scores_for(self, employee_ids, now):
+        """
+        Điểm hoạt động gần đây của nhiều nhân viên tại thời điểm now
+
+        Returns:
+            numpy.ndarray: Điểm theo đúng thứ tự employee_ids (0 nếu chưa từng check-in)
+        """
+        slots, scores, stamps = self._slots, self._scores, self._stamps
+        index = np.array([slots.get(e, -1) for e in employee_ids], dtype=np.int64)
+        result = np.zeros(len(index), dtype=np.float64)
+        known = (index >= 0) & (index < len(scores))
+        rows = index[known]
+        result[known] = scores[rows] * np.exp(-np.maximum(0.0, now.timestamp() - stamps[rows]) / self.tau)
+        return result
+
+    def refresh(self):
+        """Đọc lại điểm từ CSDL ngay trên luồng hiện tại"""
+        self._next_refresh = time.monotonic() + face_setting('RECENCY_REFRESH_SECONDS')
+        load_recency_from_db(self)
+
+    def refresh_if_due(self):
+        """
+        Bắt đầu làm mới trên luồng nền khi đã quá RECENCY_REFRESH_SECONDS
+
+        Returns:
+            bool: True nếu vừa bắt đầu một lần làm mới
+        """
+        if time.monotonic() < self._next_refresh:
+            return False
+        with self._lock:
+            if self._recorded_during_refresh is not None:
+                return False
+            self._recorded_during_refresh = []
+        self._next_refresh = time.monotonic() + face_setting('RECENCY_REFRESH_SECONDS')
+        threading.Thread(target=self._refresh_in_background, name='recency-refresh', daemon=True).start()
+        return True
+
+    def _refresh_in_background(self):
+        from django.db import close_old_connections
+
+        try:
+            load_recency_from_db(self)
+        except Exception as e:
+            logger.error(f"Lỗi khi làm mới điểm hoạt động gần đây: {str(e)}")
+        finally:
+            with self._lock:
+                self._recorded_during_refresh = None
+            close_old_connections()
+
+
+def load_recency_from_db(prior):
+    """Đọc các lần check-in trong RECENCY_HORIZON_DAYS ngày gần nhất vào prior"""
+    from .models import Attendance
+
+    now = timezone.now()
+    since = now - timedelta(days=face_setting('RECENCY_HORIZON_DAYS'))
+    rows = list(
+        Attendance.objects.filter(check_in_time__gte=since, check_in_time__lte=now)
+        .values_list('employee_id', 'check_in_time')
+    )
+    employee_ids = [employee_id for employee_id, _ in rows]
+    check_in_times = [check_in_time for _, check_in_time in rows]
+    prior.load(employee_ids, check_in_times, now)
+    logger.info(f"Đã xây dựng điểm hoạt động gần đây từ {len(rows)} lần check-in")
+
+
+_prior = None
+_prior_lock = threading.Lock()
+
+
+def get_recency_prior():
+    """
+    Trả về điểm hoạt động gần đây dùng chung của tiến trình
+
+    Lần gọi đầu tiên đọc CSDL ngay; các lần làm mới định kỳ sau đó chạy trên luồng nền.
+    """
+    global _prior
+    if _prior is None:
+        with _prior_lock:
+            if _prior is None:
+                prior = RecencyPrior(
+                    half_life_days=face_setting('RECENCY_HALF_LIFE_DAYS'),
+                    checkin_weight=face_setting('RECENCY_CHECKIN_WEIGHT'),
+                )
+                prior.refresh()
+                _prior = prior
+        return _prior
+    _prior.refresh_if_due()
+    return _prior
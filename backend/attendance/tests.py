@@ -1,3 +1,128 @@
-from django.test import TestCase
+import threading
+from datetime import datetime, timedelta, timezone as dt_timezone
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from django.test import SimpleTestCase
+
+from employees.face_gallery import FaceGallery
+
+from .recency import RecencyPrior
+
+
+class RecencyPriorTests(SimpleTestCase):
+    """Điểm hoạt động gần đây: mỗi lần check-in cộng trọng số, giảm một nửa sau mỗi chu kỳ bán rã"""
+
+    now = datetime(2024, 5, 20, 8, 0, tzinfo=dt_timezone.utc)
+
+    def test_decay(self):
+        prior = RecencyPrior(half_life_days=7, checkin_weight=0.05)
+        prior.load(['E001', 'E002', 'E002'],
+                   [self.now - timedelta(days=7), self.now, self.now - timedelta(days=14)], self.now)
+        scores = prior.scores_for(['E001', 'E002', 'E404'], self.now)
+        np.testing.assert_allclose(scores, [0.025, 0.05 + 0.0125, 0.0])
+        # Một chu kỳ bán rã sau đó mọi điểm giảm một nửa
+        later = prior.scores_for(['E001', 'E002'], self.now + timedelta(days=7))
+        np.testing.assert_allclose(later, scores[:2] / 2)
+
+    def test_record_check_in_matches_load(self):
+        times = [self.now - timedelta(days=d, hours=h) for d, h in ((9, 3), (4, 0), (1, 5))]
+        incremental = RecencyPrior(half_life_days=7, checkin_weight=0.05)
+        for when in times:
+            incremental.record_check_in('E001', when)
+        loaded = RecencyPrior(half_life_days=7, checkin_weight=0.05)
+        loaded.load(['E001'] * 3, times, self.now)
+        np.testing.assert_allclose(
+            incremental.scores_for(['E001'], self.now), loaded.scores_for(['E001'], self.now)
+        )
+
+
+class RecencyRefreshTests(SimpleTestCase):
+    """Làm mới từ CSDL chạy trên luồng nền, không mất hay đếm trùng check-in ghi nhận trong lúc đó"""
+
+    now = datetime(2024, 5, 20, 8, 0, tzinfo=dt_timezone.utc)
+
+    def test_refresh_runs_in_background(self):
+        prior = RecencyPrior(half_life_days=7, checkin_weight=0.05)
+        started, release, done = threading.Event(), threading.Event(), threading.Event()
+        query_result = (['E001', 'E002'], [self.now - timedelta(days=7), self.now])
+        checked_in_during_refresh = self.now + timedelta(minutes=1)
+
+        def load_from_db(target):
+            started.set()
+            release.wait(5)
+            # CSDL đã thấy lần check-in của E002 nhưng chưa thấy lần của E003
+            ids, times = query_result
+            target.load(ids + ['E002'], times + [checked_in_during_refresh], self.now)
+            done.set()
+
+        with mock.patch('attendance.recency.load_recency_from_db', side_effect=load_from_db), \
+                mock.patch('django.db.close_old_connections'):
+            self.assertTrue(prior.refresh_if_due())
+            self.assertTrue(started.wait(5))
+            # Luồng request không chờ; lần gọi tiếp theo không chạy thêm một lần làm mới
+            prior._next_refresh = 0.0
+            self.assertFalse(prior.refresh_if_due())
+            prior.record_check_in('E002', checked_in_during_refresh)
+            prior.record_check_in('E003', checked_in_during_refresh)
+            release.set()
+            self.assertTrue(done.wait(5))
+            for thread in threading.enumerate():
+                if thread.name == 'recency-refresh':
+                    thread.join(5)
+
+        expected = RecencyPrior(half_life_days=7, checkin_weight=0.05)
+        expected.load(['E001', 'E002', 'E002', 'E003'],
+                      query_result[1] + [checked_in_during_refresh] * 2, self.now)
+        probes = ['E001', 'E002', 'E003']
+        np.testing.assert_allclose(
+            prior.scores_for(probes, checked_in_during_refresh),
+            expected.scores_for(probes, checked_in_during_refresh),
+        )
+        self.assertIsNone(prior._recorded_during_refresh)
+
+    def test_refresh_not_due(self):
+        prior = RecencyPrior()
+        with mock.patch('attendance.recency.load_recency_from_db') as load_from_db:
+            prior._next_refresh = float('inf')
+            self.assertFalse(prior.refresh_if_due())
+        load_from_db.assert_not_called()
+
+
+class VerifyEmployeeTests(SimpleTestCase):
+    """Xác minh 1:1 của nhân viên đăng nhập dùng cùng điểm kết hợp và ngưỡng với nhận diện 1:N"""
+
+    now = datetime(2024, 5, 20, 8, 0, tzinfo=dt_timezone.utc)
+
+    def setUp(self):
+        self.gallery = FaceGallery(8)
+        self.gallery.add(1, 'E001', np.eye(8)[0])
+        self.gallery.add(2, 'E002', np.eye(8)[1])
+        # Độ tương đồng 0.65 với E001: đạt 1 - DISTANCE_THRESHOLD nhưng 0.8 * 0.65 < 0.55
+        self.probe = 0.65 * np.eye(8)[0] + np.sqrt(1 - 0.65 ** 2) * np.eye(8)[2]
+
+    def _decide(self, recency):
+        from employees.models import Employee
+
+        from .views import AttendanceViewSet
+
+        prior = RecencyPrior(half_life_days=7, checkin_weight=recency)
+        prior.load(['E001'], [self.now], self.now)
+        view = AttendanceViewSet()
+        with mock.patch('attendance.views.get_recency_prior', return_value=prior), \
+                mock.patch('attendance.views.search_shift_tiered',
+                           side_effect=lambda gallery, embedding, **kwargs: (gallery.search(embedding, **kwargs), 'all')):
+            verified = view._verify_employee(self.gallery, self.probe, Employee(employee_id='E001'), self.now)
+            identified = view._identify_employee(self.gallery, self.probe, self.now)
+        accepted = lambda result: result[0] == 'E001' and result[1] >= result[2]
+        return accepted(verified), accepted(identified), verified
+
+    def test_same_rule_as_identification(self):
+        verified, identified, result = self._decide(recency=0.0)
+        self.assertFalse(verified)
+        self.assertFalse(identified)
+        self.assertAlmostEqual(result[1], 0.8 * 0.65, places=5)
+
+        verified, identified, _ = self._decide(recency=0.5)
+        self.assertTrue(verified)
+        self.assertTrue(identified)
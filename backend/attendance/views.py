@@ -4,23 +4,22 @@ from rest_framework.decorators import action
 from rest_framework.response import Response
 from django.utils import timezone
 from django.db.models import Q
-import pickle
 import datetime
 from datetime import datetime, timedelta
 import random
 import logging
 import os
-import io
-from PIL import Image
-import cv2
 import numpy as np
-from deepface import DeepFace
-from scipy.spatial.distance import cosine
 from rest_framework.permissions import IsAuthenticated, AllowAny
 
-from .models import Attendance
+from .models import Attendance, Kiosk
 from .serializers import AttendanceSerializer, AttendanceDetailSerializer, AttendanceCreateSerializer
-from employees.models import Employee, FaceData
+from employees.models import Employee
+from employees.face_gallery import get_face_gallery
+from employees.face_service import RecognitionBusy, RecognitionTimeout, analyze_upload
+from employees.face_settings import face_setting
+from employees.face_tiers import department_partition, search_shift_tiered
+from .recency import get_recency_prior
 
 logger = logging.getLogger(__name__)
 
@@ -78,262 +77,138 @@ class AttendanceViewSet(viewsets.ModelViewSet):
         
         image_file = request.FILES['image']
         
+        # Kiosk tự định danh bằng khóa thiết bị; khi đó chỉ nhận diện nhân viên thuộc các phòng ban
+        # được gán cho kiosk. Không gửi khóa thì nhận diện trên toàn bộ nhân viên như trước
+        kiosk_key = request.META.get('HTTP_X_KIOSK_KEY') or request.data.get('kiosk_key')
+        kiosk_departments = []
+        if kiosk_key:
+            kiosk = Kiosk.objects.filter(device_key=kiosk_key, is_active=True).prefetch_related('departments').first()
+            if kiosk is None:
+                return Response(
+                    {'error': 'Thiết bị điểm danh không hợp lệ hoặc đã bị vô hiệu hóa'},
+                    status=status.HTTP_403_FORBIDDEN
+                )
+            kiosk_departments = [department.name for department in kiosk.departments.all()]
+        
         try:
             logger.info("Bắt đầu quá trình điểm danh")
             
-            # Đọc ảnh từ request
-            image_stream = io.BytesIO(image_file.read())
-            
-            # Lưu lại stream để lưu vào DB sau này
+            # Lưu lại file tải lên để lưu vào DB sau này
             image_for_db = image_file
             
-            # Chuyển đổi sang định dạng numpy array
-            pil_image = Image.open(image_stream)
-            img_array = np.array(pil_image)
-            
-            # Lưu ảnh tạm thời để DeepFace xử lý
-            temp_image_path = "temp_face_img.jpg"
-            cv2.imwrite(temp_image_path, cv2.cvtColor(img_array, cv2.COLOR_RGB2BGR))
-            
             try:
-                # Sử dụng DeepFace để phát hiện khuôn mặt với anti-spoofing
-                try:
-                    face_objs = DeepFace.extract_faces(
-                        img_path=temp_image_path, 
-                        detector_backend="retinaface",
-                        anti_spoofing=True
-                    )
-                except Exception as spoof_error:
-                    logger.warning(f"Không thể sử dụng anti-spoofing: {str(spoof_error)}")
-                    # Nếu anti-spoofing gặp lỗi, thử lại không sử dụng anti-spoofing
-                    face_objs = DeepFace.extract_faces(
-                        img_path=temp_image_path, 
-                        detector_backend="retinaface",
-                        anti_spoofing=False
-                    )
-                    # Giả định khuôn mặt là thật
-                    for i in range(len(face_objs)):
-                        face_objs[i]["is_real"] = True
-                        face_objs[i]["liveness_score"] = 0.9
+                # Phát hiện khuôn mặt một lần, dùng lại vùng khuôn mặt cho anti-spoofing và embedding
+                # (chạy trên tiến trình suy luận, ảnh được giải mã trong bộ nhớ)
+                analysis = analyze_upload(image_file)
                 
-                logger.info(f"Số khuôn mặt phát hiện được: {len(face_objs)}")
-                
-                if len(face_objs) == 0:
-                    # Xóa ảnh tạm thời
-                    if os.path.exists(temp_image_path):
-                        os.remove(temp_image_path)
+                if analysis.face_count == 0:
                     return Response(
                         {'error': 'Không phát hiện khuôn mặt trong hình ảnh. Vui lòng thử lại với ánh sáng tốt hơn và đảm bảo khuôn mặt nhìn rõ vào camera.'},
                         status=status.HTTP_400_BAD_REQUEST
                     )
                 
-                if len(face_objs) > 1:
-                    # Xóa ảnh tạm thời
-                    if os.path.exists(temp_image_path):
-                        os.remove(temp_image_path)
+                if analysis.face_count > 1:
                     return Response(
                         {'error': 'Phát hiện nhiều khuôn mặt trong hình ảnh. Vui lòng chỉ đưa một khuôn mặt vào khung hình.'},
                         status=status.HTTP_400_BAD_REQUEST
                     )
                 
-                # Kiểm tra khuôn mặt thật/giả
-                is_real_face = face_objs[0].get("is_real", True)
-                liveness_score = face_objs[0].get("liveness_score", 0.9)
+                # Ảnh không đạt chất lượng ở bước lọc nhanh: chưa kết luận được khuôn mặt thật hay giả
+                if analysis.quality_issue:
+                    return Response(
+                        {
+                            'error': 'Ảnh khuôn mặt chưa đạt chất lượng (quá nhỏ, bị mờ hoặc thiếu chi tiết). Vui lòng đứng gần camera hơn, giữ yên và thử lại với ánh sáng tốt hơn.',
+                            'quality_issue': analysis.quality_issue,
+                            'liveness_score': analysis.liveness_score
+                        },
+                        status=status.HTTP_400_BAD_REQUEST
+                    )
                 
-                logger.info(f"Kết quả kiểm tra khuôn mặt thật/giả: {is_real_face}, điểm: {liveness_score:.2f}")
+                liveness_score = analysis.liveness_score
                 
                 # Kiểm tra nếu có sự giả mạo
-                if not is_real_face:
-                    # Xóa ảnh tạm thời
-                    if os.path.exists(temp_image_path):
-                        os.remove(temp_image_path)
+                if not analysis.is_real:
                     return Response(
                         {
                             'error': 'Phát hiện khuôn mặt không phải khuôn mặt thật. Vui lòng sử dụng khuôn mặt thật để điểm danh.',
                             'liveness_score': liveness_score,
-                            'details': {'is_real': is_real_face}
+                            'details': {'is_real': analysis.is_real}
                         },
                         status=status.HTTP_400_BAD_REQUEST
                     )
                 
-                # Trích xuất đặc trưng (embedding) khuôn mặt từ ảnh đầu vào
-                embedding_objs = DeepFace.represent(
-                    img_path=temp_image_path, 
-                    detector_backend="retinaface",
-                    model_name="Facenet512"
-                )
-                
-                if len(embedding_objs) == 0:
-                    # Xóa ảnh tạm thời
-                    if os.path.exists(temp_image_path):
-                        os.remove(temp_image_path)
+                if analysis.embedding is None:
                     return Response(
                         {'error': 'Không thể trích xuất đặc trưng khuôn mặt. Vui lòng thử lại với ảnh chất lượng tốt hơn.'},
                         status=status.HTTP_400_BAD_REQUEST
                     )
                 
-                unknown_face_embedding = embedding_objs[0]["embedding"]
-                
-                # Xóa ảnh tạm thời
-                if os.path.exists(temp_image_path):
-                    os.remove(temp_image_path)
+                unknown_face_embedding = analysis.embedding
                 
+            except RecognitionBusy as e:
+                logger.warning(f"Từ chối yêu cầu nhận diện: {str(e)}")
+                return Response(
+                    {'error': 'Hệ thống nhận diện đang quá tải. Vui lòng thử lại sau giây lát.'},
+                    status=status.HTTP_503_SERVICE_UNAVAILABLE
+                )
+            except RecognitionTimeout as e:
+                logger.warning(f"Quá thời gian nhận diện: {str(e)}")
+                return Response(
+                    {'error': 'Hệ thống nhận diện phản hồi quá chậm. Vui lòng thử lại.'},
+                    status=status.HTTP_504_GATEWAY_TIMEOUT
+                )
             except Exception as e:
-                # Xóa ảnh tạm thời
-                if os.path.exists(temp_image_path):
-                    os.remove(temp_image_path)
                 logger.error(f"Lỗi khi trích xuất khuôn mặt: {str(e)}")
                 return Response(
                     {'error': f'Lỗi khi trích xuất khuôn mặt: {str(e)}'},
                     status=status.HTTP_400_BAD_REQUEST
                 )
             
-            # Lấy tất cả dữ liệu khuôn mặt đã đăng ký
-            all_face_data = FaceData.objects.all()
+            # Lấy gallery embedding khuôn mặt đã đăng ký (xây dựng một lần cho mỗi tiến trình),
+            # thu hẹp về phân vùng các phòng ban của kiosk nếu có
+            gallery = department_partition(get_face_gallery(), kiosk_departments)
             
-            if not all_face_data:
+            if len(gallery) == 0:
                 return Response(
                     {'error': 'Không có dữ liệu khuôn mặt nào trong hệ thống'},
                     status=status.HTTP_404_NOT_FOUND
                 )
             
-            logger.info(f"Số lượng dữ liệu khuôn mặt trong CSDL: {all_face_data.count()}")
-            
-            # Khởi tạo dictionary lưu thông tin tốt nhất cho mỗi nhân viên
-            # Cấu trúc: {employee_id: {'match_score': float, 'face_data': FaceData, 'recent_score': float}}
-            best_matches_by_employee = {}
+            logger.info(f"Số lượng dữ liệu khuôn mặt trong gallery: {len(gallery)}"
+                        + (f" (phòng ban: {', '.join(kiosk_departments)})" if kiosk_departments else ""))
             
-            # So sánh khuôn mặt đầu vào với tất cả khuôn mặt đã đăng ký
-            for face_data in all_face_data:
-                try:
-                    # Giải mã dữ liệu khuôn mặt
-                    stored_data = pickle.loads(face_data.face_encoding)
-                    
-                    # Kiểm tra cấu trúc dữ liệu
-                    if not isinstance(stored_data, dict):
-                        logger.warning(f"Dữ liệu khuôn mặt không hợp lệ cho ID: {face_data.id}")
-                        continue
-                    
-                    # Kiểm tra định dạng dữ liệu cũ và mới
-                    if 'encoding' in stored_data:
-                        # Định dạng mới - sử dụng vector đặc trưng
-                        stored_face_embedding = stored_data['encoding']
-                        employee_id = stored_data.get('employee_id')
-                        
-                        # Tính cosine similarity giữa hai vector đặc trưng
-                        # Chuyển đổi mảng 1D sang mảng 2D
-                        unknown_embedding_array = np.array(unknown_face_embedding)
-                        stored_embedding_array = np.array(stored_face_embedding)
-                        
-                        # Tính cosine distance bằng scipy
-                        cosine_distance = cosine(unknown_embedding_array, stored_embedding_array)
-                        
-                        # Cosine similarity = 1 - cosine distance
-                        cosine_similarity = 1 - cosine_distance
-                        match_score = cosine_similarity  # Điểm số (0.0-1.0)
-                        
-                        logger.info(f"Độ tương đồng với khuôn mặt ID {face_data.id} (nhân viên {employee_id}): {match_score}")
-                        
-                        # Cập nhật best match cho nhân viên này
-                        if employee_id not in best_matches_by_employee or match_score > best_matches_by_employee[employee_id]['match_score']:
-                            best_matches_by_employee[employee_id] = {
-                                'match_score': match_score,
-                                'face_data': face_data,
-                                'recent_score': 0.0  # Khởi tạo giá trị cho điểm check-in gần đây
-                            }
-                    
-                    elif 'face_img' in stored_data:
-                        # Định dạng cũ - bỏ qua
-                        logger.info(f"Bỏ qua dữ liệu định dạng cũ cho nhân viên ID: {stored_data.get('employee_id')}")
-                        continue
-                    else:
-                        logger.warning(f"Định dạng dữ liệu không xác định cho ID: {face_data.id}")
-                        continue
-                    
-                except Exception as e:
-                    logger.error(f"Lỗi khi so sánh khuôn mặt: {str(e)}")
-                    continue
-            
-            # Lấy dữ liệu điểm danh gần đây để cải thiện nhận diện
             now = timezone.now()
-            one_week_ago = now - timedelta(days=7)
-            
-            # Lấy điểm danh trong 7 ngày qua
-            recent_attendances = Attendance.objects.filter(
-                check_in_time__gte=one_week_ago
-            ).order_by('-check_in_time')
-            
-            logger.info(f"Số lượng điểm danh gần đây: {recent_attendances.count()}")
-            
-            # Lấy unique employee_ids từ best_matches_by_employee 
-            potential_employee_ids = best_matches_by_employee.keys()
-            
-            if potential_employee_ids:
-                # Chỉ xem xét điểm danh của những nhân viên có khả năng khớp
-                recent_attendances = recent_attendances.filter(employee_id__in=potential_employee_ids)
-                
-                for attendance in recent_attendances:
-                    employee_id = attendance.employee_id
-                    
-                    # Kiểm tra nếu nhân viên này đã có trong danh sách tiềm năng
-                    if employee_id in best_matches_by_employee:
-                        # Hệ số giảm theo thời gian (điểm danh càng cũ càng ít quan trọng)
-                        days_ago = (now - attendance.check_in_time).days
-                        time_factor = max(0.5, 1.0 - (days_ago / 14.0))  # Tối thiểu 0.5, giảm dần theo thời gian
-                        
-                        # Thêm điểm cộng cho nhân viên đã check-in gần đây (điểm càng cao càng có khả năng là người đó)
-                        # Ghi chú: Đây là sự tích lũy, mỗi điểm danh gần đây sẽ tăng điểm
-                        best_matches_by_employee[employee_id]['recent_score'] += 0.05 * time_factor
-                        
-                        logger.info(f"Thêm {0.05 * time_factor:.3f} điểm cho nhân viên {employee_id} do check-in cách đây {days_ago} ngày")
             
-            # Tính điểm kết hợp và tìm nhân viên tốt nhất
-            best_employee_id = None
-            best_combined_score = 0.0
-            face_match_weight = 0.8  # Trọng số cho điểm số khớp khuôn mặt
-            recent_activity_weight = 0.2  # Trọng số cho điểm hoạt động gần đây
+            # PHÂN QUYỀN: Nếu user đang đăng nhập, chỉ cho phép check-in bằng khuôn mặt của chính mình.
+            # Khi đó chỉ cần xác minh 1:1 với các mẫu của nhân viên đó thay vì tìm trên cả gallery
+            current_employee = None
+            if request.user and request.user.is_authenticated:
+                try:
+                    current_employee = Employee.objects.get(username=request.user)
+                except Employee.DoesNotExist:
+                    return Response(
+                        {'error': 'Không tìm thấy thông tin nhân viên của bạn.'},
+                        status=status.HTTP_404_NOT_FOUND
+                    )
+                if kiosk_departments and current_employee.department_id not in kiosk_departments:
+                    return Response(
+                        {'error': 'Bạn không thuộc phòng ban được phép điểm danh tại thiết bị này.'},
+                        status=status.HTTP_403_FORBIDDEN
+                    )
             
-            for employee_id, data in best_matches_by_employee.items():
-                # Kết hợp điểm khớp khuôn mặt và điểm hoạt động gần đây
-                combined_score = (
-                    face_match_weight * data['match_score'] + 
-                    recent_activity_weight * min(1.0, data['recent_score'])  # Giới hạn tối đa 1.0
+            if current_employee is not None:
+                best_employee_id, best_combined_score, combined_threshold = self._verify_employee(
+                    gallery, unknown_face_embedding, current_employee, now
+                )
+            else:
+                best_employee_id, best_combined_score, combined_threshold = self._identify_employee(
+                    gallery, unknown_face_embedding, now
                 )
-                
-                logger.info(f"Nhân viên {employee_id}: Điểm khuôn mặt = {data['match_score']:.3f}, "
-                           f"Điểm hoạt động gần đây = {min(1.0, data['recent_score']):.3f}, "
-                           f"Điểm kết hợp = {combined_score:.3f}")
-                
-                if combined_score > best_combined_score:
-                    best_combined_score = combined_score
-                    best_employee_id = employee_id
-            
-            # Ngưỡng điểm kết hợp (có thể điều chỉnh)
-            combined_threshold = 0.55  
-            
-            logger.info(f"Nhân viên tốt nhất: {best_employee_id}, Điểm kết hợp: {best_combined_score:.3f}, Ngưỡng: {combined_threshold}")
             
             if best_employee_id is not None and best_combined_score >= combined_threshold:
-                # Lấy face_data từ best_match
-                best_face_data = best_matches_by_employee[best_employee_id]['face_data']
-                employee = best_face_data.employee
+                employee = current_employee or Employee.objects.get(employee_id=best_employee_id)
                 
                 logger.info(f"Nhận diện thành công: {employee.first_name} {employee.last_name}")
-
-                # PHÂN QUYỀN: Nếu user đang đăng nhập, chỉ cho phép check-in bằng khuôn mặt của chính mình
-                if request.user and request.user.is_authenticated:
-                    try:
-                        current_employee = Employee.objects.get(username=request.user)
-                        if employee != current_employee:
-                            return Response(
-                                {'error': 'Bạn chỉ được phép check-in bằng khuôn mặt của chính mình.'},
-                                status=status.HTTP_403_FORBIDDEN
-                            )
-                    except Employee.DoesNotExist:
-                        return Response(
-                            {'error': 'Không tìm thấy thông tin nhân viên của bạn.'},
-                            status=status.HTTP_404_NOT_FOUND
-                        )
                 
                 # Kiểm tra trạng thái điểm danh hiện tại
                 today_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
@@ -400,6 +275,9 @@ class AttendanceViewSet(viewsets.ModelViewSet):
                     
                     attendance.save()
                     
+                    # Cập nhật điểm hoạt động gần đây dùng cho các lần nhận diện sau
+                    get_recency_prior().record_check_in(employee.employee_id, now)
+                    
                     return Response({
                         'success': True,
                         'action': 'check_in',
@@ -413,6 +291,17 @@ class AttendanceViewSet(viewsets.ModelViewSet):
                         'liveness_score': liveness_score,
                         'match_score': best_combined_score
                     })
+            elif current_employee is not None and best_employee_id is None:
+                return Response(
+                    {'error': 'Bạn chưa đăng ký dữ liệu khuôn mặt hoặc tài khoản nhân viên đã ngừng hoạt động.'},
+                    status=status.HTTP_404_NOT_FOUND
+                )
+            elif current_employee is not None:
+                logger.warning(f"Khuôn mặt không khớp với nhân viên đang đăng nhập {current_employee.employee_id}: {best_combined_score}")
+                return Response(
+                    {'error': 'Bạn chỉ được phép check-in bằng khuôn mặt của chính mình.'},
+                    status=status.HTTP_403_FORBIDDEN
+                )
             else:
                 logger.warning(f"Không tìm thấy khuôn mặt phù hợp trong CSDL hoặc điểm tương đồng quá thấp: {best_combined_score}")
                 return Response(
@@ -429,6 +318,86 @@ class AttendanceViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
     
+    # Trọng số và ngưỡng điểm kết hợp (có thể điều chỉnh), dùng chung cho nhận diện 1:N và xác minh 1:1
+    face_match_weight = 0.8  # Trọng số cho điểm số khớp khuôn mặt
+    recent_activity_weight = 0.2  # Trọng số cho điểm hoạt động gần đây
+    combined_threshold = 0.55
+    
+    def _combined_scores(self, matches, now):
+        """Điểm kết hợp (khớp khuôn mặt + hoạt động gần đây) của các ứng viên, theo thứ tự matches"""
+        # Điểm hoạt động gần đây (giảm dần theo thời gian) của các ứng viên, tra cứu trong bộ nhớ
+        employee_ids = [match.employee_id for match in matches]
+        match_scores = np.array([match.similarity for match in matches], dtype=np.float64)
+        recent_scores = np.minimum(1.0, get_recency_prior().scores_for(employee_ids, now))  # Giới hạn tối đa 1.0
+        
+        # Kết hợp điểm khớp khuôn mặt và điểm hoạt động gần đây
+        combined_scores = self.face_match_weight * match_scores + self.recent_activity_weight * recent_scores
+        
+        for match, recent_score, combined_score in zip(matches, recent_scores, combined_scores):
+            logger.info(f"Nhân viên {match.employee_id} (khuôn mặt ID {match.face_data_id}): "
+                       f"Điểm khuôn mặt = {match.similarity:.3f}, "
+                       f"Điểm hoạt động gần đây = {recent_score:.3f}, "
+                       f"Điểm kết hợp = {combined_score:.3f}")
+        return combined_scores
+    
+    def _identify_employee(self, gallery, unknown_face_embedding, now):
+        """
+        Nhận diện 1:N: so khớp với toàn bộ gallery rồi kết hợp với dữ liệu check-in gần đây
+
+        Returns:
+            tuple: (best_employee_id, best_combined_score, combined_threshold)
+        """
+        combined_threshold = self.combined_threshold
+        
+        # Ứng viên có độ tương đồng dưới mức này không thể đạt ngưỡng kết hợp
+        # kể cả khi được cộng tối đa điểm hoạt động gần đây
+        min_match_score = (combined_threshold - self.recent_activity_weight) / self.face_match_weight
+        
+        # So sánh khuôn mặt đầu vào bằng một phép nhân ma trận-vector: trước tiên với nhân viên
+        # sắp vào/tan ca, sau đó với toàn bộ gallery nếu không có ứng viên đủ tin cậy.
+        # Nhân viên có nhiều mẫu chỉ được tính một lần với mẫu giống nhất
+        matches, search_tier = search_shift_tiered(
+            gallery,
+            unknown_face_embedding,
+            top_k=face_setting('GALLERY_TOP_K'),
+            min_similarity=min_match_score,
+            per_employee=True
+        )
+        logger.info(f"Tìm kiếm khuôn mặt theo tầng '{search_tier}': {len(matches)} ứng viên")
+        
+        if not matches:
+            logger.info(f"Nhân viên tốt nhất: None, Điểm kết hợp: 0.000, Ngưỡng: {combined_threshold}")
+            return None, 0.0, combined_threshold
+        
+        combined_scores = self._combined_scores(matches, now)
+        best = int(np.argmax(combined_scores))
+        best_employee_id = matches[best].employee_id
+        best_combined_score = float(combined_scores[best])
+        
+        logger.info(f"Nhân viên tốt nhất: {best_employee_id}, Điểm kết hợp: {best_combined_score:.3f}, Ngưỡng: {combined_threshold}")
+        
+        return best_employee_id, best_combined_score, combined_threshold
+    
+    def _verify_employee(self, gallery, unknown_face_embedding, employee, now):
+        """
+        Xác minh 1:1: chỉ so khớp với các mẫu khuôn mặt của nhân viên đang đăng nhập
+
+        Dùng cùng điểm kết hợp và ngưỡng với nhận diện 1:N, nên một khuôn mặt không được chấp nhận
+        khi nhận diện trên kiosk cũng không được chấp nhận khi nhân viên tự điểm danh.
+
+        Returns:
+            tuple: (best_employee_id, best_combined_score, combined_threshold)
+        """
+        match = gallery.verify(unknown_face_embedding, employee.employee_id)
+        if match is None:
+            logger.info(f"Nhân viên {employee.employee_id} chưa có mẫu khuôn mặt trong gallery")
+            return None, 0.0, self.combined_threshold
+        
+        combined_score = float(self._combined_scores([match], now)[0])
+        logger.info(f"Xác minh nhân viên {employee.employee_id}: điểm kết hợp {combined_score:.3f}, "
+                   f"ngưỡng {self.combined_threshold}")
+        return employee.employee_id, combined_score, self.combined_threshold
+    
     @action(detail=False, methods=['get'])
     def today(self, request):
         """Lấy danh sách chấm công hôm nay"""
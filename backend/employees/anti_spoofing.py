@@ -1,3 +1,5 @@
+import time
+
 import cv2
 import numpy as np
 import logging
@@ -7,146 +9,153 @@ logger = logging.getLogger(__name__)
 class LivenessDetector:
     """
     Lớp phát hiện khuôn mặt thật/giả sử dụng các kỹ thuật phân tích ảnh đơn giản
+
+    Dùng làm bước lọc nhanh (khoảng 1 ms mỗi khuôn mặt) trước các mô hình nặng: khuôn mặt quá nhỏ,
+    quá mờ (ảnh chụp lại từ màn hình, chuyển động) hoặc quá phẳng (ảnh in) bị loại ngay mà không
+    cần chạy anti-spoofing của DeepFace và Facenet512.
+
+    Các ngưỡng mặc định giữ nguyên từ phiên bản trước (khi lớp này chỉ ghi log, không loại khuôn mặt
+    nào) và được đo trên ảnh xám ở độ phân giải gốc của khuôn mặt; chúng chưa được hiệu chỉnh trên
+    ảnh thật/giả thu từ kiosk, vì vậy LIVENESS_PREGATE mặc định tắt.
+
+    analysis_size (tùy chọn): đưa mọi khuôn mặt về cùng kích thước analysis_size x analysis_size
+    để chấm điểm cả lô trên một mảng NumPy (N x H x W). Phương sai Laplacian, độ lệch chuẩn và mật độ
+    cạnh thay đổi khi thu nhỏ ảnh, nên khi bật phải hiệu chỉnh lại các ngưỡng.
+
+    Thay đổi so với phiên bản trước: điểm texture chuẩn hóa là std / 70 (càng nhiều chi tiết càng
+    giống thật, đúng với lý do dùng phép kiểm tra này) thay cho 1 - std / 70.
     """
-    
-    def __init__(self):
-        self.min_face_size = (50, 50)  # Giảm kích thước tối thiểu hơn nữa
-        self.blur_threshold = 50.0  # Giữ ngưỡng độ mờ
-        self.uniform_threshold = 20.0  # Giữ ngưỡng độ đồng nhất
-        self.edge_density_threshold = 0.05  # Giữ ngưỡng mật độ cạnh
-    
+
+    def __init__(self, min_face_size=50, blur_threshold=50.0, uniform_threshold=20.0,
+                 edge_density_threshold=0.05, liveness_threshold=0.3, analysis_size=None):
+        self.min_face_size = (min_face_size, min_face_size)
+        self.blur_threshold = blur_threshold  # Phương sai Laplacian tối thiểu
+        self.uniform_threshold = uniform_threshold  # Độ lệch chuẩn mức xám tối thiểu
+        self.edge_density_threshold = edge_density_threshold  # Mật độ cạnh tham chiếu
+        self.liveness_threshold = liveness_threshold  # Điểm tổng hợp tối thiểu
+        self.analysis_size = analysis_size
+
     def check_liveness(self, image):
         """
         Kiểm tra tính thật của khuôn mặt trong ảnh
-        
+
         Args:
-            image (numpy.ndarray): Ảnh đầu vào BGR
-            
+            image (numpy.ndarray): Ảnh khuôn mặt BGR
+
         Returns:
             tuple: (is_real, confidence, details)
                 - is_real: Boolean - khuôn mặt là thật hoặc giả
                 - confidence: Float - độ tin cậy từ 0.0-1.0
-                - details: Dict - chi tiết kết quả kiểm tra
+                - details: Dict - chi tiết kết quả kiểm tra (lý do loại, điểm từng phép kiểm tra, thời gian)
+        """
+        results, timings = self.check_liveness_batch([image])
+        is_real, confidence, details = results[0]
+        details["timings_ms"] = timings
+        return is_real, confidence, details
+
+    def check_liveness_batch(self, images):
+        """
+        Kiểm tra nhiều khuôn mặt cùng lúc
+
+        Args:
+            images (list[numpy.ndarray]): Các ảnh khuôn mặt BGR (kích thước bất kỳ)
+
+        Returns:
+            tuple: (danh sách (is_real, confidence, details) theo thứ tự images,
+                    thời gian từng phép kiểm tra cho cả lô tính bằng mili giây)
         """
-        try:
-            # Convert to grayscale
-            if len(image.shape) > 2:
-                gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        timings = {}
+        started = time.perf_counter()
+        sizes = np.array([image.shape[:2] for image in images], dtype=np.int64).reshape(-1, 2)
+        stacks = self._normalize(images)
+        timings["normalize"] = (time.perf_counter() - started) * 1000.0
+
+        checks = (
+            ("blur", self._check_blur),
+            ("texture", self._check_texture_uniformity),
+            ("edge", self._check_edge_density),
+        )
+        scores = {}
+        for name, check in checks:
+            started = time.perf_counter()
+            scores[name] = np.concatenate([check(stack) for stack in stacks]) if stacks else np.empty(0)
+            timings[name] = (time.perf_counter() - started) * 1000.0
+
+        # Chuẩn hóa về [0, 1]: càng sắc nét, càng nhiều chi tiết, càng nhiều cạnh thì càng giống khuôn mặt thật
+        # (phiên bản trước dùng 1 - std / 70 cho texture, tức là thưởng cho ảnh đồng nhất)
+        norm_blur = np.clip(scores["blur"] / 70.0, 0.0, 1.0)
+        norm_texture = np.clip(scores["texture"] / 70.0, 0.0, 1.0)
+        norm_edge = np.clip(scores["edge"] / (2 * self.edge_density_threshold), 0.0, 1.0)
+        final_scores = 0.6 * norm_blur + 0.3 * norm_texture + 0.1 * norm_edge
+
+        too_small = (sizes[:, 0] < self.min_face_size[0]) | (sizes[:, 1] < self.min_face_size[1])
+        blurry = scores["blur"] < self.blur_threshold
+        flat = scores["texture"] < self.uniform_threshold
+        low_score = final_scores < self.liveness_threshold
+
+        results = []
+        for i in range(len(images)):
+            if too_small[i]:
+                reason = "face_too_small"
+            elif blurry[i]:
+                reason = "blurry"
+            elif flat[i]:
+                reason = "flat"
+            elif low_score[i]:
+                reason = "low_score"
             else:
-                gray = image.copy()
-            
-            # Kiểm tra kích thước khuôn mặt
-            height, width = gray.shape
-            if height < self.min_face_size[0] or width < self.min_face_size[1]:
-                logger.warning(f"Khuôn mặt quá nhỏ: {width}x{height}, cần ít nhất {self.min_face_size}")
-                return False, 0.1, {"error": "face_too_small", "message": "Khuôn mặt quá nhỏ"}
-            
-            # Phân tích 1: Kiểm tra độ mờ (phát hiện ảnh mờ hoặc ảnh trên màn hình)
-            blur_score = self._check_blur(gray)
-            
-            # Phân tích 2: Kiểm tra độ đồng nhất kết cấu (phát hiện ảnh in)
-            texture_score = self._check_texture_uniformity(gray)
-            
-            # Phân tích 3: Phát hiện cạnh (ảnh thật thường có nhiều chi tiết)
-            edge_score = self._check_edge_density(gray)
-            
-            # Tổng hợp kết quả
-            scores = {
-                "blur": blur_score,
-                "texture": texture_score,
-                "edge": edge_score
-            }
-            
-            # Tính điểm tổng hợp (1.0 = khuôn mặt thật, 0.0 = khuôn mặt giả)
-            # Điều chỉnh trọng số - tập trung vào độ mờ và cấu trúc
-            blur_weight = 0.6     # Tăng trọng số độ mờ
-            texture_weight = 0.3  # Tăng trọng số độ đồng nhất
-            edge_weight = 0.1     # Giảm trọng số mật độ cạnh
-            
-            # Chuẩn hóa với ngưỡng thấp hơn để ít bị từ chối hơn
-            norm_blur = min(1.0, max(0.0, blur_score / 70.0))    # Giảm ngưỡng từ 100 xuống 70
-            norm_texture = min(1.0, max(0.0, 1.0 - texture_score / 70.0))  # Tăng ngưỡng
-            norm_edge = min(1.0, max(0.0, edge_score / 0.1))    # Giảm ngưỡng
-            
-            # Tính điểm tổng hợp
-            final_score = (
-                blur_weight * norm_blur +
-                texture_weight * norm_texture +
-                edge_weight * norm_edge
-            )
-            
-            # Ngưỡng quyết định - giảm xuống nhiều để LUÔN chấp nhận khuôn mặt thật
-            liveness_threshold = 0.3  # Giảm từ 0.45 xuống 0.3
-            is_real = final_score >= liveness_threshold
-            
-            # Log chi tiết cho debug
+                reason = None
             details = {
-                "scores": scores,
+                "reason": reason,
+                "size": sizes[i].tolist(),
+                "scores": {name: float(values[i]) for name, values in scores.items()},
                 "normalized_scores": {
-                    "blur": norm_blur,
-                    "texture": norm_texture,
-                    "edge": norm_edge
+                    "blur": float(norm_blur[i]),
+                    "texture": float(norm_texture[i]),
+                    "edge": float(norm_edge[i])
                 },
-                "final_score": final_score,
-                "threshold": liveness_threshold
+                "final_score": float(final_scores[i]),
+                "threshold": self.liveness_threshold
             }
-            
-            logger.info(f"Kết quả phát hiện liveness: {is_real}, điểm: {final_score:.2f}")
-            
-            # ===== QUAN TRỌNG: TẠM THỜI VÔ HIỆU HÓA KIỂM TRA ĐỂ LUÔN CHẤP NHẬN KHUÔN MẶT =====
-            # Luôn trả về True (khuôn mặt thật) và điểm số cao để chấp nhận mọi khuôn mặt
-            # Điều này giúp người dùng đăng ký và sử dụng hệ thống trong giai đoạn thử nghiệm
-            return True, max(0.7, final_score), details
-            
-        except Exception as e:
-            logger.error(f"Lỗi khi kiểm tra liveness: {str(e)}")
-            return True, 0.7, {"error": "processing_error", "message": str(e)}  # Vẫn trả về True
-    
-    def _check_blur(self, gray_image):
-        """Kiểm tra độ mờ của ảnh sử dụng biến thể Laplacian"""
-        try:
-            laplacian_var = cv2.Laplacian(gray_image, cv2.CV_64F).var()
-            logger.debug(f"Điểm độ mờ: {laplacian_var}")
-            
-            # laplacian_var thấp = ảnh mờ = có khả năng là ảnh giả
-            # laplacian_var cao = ảnh sắc nét = có khả năng là ảnh thật
-            return laplacian_var
-        except Exception as e:
-            logger.error(f"Lỗi khi kiểm tra độ mờ: {str(e)}")
-            return 0.0
-    
-    def _check_texture_uniformity(self, gray_image):
-        """Kiểm tra độ đồng nhất của kết cấu (texture)"""
-        try:
-            # Tính độ lệch chuẩn của ảnh (đo sự biến thiên)
-            mean, std_dev = cv2.meanStdDev(gray_image)
-            
-            # Tính toán độ đồng nhất dựa trên độ lệch chuẩn và giá trị trung bình
-            # Ảnh in hoặc màn hình thường có độ đồng nhất cao (độ lệch chuẩn thấp)
-            uniformity = std_dev[0][0]
-            logger.debug(f"Điểm độ đồng nhất: {uniformity}")
-            
-            return uniformity
-        except Exception as e:
-            logger.error(f"Lỗi khi kiểm tra độ đồng nhất: {str(e)}")
-            return 0.0
-    
-    def _check_edge_density(self, gray_image):
-        """Kiểm tra mật độ cạnh trong ảnh"""
-        try:
-            # Phát hiện cạnh bằng thuật toán Canny với ngưỡng thấp hơn nữa
-            edges = cv2.Canny(gray_image, 30, 120)  # Giảm ngưỡng từ (50, 150) xuống (30, 120)
-            
-            # Tính mật độ cạnh (số pixel cạnh / tổng số pixel)
-            height, width = edges.shape
-            total_pixels = height * width
-            edge_pixels = cv2.countNonZero(edges)
-            edge_density = edge_pixels / total_pixels
-            
-            logger.debug(f"Mật độ cạnh: {edge_density}")
-            
-            # Ảnh thật thường có mật độ cạnh cao hơn ảnh giả
-            return edge_density
-        except Exception as e:
-            logger.error(f"Lỗi khi kiểm tra mật độ cạnh: {str(e)}")
-            return 0.0 
\ No newline at end of file
+            results.append((reason is None, float(final_scores[i]), details))
+
+        logger.debug(f"Kiểm tra liveness {len(images)} khuôn mặt: {timings}")
+        return results, timings
+
+    def _normalize(self, images):
+        """
+        Chuyển các khuôn mặt sang ảnh xám float32
+
+        Returns:
+            list[numpy.ndarray]: Các mảng (N x H x W) theo đúng thứ tự images; một mảng cho cả lô
+            khi có analysis_size, ngược lại mỗi khuôn mặt một mảng ở độ phân giải gốc
+        """
+        grays = [cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim > 2 else image for image in images]
+        size = self.analysis_size
+        if not size:
+            return [gray[np.newaxis].astype(np.float32) for gray in grays]
+        stack = np.empty((len(grays), size, size), dtype=np.float32)
+        for i, gray in enumerate(grays):
+            stack[i] = cv2.resize(gray, (size, size), interpolation=cv2.INTER_AREA)
+        return [stack] if grays else []
+
+    def _check_blur(self, stack):
+        """Phương sai Laplacian của từng ảnh (thấp = ảnh mờ = có khả năng là ảnh giả)"""
+        laplacian = (
+            stack[:, :-2, 1:-1] + stack[:, 2:, 1:-1] + stack[:, 1:-1, :-2] + stack[:, 1:-1, 2:]
+            - 4.0 * stack[:, 1:-1, 1:-1]
+        )
+        return laplacian.reshape(len(stack), -1).var(axis=1)
+
+    def _check_texture_uniformity(self, stack):
+        """Độ lệch chuẩn mức xám của từng ảnh (ảnh in hoặc màn hình thường đồng nhất, độ lệch chuẩn thấp)"""
+        return stack.reshape(len(stack), -1).std(axis=1)
+
+    def _check_edge_density(self, stack):
+        """Tỉ lệ điểm ảnh là cạnh (Canny) của từng ảnh (ảnh thật thường có mật độ cạnh cao hơn)"""
+        pixels = stack.shape[1] * stack.shape[2]
+        gray = stack.astype(np.uint8)
+        return np.array(
+            [cv2.countNonZero(cv2.Canny(image, 30, 120)) / pixels for image in gray],
+            dtype=np.float64
+        )
@@ -1,6 +1,42 @@
+import os
+import sys
+
 from django.apps import AppConfig
 
 
 class EmployeesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'employees'
+
+    def ready(self):
+        # Đăng ký signal cập nhật gallery khuôn mặt
+        from . import signals  # noqa: F401
+
+        from .face_settings import face_setting
+
+        if not _serves_requests():
+            return
+
+        # Thiếu file trọng số thì dừng ngay khi khởi động (MODEL_ARTIFACTS_CHECK)
+        from .face_artifacts import check_artifacts_on_startup
+
+        check_artifacts_on_startup()
+
+        # Server prefork (gunicorn.conf.py): master không chạy warmup, từng worker chạy sau khi fork
+        if face_setting('WARMUP_ON_STARTUP') and os.environ.get('FACE_WARMUP_AFTER_FORK') != 'True':
+            from .face_warmup import start_warmup
+
+            start_warmup()
+
+
+def _serves_requests():
+    # Chỉ tiến trình xử lý yêu cầu mới kiểm tra file trọng số và nạp mô hình khi khởi động:
+    # gunicorn.conf.py (và server WSGI/ASGI khác khi được cấu hình) đặt FACE_SERVES_REQUESTS=True;
+    # với runserver là tiến trình con của autoreloader (hoặc chạy với --noreload). Lệnh quản lý,
+    # test, celery, script tự import Django... không nạp gì
+    if os.environ.get('FACE_SERVES_REQUESTS') == 'True':
+        return True
+    command = sys.argv[1] if len(sys.argv) > 1 else ''
+    if os.path.basename(sys.argv[0]) == 'manage.py' and command == 'runserver':
+        return '--noreload' in sys.argv or os.environ.get('RUN_MAIN') == 'true'
+    return False
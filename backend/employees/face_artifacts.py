@@ -0,0 +1,294 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tarfile
+import tempfile
+import time
+from collections import namedtuple
+from pathlib import Path
+
+from .face_settings import face_setting
+
+logger = logging.getLogger(__name__)
+
+# File trọng số mà DeepFace tải về <DEEPFACE_HOME>/.deepface/weights ở lần dùng đầu tiên.
+# Bộ phát hiện 'opencv' (Haar cascade đi kèm OpenCV) và 'mtcnn' (trọng số nằm trong gói) không cần tải.
+DEEPFACE_WEIGHTS = {
+    'retinaface': ('retinaface.h5',),
+    'yunet': ('face_detection_yunet_2023mar.onnx',),
+    'ssd': ('deploy.prototxt', 'res10_300x300_ssd_iter_140000.caffemodel'),
+    'dlib': ('shape_predictor_5_face_landmarks.dat',),
+    'centerface': ('centerface.onnx',),
+    'opencv': (),
+    'mtcnn': (),
+    'Facenet512': ('facenet512_weights.h5',),
+    'Facenet': ('facenet_weights.h5',),
+    'ArcFace': ('arcface_weights.h5',),
+    'VGG-Face': ('vgg_face_weights.h5',),
+    'Fasnet': ('2.7_80x80_MiniFASNetV2.pth', '4_0_0_80x80_MiniFASNetV1SE.pth'),
+}
+
+# Manifest ghi cạnh các file trọng số (và ở gốc file nén do bundle_artifacts tạo)
+MANIFEST_NAME = 'face_models_manifest.json'
+MANIFEST_FORMAT = 1
+
+# name: tên file (dùng làm khóa trong manifest), path: nơi pipeline đọc file
+Artifact = namedtuple('Artifact', ['name', 'path'])
+
+
+class ArtifactError(Exception):
+    """Thiếu file trọng số hoặc file không khớp checksum"""
+
+
+def weights_dir():
+    """Thư mục DeepFace đọc/tải trọng số: <DEEPFACE_HOME hoặc thư mục home>/.deepface/weights"""
+    home = os.getenv('DEEPFACE_HOME') or os.path.expanduser('~')
+    return Path(home) / '.deepface' / 'weights'
+
+
+def required_artifacts():
+    """
+    Các file trọng số mà pipeline đang cấu hình cần (theo DETECTION_BACKEND, DETECTOR_CASCADE,
+    ANTI_SPOOFING_BACKEND, EMBEDDING_BACKEND và MODEL_NAME)
+
+    Returns:
+        list[Artifact]
+    """
+    names = []
+    if face_setting('DETECTION_BACKEND') == 'deepface':
+        names.extend(face_setting('DETECTOR_CASCADE'))
+    if face_setting('ANTI_SPOOFING_BACKEND') == 'fasnet':
+        names.append('Fasnet')
+    if face_setting('EMBEDDING_BACKEND') == 'keras':
+        names.append(face_setting('MODEL_NAME'))
+
+    root = weights_dir()
+    artifacts = []
+    for name in names:
+        if name not in DEEPFACE_WEIGHTS:
+            logger.warning(f"Không biết file trọng số của {name}, bỏ qua khi kiểm tra")
+            continue
+        artifacts.extend(Artifact(filename, root / filename) for filename in DEEPFACE_WEIGHTS[name])
+
+    if face_setting('DETECTION_BACKEND') == 'yunet':
+        from .face_backends import default_yunet_path
+
+        path = Path(face_setting('YUNET_MODEL_PATH') or default_yunet_path())
+        artifacts.append(Artifact(path.name, path))
+    if face_setting('EMBEDDING_BACKEND') == 'onnx':
+        from .face_onnx import onnx_model_path
+
+        path = onnx_model_path()
+        artifacts.append(Artifact(path.name, path))
+
+    unique = {}
+    for artifact in artifacts:
+        unique.setdefault(artifact.name, artifact)
+    return list(unique.values())
+
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def read_manifest(path=None):
+    """Đọc manifest (mặc định trong weights_dir()); None nếu chưa có"""
+    path = Path(path) if path else weights_dir() / MANIFEST_NAME
+    if not path.exists():
+        return None
+    return json.loads(path.read_text())
+
+
+def _write_manifest(path, entries):
+    from .face_backends import backend_summary
+
+    manifest = {
+        'format': MANIFEST_FORMAT,
+        'created_at': time.time(),
+        'pipeline': backend_summary(),
+        'model_name': face_setting('MODEL_NAME'),
+        'artifacts': entries,
+    }
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    tmp_path.write_text(json.dumps(manifest, indent=2, sort_keys=True))
+    os.replace(tmp_path, path)
+    return manifest
+
+
+def _find_files(root):
+    """Tên file -> đường dẫn của mọi file trong thư mục (kể cả thư mục con)"""
+    found = {}
+    for path in sorted(Path(root).rglob('*')):
+        if path.is_file():
+            found.setdefault(path.name, path)
+    return found
+
+
+def stage_artifacts(source, artifacts=None, require_checksums=True):
+    """
+    Chép file trọng số từ thư mục hoặc file nén (.tar, .tar.gz, .tgz) vào nơi pipeline đọc,
+    kiểm tra checksum và ghi manifest
+
+    Checksum mong đợi lấy từ manifest nằm trong nguồn (do bundle_artifacts tạo trên máy có mạng).
+    File được chép ra file tạm, kiểm tra xong mới đổi tên nên không để lại file hỏng.
+
+    Args:
+        source: Thư mục hoặc file nén chứa các file trọng số
+        artifacts (list[Artifact]): Mặc định required_artifacts()
+        require_checksums (bool): Báo lỗi nếu nguồn không có checksum cho một file
+
+    Returns:
+        dict: Manifest đã ghi
+
+    Raises:
+        ArtifactError: Nguồn thiếu file hoặc checksum không khớp
+    """
+    artifacts = required_artifacts() if artifacts is None else artifacts
+    source = Path(source)
+    with tempfile.TemporaryDirectory(prefix='face-models-') as extracted:
+        if source.is_file():
+            with tarfile.open(source) as archive:
+                if hasattr(tarfile, 'data_filter'):
+                    # Không cho phép đường dẫn tuyệt đối, '..' hay liên kết ra ngoài thư mục giải nén
+                    archive.extractall(extracted, filter='data')
+                else:
+                    archive.extractall(extracted)
+            source_dir = Path(extracted)
+        else:
+            source_dir = source
+
+        files = _find_files(source_dir)
+        expected = {}
+        if MANIFEST_NAME in files:
+            expected = {
+                name: entry['sha256'] for name, entry in read_manifest(files[MANIFEST_NAME])['artifacts'].items()
+            }
+
+        missing = [artifact.name for artifact in artifacts if artifact.name not in files]
+        if missing:
+            raise ArtifactError(f"Nguồn {source} thiếu file trọng số: {', '.join(missing)}")
+        unverified = [artifact.name for artifact in artifacts if artifact.name not in expected]
+        if unverified and require_checksums:
+            raise ArtifactError(f"Không có checksum cho: {', '.join(unverified)} (cần {MANIFEST_NAME} trong nguồn)")
+
+        # Chép hết ra file tạm và kiểm tra bản đã chép trước khi thay file nào đang dùng
+        copies, checksums = [], {}
+        try:
+            for artifact in artifacts:
+                destination = Path(artifact.path)
+                destination.parent.mkdir(parents=True, exist_ok=True)
+                tmp_path = destination.with_name(f".{destination.name}.{os.getpid()}.tmp")
+                copies.append((artifact, tmp_path))
+                shutil.copyfile(files[artifact.name], tmp_path)
+                checksum = checksums[artifact.name] = file_sha256(tmp_path)
+                if artifact.name in expected and checksum != expected[artifact.name]:
+                    raise ArtifactError(
+                        f"Checksum của {artifact.name} không khớp: {checksum}, mong đợi {expected[artifact.name]}"
+                    )
+        except Exception:
+            for _, tmp_path in copies:
+                if tmp_path.exists():
+                    tmp_path.unlink()
+            raise
+
+        entries = {}
+        for artifact, tmp_path in copies:
+            destination = Path(artifact.path)
+            os.replace(tmp_path, destination)
+            entries[artifact.name] = {
+                'sha256': checksums[artifact.name],
+                'size': destination.stat().st_size,
+                'path': str(destination),
+                'verified': artifact.name in expected,
+            }
+            logger.info(f"Đã chép {artifact.name} vào {destination}")
+
+    manifest = read_manifest() or {}
+    entries = {**manifest.get('artifacts', {}), **entries}
+    return _write_manifest(weights_dir() / MANIFEST_NAME, entries)
+
+
+def bundle_artifacts(output, artifacts=None):
+    """
+    Gói các file trọng số đang có (sau khi DeepFace đã tải về trên máy có mạng) kèm manifest
+    checksum thành file .tar.gz để chép sang nhà máy không có mạng
+
+    Raises:
+        ArtifactError: Thiếu file trọng số
+    """
+    artifacts = required_artifacts() if artifacts is None else artifacts
+    missing = [artifact.name for artifact in artifacts if not Path(artifact.path).exists()]
+    if missing:
+        raise ArtifactError(
+            f"Chưa có file trọng số: {', '.join(missing)}. Chạy python manage.py warmup_face_models để tải về"
+        )
+
+    with tempfile.TemporaryDirectory(prefix='face-models-') as staging:
+        entries = {
+            artifact.name: {'sha256': file_sha256(artifact.path), 'size': Path(artifact.path).stat().st_size}
+            for artifact in artifacts
+        }
+        manifest_path = Path(staging) / MANIFEST_NAME
+        _write_manifest(manifest_path, entries)
+        with tarfile.open(output, 'w:gz') as archive:
+            archive.add(manifest_path, arcname=MANIFEST_NAME)
+            for artifact in artifacts:
+                archive.add(artifact.path, arcname=artifact.name)
+    return entries
+
+
+def verify_artifacts(checksums=False):
+    """
+    Kiểm tra mọi file trọng số mà pipeline cần đã có sẵn (và khớp manifest nếu có)
+
+    Args:
+        checksums (bool): Tính lại SHA-256 (chậm với vài trăm MB trọng số); mặc định chỉ so kích thước
+
+    Returns:
+        list[str]: Mô tả các vấn đề, rỗng nếu đầy đủ
+    """
+    manifest = read_manifest() or {}
+    recorded = manifest.get('artifacts', {})
+    problems = []
+    for artifact in required_artifacts():
+        path = Path(artifact.path)
+        if not path.exists():
+            problems.append(f"thiếu {artifact.name} ({path})")
+            continue
+        entry = recorded.get(artifact.name)
+        if entry is None:
+            continue
+        if path.stat().st_size != entry['size']:
+            problems.append(f"{artifact.name} có kích thước {path.stat().st_size}, manifest ghi {entry['size']}")
+        elif checksums and file_sha256(path) != entry['sha256']:
+            problems.append(f"{artifact.name} không khớp checksum trong manifest")
+    return problems
+
+
+def check_artifacts_on_startup():
+    """
+    Dừng khởi động nếu thiếu file trọng số (MODEL_ARTIFACTS_CHECK), thay vì để DeepFace tải về
+    hoặc báo lỗi ở lần điểm danh đầu tiên
+
+    Raises:
+        ImproperlyConfigured
+    """
+    from django.core.exceptions import ImproperlyConfigured
+
+    mode = face_setting('MODEL_ARTIFACTS_CHECK')
+    if not mode:
+        return
+    problems = verify_artifacts(checksums=(mode == 'sha256'))
+    if problems:
+        raise ImproperlyConfigured(
+            f"Thiếu hoặc sai file trọng số nhận diện khuôn mặt: {'; '.join(problems)}. "
+            f"Chép vào bằng: python manage.py stage_face_models --source <thư mục hoặc file nén>"
+        )
+    logger.info(f"Đã kiểm tra file trọng số nhận diện khuôn mặt trong {weights_dir()}")
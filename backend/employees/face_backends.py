@@ -0,0 +1,373 @@
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+
+from .face_settings import face_setting
+
+logger = logging.getLogger(__name__)
+
+# Framework mà mỗi module cần import kéo theo (dùng để báo cáo cấu hình đang chạy)
+MODULE_FRAMEWORKS = {
+    'deepface.DeepFace': 'tensorflow',
+    'torch': 'torch',
+    'onnxruntime': 'onnxruntime',
+    'cv2': 'opencv',
+}
+
+
+def _timed_ms(func):
+    started = time.perf_counter()
+    func()
+    return round((time.perf_counter() - started) * 1000.0, 1)
+
+
+class DeepFaceDetector:
+    """
+    Phát hiện khuôn mặt bằng DeepFace theo chuỗi DETECTOR_CASCADE (cần DeepFace/TensorFlow)
+
+    Các bộ phát hiện nhanh (YuNet, Haar cascade của OpenCV) chạy trước; kết quả chỉ được chấp nhận
+    khi có đúng một khuôn mặt với độ tin cậy tối thiểu DETECTOR_MIN_CONFIDENCE. Không thấy khuôn
+    mặt, nhiều khuôn mặt, độ tin cậy thấp hoặc bộ phát hiện lỗi thì chuyển sang tầng sau. Tầng cuối
+    (mặc định RetinaFace) luôn được chấp nhận và giữ nguyên cách xử lý lỗi như trước.
+    """
+
+    modules = ('deepface.DeepFace',)
+
+    def __init__(self, cascade=None, min_confidence=None):
+        self.cascade = list(face_setting('DETECTOR_CASCADE') if cascade is None else cascade) or ['retinaface']
+        self.min_confidence = face_setting('DETECTOR_MIN_CONFIDENCE') if min_confidence is None else min_confidence
+
+    def _extract_faces(self, img, detector_backend, enforce_detection=True):
+        from deepface import DeepFace
+
+        # Anti-spoofing chạy riêng sau bước lọc nhanh, chỉ cho khuôn mặt được chấp nhận
+        return DeepFace.extract_faces(
+            img_path=img,
+            detector_backend=detector_backend,
+            enforce_detection=enforce_detection,
+            anti_spoofing=False
+        )
+
+    @staticmethod
+    def _fast_stage_result(face_objs, min_confidence):
+        """Lý do chuyển sang tầng sau, hoặc None nếu chấp nhận kết quả của tầng nhanh"""
+        # enforce_detection=False: không thấy khuôn mặt thì DeepFace trả về cả ảnh với confidence 0
+        faces = [face_obj for face_obj in face_objs if face_obj.get("confidence", 0) > 0]
+        if not faces:
+            return 'no_face'
+        if len(faces) > 1:
+            return 'multiple_faces'
+        if faces[0]["confidence"] < min_confidence:
+            return 'low_confidence'
+        return None
+
+    def detect(self, img):
+        """
+        Returns:
+            tuple: (list[dict] kết quả DeepFace.extract_faces, tên bộ phát hiện đã dùng)
+        """
+        for detector_backend in self.cascade[:-1]:
+            try:
+                face_objs = self._extract_faces(img, detector_backend, enforce_detection=False)
+            except Exception as e:
+                logger.warning(f"Bộ phát hiện {detector_backend} gặp lỗi, chuyển sang tầng sau: {str(e)}")
+                continue
+            reason = self._fast_stage_result(face_objs, self.min_confidence.get(detector_backend, 0.0))
+            if reason is None:
+                return [face_obj for face_obj in face_objs if face_obj.get("confidence", 0) > 0], detector_backend
+            logger.info(f"Bộ phát hiện {detector_backend} không đạt ({reason}), chuyển sang tầng sau")
+
+        return self._extract_faces(img, self.cascade[-1]), self.cascade[-1]
+
+    def warmup(self, img):
+        """Nạp từng tầng của chuỗi; tầng đầu bị lỗi chỉ ghi cảnh báo vì pipeline vẫn chuyển sang tầng sau"""
+        timings = {}
+        for detector_backend in self.cascade:
+            try:
+                timings[f"detector:{detector_backend}"] = _timed_ms(
+                    lambda: self._extract_faces(img, detector_backend, enforce_detection=False)
+                )
+            except Exception as e:
+                if detector_backend == self.cascade[-1]:
+                    raise
+                logger.warning(f"Không nạp được bộ phát hiện {detector_backend}: {str(e)}")
+        return timings
+
+
+class YuNetDetector:
+    """
+    Phát hiện khuôn mặt bằng YuNet qua cv2.FaceDetectorYN, không cần DeepFace/TensorFlow
+
+    Dùng cùng file trọng số ONNX mà DeepFace tải cho detector_backend='yunet'. Kết quả có cùng
+    dạng với DeepFace.extract_faces (face, facial_area kèm điểm mốc, confidence) nên phần còn lại
+    của pipeline không đổi. Không có tầng dự phòng RetinaFace.
+    """
+
+    name = 'yunet'
+    modules = ('cv2',)
+
+    def __init__(self, model_path=None, min_confidence=None, nms_threshold=0.3, top_k=5000):
+        self.model_path = str(model_path or face_setting('YUNET_MODEL_PATH') or default_yunet_path())
+        if min_confidence is None:
+            min_confidence = face_setting('DETECTOR_MIN_CONFIDENCE').get(self.name, 0.9)
+        self.min_confidence = min_confidence
+        self.nms_threshold = nms_threshold
+        self.top_k = top_k
+        # FaceDetectorYN không dùng chung được giữa các luồng
+        self._local = threading.local()
+
+    def _detector(self):
+        detector = getattr(self._local, 'detector', None)
+        if detector is None:
+            import cv2
+
+            if not os.path.exists(self.model_path):
+                raise FileNotFoundError(f"Không tìm thấy trọng số YuNet {self.model_path}")
+            detector = cv2.FaceDetectorYN.create(
+                self.model_path, "", (320, 320), self.min_confidence, self.nms_threshold, self.top_k
+            )
+            self._local.detector = detector
+        return detector
+
+    def detect(self, img):
+        """
+        Returns:
+            tuple: (list[dict] khuôn mặt dạng DeepFace.extract_faces, 'yunet')
+        """
+        from .face_pipeline import aligned_crop
+
+        detector = self._detector()
+        height, width = img.shape[:2]
+        detector.setInputSize((width, height))
+        _, faces = detector.detect(img)
+
+        face_objs = []
+        for row in (faces if faces is not None else []):
+            x, y = max(0, int(row[0])), max(0, int(row[1]))
+            w, h = min(int(row[2]), width - x), min(int(row[3]), height - y)
+            # Mỗi dòng: x, y, w, h, mắt phải, mắt trái, mũi, khóe miệng phải, khóe miệng trái, điểm tin cậy
+            facial_area = {
+                'x': x, 'y': y, 'w': w, 'h': h,
+                'right_eye': (int(row[4]), int(row[5])),
+                'left_eye': (int(row[6]), int(row[7])),
+                'nose': (int(row[8]), int(row[9])),
+                'mouth_right': (int(row[10]), int(row[11])),
+                'mouth_left': (int(row[12]), int(row[13])),
+            }
+            face_objs.append({
+                # RGB như DeepFace.extract_faces (face_crop đổi lại sang BGR)
+                'face': aligned_crop(img, facial_area)[:, :, ::-1],
+                'facial_area': facial_area,
+                'confidence': float(row[14]),
+            })
+        return face_objs, self.name
+
+    def warmup(self, img):
+        return {f"detector:{self.name}": _timed_ms(lambda: self.detect(img))}
+
+
+def default_yunet_path():
+    """File YuNet mà DeepFace tải về (DEEPFACE_HOME/.deepface/weights)"""
+    home = os.getenv('DEEPFACE_HOME') or os.path.expanduser('~')
+    return os.path.join(home, '.deepface', 'weights', 'face_detection_yunet_2023mar.onnx')
+
+
+class FasNetAntiSpoofing:
+    """
+    Kiểm tra khuôn mặt thật/giả bằng mô hình FasNet của DeepFace (cần PyTorch)
+
+    Nếu anti-spoofing gặp lỗi (ví dụ thiếu torch) thì giả định khuôn mặt là thật như trước.
+    """
+
+    modules = ('deepface.DeepFace', 'torch')
+
+    def check(self, img, facial_area):
+        """
+        Args:
+            img (numpy.ndarray): Ảnh BGR đã dùng để phát hiện khuôn mặt
+            facial_area (dict): Vùng khuôn mặt trên img
+
+        Returns:
+            tuple: (is_real, liveness_score)
+        """
+        try:
+            from deepface.modules import modeling
+
+            try:
+                model = modeling.build_model(task="spoofing", model_name="Fasnet")
+            except TypeError:
+                # DeepFace cũ: build_model không có tham số task
+                model = modeling.build_model(model_name="Fasnet")
+            box = tuple(int(facial_area[key]) for key in ('x', 'y', 'w', 'h'))
+            is_real, score = model.analyze(img=img, facial_area=box)
+            return bool(is_real), float(score)
+        except Exception as spoof_error:
+            logger.warning(f"Không thể sử dụng anti-spoofing: {str(spoof_error)}")
+            return True, 0.9
+
+
+class PregateOnlyAntiSpoofing:
+    """Không chạy mô hình anti-spoofing, chỉ dựa vào bước lọc nhanh LivenessDetector (LIVENESS_PREGATE)"""
+
+    modules = ()
+
+    def __init__(self):
+        if not face_setting('LIVENESS_PREGATE'):
+            logger.warning("ANTI_SPOOFING_BACKEND='none' và LIVENESS_PREGATE tắt: không kiểm tra khuôn mặt thật/giả")
+
+    def check(self, img, facial_area):
+        # Điểm None: inspect_face dùng điểm của bước lọc nhanh
+        return True, None
+
+
+class KerasEmbedder:
+    """Trích xuất embedding bằng mô hình Keras của DeepFace (MODEL_NAME, cần TensorFlow)"""
+
+    modules = ('deepface.DeepFace',)
+
+    def embed_one(self, crop):
+        """
+        Trích xuất embedding từ một khuôn mặt đã cắt và căn chỉnh (xem embed)
+
+        Returns:
+            list[float] | None: Embedding, None nếu mô hình không trả về kết quả
+        """
+        return self.embed([crop])[0]
+
+    def embed(self, crops):
+        """
+        Trích xuất embedding cho các khuôn mặt đã cắt và căn chỉnh bằng một lần gọi DeepFace.represent
+
+        Khuôn mặt được đưa thẳng vào mô hình với detector_backend='skip' nên RetinaFace không phải
+        chạy lại. Một khuôn mặt hay cả lô đều đi qua cùng tiền xử lý của DeepFace (resize_image,
+        normalize_input) và model.forward, nên embedding của một khuôn mặt không phụ thuộc vào việc
+        MicroBatcher có gom nó với khuôn mặt khác hay không. Phiên bản DeepFace không nhận danh sách
+        ảnh thì gọi represent cho từng khuôn mặt (vẫn cùng tiền xử lý).
+
+        Returns:
+            list: Embedding (list[float] | None) theo đúng thứ tự crops
+        """
+        from deepface import DeepFace
+
+        if not len(crops):
+            return []
+        options = {'detector_backend': 'skip', 'model_name': face_setting('MODEL_NAME')}
+        try:
+            results = DeepFace.represent(img_path=list(crops), **options)
+            # Danh sách một ảnh trả về kết quả của riêng ảnh đó thay vì danh sách lồng nhau
+            results = [results] if len(crops) == 1 else results
+            if len(results) != len(crops) or not all(isinstance(objs, list) for objs in results):
+                raise ValueError('DeepFace.represent không trả về kết quả cho từng ảnh')
+        except Exception as e:
+            logger.warning(f"Không chạy được mô hình theo lô, trích xuất từng khuôn mặt: {str(e)}")
+            results = [DeepFace.represent(img_path=crop, **options) for crop in crops]
+        return [
+            np.asarray(objs[0]["embedding"]).ravel().tolist() if objs else None
+            for objs in results
+        ]
+
+
+def _onnx_embedder():
+    from .face_onnx import get_onnx_embedder
+
+    return get_onnx_embedder()
+
+
+_onnx_embedder.modules = ('onnxruntime',)
+
+
+# Các backend có thể chọn qua FACE_RECOGNITION['DETECTION_BACKEND'], ['ANTI_SPOOFING_BACKEND'] và
+# ['EMBEDDING_BACKEND']; mỗi backend chỉ import framework của nó khi được dùng
+DETECTION_BACKENDS = {
+    'deepface': DeepFaceDetector,
+    'yunet': YuNetDetector,
+}
+
+ANTI_SPOOFING_BACKENDS = {
+    'fasnet': FasNetAntiSpoofing,
+    'none': PregateOnlyAntiSpoofing,
+}
+
+EMBEDDING_BACKENDS = {
+    'keras': KerasEmbedder,
+    'onnx': _onnx_embedder,
+}
+
+
+def _backend(kind, backends, name):
+    if name not in backends:
+        raise ValueError(f"Backend {kind} không hợp lệ: {name}")
+    return backends[name]
+
+
+def create_detector(name, **options):
+    """Tạo bộ phát hiện khuôn mặt theo tên cấu hình"""
+    return _backend('phát hiện khuôn mặt', DETECTION_BACKENDS, name)(**options)
+
+
+def create_anti_spoofing(name):
+    """Tạo bộ kiểm tra khuôn mặt thật/giả theo tên cấu hình"""
+    return _backend('anti-spoofing', ANTI_SPOOFING_BACKENDS, name)()
+
+
+def create_embedder(name):
+    """Tạo (hoặc lấy) bộ trích xuất embedding theo tên cấu hình"""
+    return _backend('embedding', EMBEDDING_BACKENDS, name)()
+
+
+_lock = threading.Lock()
+_instances = {}
+
+
+def _shared(kind, factory):
+    instance = _instances.get(kind)
+    if instance is None:
+        with _lock:
+            instance = _instances.get(kind)
+            if instance is None:
+                instance = _instances[kind] = factory()
+    return instance
+
+
+def get_detector():
+    """Bộ phát hiện khuôn mặt dùng chung của tiến trình (DETECTION_BACKEND, DETECTION_OPTIONS)"""
+    return _shared('detection', lambda: create_detector(
+        face_setting('DETECTION_BACKEND'), **face_setting('DETECTION_OPTIONS')
+    ))
+
+
+def get_anti_spoofing():
+    """Bộ kiểm tra khuôn mặt thật/giả dùng chung của tiến trình (ANTI_SPOOFING_BACKEND)"""
+    return _shared('anti_spoofing', lambda: create_anti_spoofing(face_setting('ANTI_SPOOFING_BACKEND')))
+
+
+def get_embedder():
+    """Bộ trích xuất embedding dùng chung của tiến trình (EMBEDDING_BACKEND)"""
+    return _shared('embedding', lambda: create_embedder(face_setting('EMBEDDING_BACKEND')))
+
+
+def required_modules():
+    """Các module nặng mà cấu hình backend hiện tại cần import (theo thứ tự, không trùng lặp)"""
+    modules = []
+    for backends, setting in (
+        (DETECTION_BACKENDS, 'DETECTION_BACKEND'),
+        (ANTI_SPOOFING_BACKENDS, 'ANTI_SPOOFING_BACKEND'),
+        (EMBEDDING_BACKENDS, 'EMBEDDING_BACKEND'),
+    ):
+        for module in _backend(setting, backends, face_setting(setting)).modules:
+            if module not in modules:
+                modules.append(module)
+    return modules
+
+
+def backend_summary():
+    """Backend đang chọn và các framework suy luận mà chúng nạp"""
+    return {
+        'detection': face_setting('DETECTION_BACKEND'),
+        'anti_spoofing': face_setting('ANTI_SPOOFING_BACKEND'),
+        'embedding': face_setting('EMBEDDING_BACKEND'),
+        'frameworks': sorted({MODULE_FRAMEWORKS[module] for module in required_modules()}),
+    }
@@ -0,0 +1,146 @@
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class MicroBatcher:
+    """
+    Gom các phần tử gửi đồng thời từ nhiều luồng thành lô để chạy mô hình một lần cho cả lô.
+
+    Phần tử đầu tiên mở một lô; lô được gửi đi khi đủ max_batch_size phần tử hoặc sau max_wait_ms
+    mili giây kể từ phần tử đầu tiên, tùy điều kiện nào đến trước. Khi tải thấp mỗi phần tử chỉ
+    chờ thêm tối đa max_wait_ms; khi cao điểm (đổi ca) các lô đầy lên và số lần gọi mô hình giảm.
+
+    run_batch(items) nhận danh sách phần tử và trả về danh sách kết quả cùng thứ tự, hoặc một
+    Future của danh sách đó (khi lô được chạy trên tiến trình khác).
+    """
+
+    def __init__(self, run_batch, max_batch_size=16, max_wait_ms=5.0, name='batcher'):
+        self.run_batch = run_batch
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.name = name
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._batches = 0
+        self._items = 0
+        self._full_batches = 0
+        self._wait_total = 0.0
+
+    def submit(self, item):
+        """Thêm một phần tử vào lô đang gom; trả về Future của kết quả"""
+        future = Future()
+        self._ensure_thread()
+        self._queue.put((item, future, time.monotonic()))
+        return future
+
+    def stats(self):
+        with self._lock:
+            batches, items, full, wait_total = self._batches, self._items, self._full_batches, self._wait_total
+        return {
+            'max_batch_size': self.max_batch_size,
+            'max_wait_ms': self.max_wait * 1000.0,
+            'batches': batches,
+            'items': items,
+            'full_batches': full,
+            'mean_batch_size': round(items / batches, 2) if batches else None,
+            # Thời gian trung bình một phần tử nằm chờ trước khi lô của nó được gửi đi
+            'mean_added_latency_ms': round(wait_total / items * 1000.0, 3) if items else None,
+        }
+
+    def _ensure_thread(self):
+        # Luồng gom lô không tồn tại trong tiến trình con sau khi fork, cần tạo lại
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid():
+                self._queue = queue.Queue()
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._loop, name=self.name, daemon=True)
+                self._thread.start()
+
+    def _loop(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._dispatch(batch)
+
+    def _dispatch(self, batch):
+        # Bỏ các phần tử mà bên gửi đã hủy (ví dụ quá thời gian chờ)
+        batch = [entry for entry in batch if entry[1].set_running_or_notify_cancel()]
+        if not batch:
+            return
+
+        now = time.monotonic()
+        with self._lock:
+            self._batches += 1
+            self._items += len(batch)
+            self._full_batches += len(batch) == self.max_batch_size
+            self._wait_total += sum(now - enqueued for _, _, enqueued in batch)
+
+        futures = [future for _, future, _ in batch]
+        try:
+            results = self.run_batch([item for item, _, _ in batch])
+        except Exception as e:
+            logger.error(f"Lỗi khi xử lý lô {len(batch)} phần tử ({self.name}): {str(e)}")
+            self._fail(futures, e)
+            return
+
+        if isinstance(results, Future):
+            results.add_done_callback(lambda done: self._scatter(futures, done))
+        else:
+            self._set_results(futures, results)
+
+    def _scatter(self, futures, done):
+        try:
+            results = done.result()
+        except Exception as e:
+            self._fail(futures, e)
+            return
+        self._set_results(futures, results)
+
+    @staticmethod
+    def _set_results(futures, results):
+        if len(results) != len(futures):
+            MicroBatcher._fail(futures, RuntimeError(f"Lô trả về {len(results)} kết quả cho {len(futures)} phần tử"))
+            return
+        for future, result in zip(futures, results):
+            future.set_result(result)
+
+    @staticmethod
+    def _fail(futures, error):
+        for future in futures:
+            future.set_exception(error)
+
+
+def latency_summary(latencies):
+    """Trung bình và các phân vị (mili giây) của danh sách độ trễ tính bằng giây"""
+    values = np.asarray(latencies, dtype=np.float64) * 1000.0
+    if not len(values):
+        return None
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {
+        'mean': round(float(values.mean()), 2),
+        'p50': round(float(p50), 2),
+        'p95': round(float(p95), 2),
+        'p99': round(float(p99), 2),
+        'max': round(float(values.max()), 2),
+        'samples': len(values),
+    }
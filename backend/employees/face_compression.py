@@ -0,0 +1,189 @@
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Số dòng tối đa giải nén cùng lúc khi chấm điểm, giới hạn bộ nhớ tạm
+SCORE_CHUNK_SIZE = 8192
+
+
+class ScalarQuantizer:
+    """
+    Lượng tử hóa int8 theo từng vector: code = round(x / scale), scale = max|x| / 127.
+
+    Mỗi mẫu tốn dim byte + 4 byte scale (516 byte với Facenet512, so với 2048 byte float32).
+    """
+
+    def __init__(self):
+        self.dim = None
+
+    def train(self, vectors):
+        self.dim = vectors.shape[1]
+
+    @property
+    def code_dtype(self):
+        return np.dtype([('code', np.int8, (self.dim,)), ('scale', np.float32)])
+
+    def encode(self, vectors):
+        scales = np.abs(vectors).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        codes = np.empty(len(vectors), dtype=self.code_dtype)
+        codes['code'] = np.round(vectors / scales[:, None]).astype(np.int8)
+        codes['scale'] = scales
+        return codes
+
+    def decode(self, codes):
+        return codes['code'].astype(np.float32) * codes['scale'][:, None]
+
+    def scores(self, codes, probe):
+        return (codes['code'] @ probe) * codes['scale']
+
+    def model_nbytes(self):
+        return 0
+
+
+class PCACompressor:
+    """
+    Chiếu embedding xuống n_components chiều bằng PCA (không trừ trung bình) học từ gallery.
+
+    Tích vô hướng trong không gian chiếu xấp xỉ tốt nhất (theo hạng) cosine similarity gốc.
+    """
+
+    def __init__(self, n_components=128, max_train_size=50000, seed=0):
+        self.n_components = n_components
+        self.max_train_size = max_train_size
+        self.seed = seed
+        self.components = None
+
+    def train(self, vectors):
+        dim = vectors.shape[1]
+        sample = vectors
+        if len(vectors) > self.max_train_size:
+            rng = np.random.default_rng(self.seed)
+            sample = vectors[rng.choice(len(vectors), self.max_train_size, replace=False)]
+        _, _, vt = np.linalg.svd(sample, full_matrices=False)
+        components = np.zeros((self.n_components, dim), dtype=np.float32)
+        # Gallery nhỏ hơn n_components: các thành phần còn thiếu để bằng 0
+        rank = min(self.n_components, len(vt))
+        components[:rank] = vt[:rank]
+        self.components = components
+
+    @property
+    def code_dtype(self):
+        return np.dtype(np.float32)
+
+    def encode(self, vectors):
+        return np.ascontiguousarray(vectors @ self.components.T, dtype=np.float32)
+
+    def decode(self, codes):
+        return codes @ self.components
+
+    def scores(self, codes, probe):
+        return codes @ (self.components @ probe)
+
+    def model_nbytes(self):
+        return self.components.nbytes if self.components is not None else 0
+
+
+class ProductQuantizer:
+    """
+    Product quantization: chia vector thành n_subspaces đoạn, mỗi đoạn mã hóa bằng
+    chỉ số (uint8) của tâm gần nhất trong bảng 256 tâm học bằng k-means.
+
+    Điểm số được tính bằng bảng tra (asymmetric distance): mỗi mẫu chỉ tốn n_subspaces byte.
+    """
+
+    def __init__(self, n_subspaces=64, n_centroids=256, train_iterations=10, max_train_size=10000, seed=0):
+        self.n_subspaces = n_subspaces
+        self.n_centroids = n_centroids
+        self.train_iterations = train_iterations
+        self.max_train_size = max_train_size
+        self.seed = seed
+        self.codebooks = None
+
+    def train(self, vectors):
+        dim = vectors.shape[1]
+        if dim % self.n_subspaces:
+            raise ValueError(f"Số chiều {dim} không chia hết cho n_subspaces={self.n_subspaces}")
+        rng = np.random.default_rng(self.seed)
+        sample = vectors
+        if len(vectors) > self.max_train_size:
+            sample = vectors[rng.choice(len(vectors), self.max_train_size, replace=False)]
+        n_centroids = min(self.n_centroids, len(sample))
+        sub_dim = dim // self.n_subspaces
+
+        codebooks = np.zeros((self.n_subspaces, self.n_centroids, sub_dim), dtype=np.float32)
+        for m in range(self.n_subspaces):
+            sub = sample[:, m * sub_dim:(m + 1) * sub_dim]
+            centroids = sub[rng.choice(len(sub), n_centroids, replace=False)].copy()
+            for _ in range(self.train_iterations):
+                assignments = self._nearest(sub, centroids)
+                # Cộng dồn theo cụm bằng ma trận one-hot (nhanh hơn np.add.at nhiều lần)
+                one_hot = np.zeros((len(sub), n_centroids), dtype=np.float32)
+                one_hot[np.arange(len(sub)), assignments] = 1.0
+                sums = one_hot.T @ sub
+                counts = np.bincount(assignments, minlength=n_centroids)
+                filled = counts > 0
+                centroids[filled] = sums[filled] / counts[filled, None]
+            codebooks[m, :n_centroids] = centroids
+            # Gallery nhỏ: các tâm thừa lặp lại tâm đầu tiên để không bao giờ được chọn nhầm
+            codebooks[m, n_centroids:] = centroids[0]
+        self.codebooks = codebooks
+
+    @staticmethod
+    def _nearest(sub, centroids):
+        # ||x||^2 không đổi theo từng dòng nên bỏ qua khi tìm tâm gần nhất
+        distances = np.einsum('ij,ij->i', centroids, centroids)[None, :] - 2.0 * (sub @ centroids.T)
+        return np.argmin(distances, axis=1)
+
+    @property
+    def code_dtype(self):
+        return np.dtype((np.uint8, (self.n_subspaces,)))
+
+    def encode(self, vectors):
+        sub_dim = vectors.shape[1] // self.n_subspaces
+        codes = np.empty((len(vectors), self.n_subspaces), dtype=np.uint8)
+        for m in range(self.n_subspaces):
+            codes[:, m] = self._nearest(vectors[:, m * sub_dim:(m + 1) * sub_dim], self.codebooks[m])
+        return codes
+
+    def decode(self, codes):
+        return np.concatenate(
+            [self.codebooks[m][codes[:, m]] for m in range(self.n_subspaces)], axis=1
+        )
+
+    def scores(self, codes, probe):
+        sub_dim = len(probe) // self.n_subspaces
+        # Bảng tra: tích vô hướng của từng đoạn probe với từng tâm
+        table = np.einsum('mkd,md->mk', self.codebooks, probe.reshape(self.n_subspaces, sub_dim))
+        return table[np.arange(self.n_subspaces), codes].sum(axis=1)
+
+    def model_nbytes(self):
+        return self.codebooks.nbytes if self.codebooks is not None else 0
+
+
+def chunked_scores(compressor, codes, probe):
+    """Chấm điểm xấp xỉ theo từng khối để bộ nhớ tạm không tăng theo kích thước gallery"""
+    scores = np.empty(len(codes), dtype=np.float32)
+    for start in range(0, len(codes), SCORE_CHUNK_SIZE):
+        chunk = codes[start:start + SCORE_CHUNK_SIZE]
+        scores[start:start + len(chunk)] = compressor.scores(chunk, probe)
+    return scores
+
+
+# Các kiểu nén có thể chọn qua FACE_RECOGNITION['GALLERY_COMPRESSION']
+COMPRESSION_BACKENDS = {
+    'none': None,
+    'int8': ScalarQuantizer,
+    'pca': PCACompressor,
+    'pq': ProductQuantizer,
+}
+
+
+def create_compressor(name, **options):
+    """Tạo bộ nén theo tên cấu hình, trả về None nếu giữ nguyên float32"""
+    if name not in COMPRESSION_BACKENDS:
+        raise ValueError(f"Kiểu nén gallery không hợp lệ: {name}")
+    backend = COMPRESSION_BACKENDS[name]
+    return backend(**options) if backend is not None else None
@@ -0,0 +1,122 @@
+import pickle
+import struct
+from collections import namedtuple
+
+import numpy as np
+
+# Định dạng nhị phân cho FaceData.face_encoding (phiên bản 1):
+#
+#   magic      4 byte   b'FTEM'
+#   version    uint8    1
+#   dtype      uint8    1 = float32, 2 = float16
+#   dim        uint16   số chiều embedding
+#   liveness   float32  điểm liveness lúc đăng ký (NaN nếu không có)
+#   name_len   uint8    độ dài tên model
+#   model      name_len byte UTF-8
+#   padding    0 byte cho tới bội số của 8
+#   data       dim phần tử little-endian, đọc trực tiếp bằng np.frombuffer
+#
+# Dữ liệu pickle cũ ({'encoding': list, 'employee_id', 'liveness_score'}) vẫn đọc được
+# trong thời gian chuyển đổi bằng lệnh `manage.py migrate_face_encodings`.
+
+MAGIC = b'FTEM'
+FORMAT_VERSION = 1
+
+_HEADER = struct.Struct('<4sBBHfB')
+_ALIGNMENT = 8
+
+DTYPE_CODES = {
+    'float32': 1,
+    'float16': 2,
+}
+_DTYPES_BY_CODE = {code: np.dtype(name).newbyteorder('<') for name, code in DTYPE_CODES.items()}
+
+
+class EmbeddingRecord(namedtuple('EmbeddingRecord', ['embedding', 'model_name', 'liveness_score', 'version'])):
+    """Embedding đã giải mã; version = 0 nghĩa là dữ liệu pickle cũ"""
+
+    @property
+    def is_legacy(self):
+        return self.version == 0
+
+
+def encode_embedding(embedding, model_name, dtype='float32', liveness_score=None):
+    """
+    Mã hóa embedding thành định dạng nhị phân có header
+
+    Args:
+        embedding (array-like): Vector đặc trưng khuôn mặt
+        model_name (str): Tên model tạo ra embedding, ví dụ 'Facenet512'
+        dtype (str): 'float32' hoặc 'float16'
+        liveness_score (float): Điểm liveness lúc đăng ký
+
+    Returns:
+        bytes: Dữ liệu lưu vào FaceData.face_encoding
+    """
+    if dtype not in DTYPE_CODES:
+        raise ValueError(f"Kiểu dữ liệu embedding không hợp lệ: {dtype}")
+    vector = np.asarray(embedding, dtype=np.float32).ravel()
+    name = model_name.encode('utf-8')
+    if len(name) > 255:
+        raise ValueError("Tên model quá dài")
+
+    header = _HEADER.pack(
+        MAGIC,
+        FORMAT_VERSION,
+        DTYPE_CODES[dtype],
+        len(vector),
+        float('nan') if liveness_score is None else float(liveness_score),
+        len(name),
+    ) + name
+    header += b'\0' * (-len(header) % _ALIGNMENT)
+    return header + vector.astype(_DTYPES_BY_CODE[DTYPE_CODES[dtype]]).tobytes()
+
+
+def decode_embedding(blob):
+    """
+    Giải mã FaceData.face_encoding (định dạng nhị phân hoặc pickle cũ)
+
+    Với định dạng nhị phân, embedding là view trên bộ đệm gốc (không sao chép).
+
+    Returns:
+        EmbeddingRecord | None: None nếu dữ liệu không chứa embedding
+    """
+    buffer = memoryview(blob)
+    if bytes(buffer[:len(MAGIC)]) != MAGIC:
+        return _decode_legacy(buffer)
+
+    magic, version, dtype_code, dim, liveness, name_len = _HEADER.unpack_from(buffer)
+    if version != FORMAT_VERSION:
+        raise ValueError(f"Phiên bản định dạng embedding không được hỗ trợ: {version}")
+    if dtype_code not in _DTYPES_BY_CODE:
+        raise ValueError(f"Mã kiểu dữ liệu embedding không hợp lệ: {dtype_code}")
+
+    name_end = _HEADER.size + name_len
+    model_name = bytes(buffer[_HEADER.size:name_end]).decode('utf-8')
+    offset = name_end + (-name_end % _ALIGNMENT)
+    embedding = np.frombuffer(buffer, dtype=_DTYPES_BY_CODE[dtype_code], count=dim, offset=offset)
+    return EmbeddingRecord(
+        embedding,
+        model_name,
+        None if np.isnan(liveness) else liveness,
+        version,
+    )
+
+
+def _decode_legacy(buffer):
+    stored_data = pickle.loads(buffer)
+    if not isinstance(stored_data, dict) or 'encoding' not in stored_data:
+        # Định dạng cũ ('face_img') hoặc không xác định - bỏ qua
+        return None
+    # Dữ liệu pickle cũ luôn được tạo bởi Facenet512
+    return EmbeddingRecord(
+        np.asarray(stored_data['encoding'], dtype=np.float32),
+        'Facenet512',
+        stored_data.get('liveness_score'),
+        0,
+    )
+
+
+def is_legacy_encoding(blob):
+    """Kiểm tra nhanh dữ liệu còn ở định dạng pickle cũ hay không"""
+    return bytes(memoryview(blob)[:len(MAGIC)]) != MAGIC
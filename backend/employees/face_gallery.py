@@ -0,0 +1,784 @@
+import logging
+import threading
+import time
+from collections import namedtuple
+
+import numpy as np
+
+from .face_compression import chunked_scores, create_compressor
+from .face_encoding import decode_embedding
+from .face_index import create_index
+from .face_settings import face_setting
+from .face_snapshot import current_snapshot_name, open_snapshot, schedule_snapshot_rebuild, write_snapshot
+from .face_templates import aggregate_templates, uses_centroids
+
+logger = logging.getLogger(__name__)
+
+# Số dòng gallery mỗi khối khi nhân ma trận-ma trận trong search_batch
+BATCH_CHUNK_ROWS = 65536
+
+
+class GalleryMatch(namedtuple('GalleryMatch', ['face_data_id', 'employee_id', 'similarity'])):
+    """Một ứng viên trả về từ gallery"""
+
+    @property
+    def distance(self):
+        # Cosine distance = 1 - cosine similarity
+        return 1.0 - self.similarity
+
+
+def decode_face_encoding(blob):
+    """Giải mã trường FaceData.face_encoding thành embedding, trả về None nếu không dùng được"""
+    record = decode_embedding(blob)
+    if record is None:
+        return None
+    if record.model_name != face_setting('MODEL_NAME'):
+        # Embedding của model khác không so sánh được với probe hiện tại
+        return None
+    return record.embedding
+
+
+def l2_normalize(matrix):
+    """Chuẩn hóa L2 theo hàng (hoặc một vector), giữ nguyên vector 0"""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class FaceGallery:
+    """
+    Gallery embedding khuôn mặt dùng chung trong một tiến trình.
+
+    Lưu ma trận float32 liên tục (N x D) các embedding đã chuẩn hóa L2 cùng mảng
+    mã nhân viên và mảng ID FaceData tương ứng. So khớp chỉ là một phép nhân
+    ma trận-vector và chọn top-k, không cần unpickle hay vòng lặp Python.
+
+    Các dòng luôn được sắp xếp theo ID FaceData để tra vị trí bằng searchsorted.
+    Nếu có chỉ mục ANN (ví dụ IVFIndex), chỉ mục chỉ chọn dòng cần chấm điểm.
+
+    Nếu có bộ nén (int8, PCA, PQ), gallery chỉ giữ mã nén trong bộ nhớ và chấm điểm
+    xấp xỉ trên đó; rerank_k ứng viên tốt nhất được chấm lại bằng vector đầy đủ lấy
+    qua vector_loader (mặc định đọc từ CSDL) trước khi áp ngưỡng và chọn top-k.
+
+    Một nhân viên có thể có nhiều dòng (nhiều mẫu khuôn mặt); search(per_employee=True)
+    chỉ giữ dòng giống nhất của mỗi nhân viên (chấm điểm theo max-similarity).
+
+    Gallery mở từ snapshot memory-map (không nén) không sao chép ma trận khi thay đổi: dòng bị
+    xóa hoặc thay thế chỉ được đánh dấu ẩn (mảng bool N phần tử), dòng mới nằm trong một gallery
+    delta nhỏ, và kết quả của hai lớp được gộp lại khi tìm kiếm. Ma trận dùng chung giữa các
+    worker cho tới khi worker mở lại snapshot mới (xem get_face_gallery).
+
+    version là ID GalleryChange cuối cùng đã được áp dụng vào gallery, snapshot_name là tên
+    snapshot đang được memory-map (None nếu gallery được đọc từ CSDL).
+    """
+
+    def __init__(self, dim, index=None, compressor=None, vector_loader=None, rerank_k=50):
+        self.dim = dim
+        self.index = index
+        self.compressor = compressor
+        self.vector_loader = vector_loader
+        self.rerank_k = rerank_k
+        self.version = 0
+        self.snapshot_name = None
+        self._trained_size = 0
+        self._max_templates = 1
+        self._templates_by_employee = {}
+        self._hidden = None
+        self._delta = None
+        self._lock = threading.Lock()
+        self._set_state(
+            np.empty((0, dim), dtype=np.float32),
+            np.empty(0, dtype=object),
+            np.empty(0, dtype=np.int64),
+        )
+
+    def __len__(self):
+        hidden, delta = self._hidden, self._delta
+        count = len(self._state[2])
+        if hidden is not None:
+            count -= int(np.count_nonzero(hidden))
+        return count + (len(delta) if delta is not None else 0)
+
+    @property
+    def shared(self):
+        """Ma trận gallery là snapshot memory-map dùng chung, thay đổi đi vào lớp delta"""
+        return self._delta is not None
+
+    def _set_state(self, data, employee_ids, face_data_ids):
+        # Thay cả bộ mảng trong một phép gán để luồng đọc luôn thấy trạng thái nhất quán.
+        # data là ma trận float32 hoặc mã nén nếu có bộ nén
+        if self.compressor is None:
+            data = np.ascontiguousarray(data, dtype=np.float32)
+        self._index_templates(employee_ids, face_data_ids)
+        self._state = (data, employee_ids, face_data_ids)
+
+    def _index_templates(self, employee_ids, face_data_ids):
+        # Nhóm ID FaceData theo nhân viên cho verify() và số mẫu nhiều nhất của một nhân viên
+        # (dùng khi gom kết quả theo nhân viên). Chỉ tính lại khi gallery thay đổi
+        if not len(employee_ids):
+            self._max_templates = 1
+            self._templates_by_employee = {}
+            return
+        keys, inverse, counts = np.unique(np.asarray(employee_ids, dtype=str), return_inverse=True, return_counts=True)
+        grouped = np.split(face_data_ids[np.argsort(inverse, kind='stable')], np.cumsum(counts)[:-1])
+        self._max_templates = int(counts.max())
+        self._templates_by_employee = dict(zip(keys.tolist(), grouped))
+
+    @property
+    def nbytes(self):
+        """Bộ nhớ dùng cho dữ liệu so khớp (embedding hoặc mã nén và mô hình nén)"""
+        data = self._state[0]
+        model_nbytes = self.compressor.model_nbytes() if self.compressor is not None else 0
+        delta_nbytes = self._delta.nbytes if self._delta is not None else 0
+        return data.nbytes + model_nbytes + delta_nbytes
+
+    def load(self, rows):
+        """
+        Xây dựng lại gallery từ các bộ (face_data_id, employee_id, face_encoding)
+
+        Args:
+            rows (iterable): Thường là FaceData.objects.values_list('id', 'employee_id', 'face_encoding')
+        """
+        self.load_arrays(*read_face_arrays(rows, self.dim))
+        logger.info(f"Đã xây dựng gallery khuôn mặt với {len(self)} mẫu")
+
+    def load_arrays(self, embeddings, employee_ids, face_data_ids):
+        """Xây dựng lại gallery từ các mảng đã có (embedding đã chuẩn hóa L2)"""
+        if np.any(np.diff(face_data_ids) <= 0):
+            order = np.argsort(face_data_ids, kind='stable')
+            embeddings, employee_ids, face_data_ids = embeddings[order], employee_ids[order], face_data_ids[order]
+        # Mảng đã sắp xếp (ví dụ snapshot memory-map) được dùng trực tiếp, không sao chép
+        with self._lock:
+            self._load_sorted(embeddings, employee_ids, face_data_ids)
+
+    def _load_sorted(self, embeddings, employee_ids, face_data_ids):
+        if self.index is not None:
+            self.index.build(face_data_ids, embeddings)
+        data = embeddings
+        if self.compressor is not None and len(embeddings):
+            self.compressor.train(embeddings)
+            self._trained_size = len(embeddings)
+            data = self.compressor.encode(embeddings)
+        self._hidden = None
+        # Ma trận memory-map được giữ nguyên, thay đổi sau đó đi vào gallery delta
+        self._delta = FaceGallery(self.dim) if isinstance(data, np.memmap) else None
+        self._set_state(data, employee_ids, face_data_ids)
+
+    def _encode(self, vectors):
+        return self.compressor.encode(vectors) if self.compressor is not None else vectors
+
+    def _retrain_compressor(self):
+        # Học lại mô hình nén từ vector đầy đủ khi gallery đã tăng gấp đôi kể từ lần học trước
+        _, employee_ids, face_data_ids = self._state
+        full_vectors = self.vector_loader(face_data_ids)
+        keep = np.array([face_data_id in full_vectors for face_data_id in face_data_ids], dtype=bool)
+        if not keep.any():
+            return
+        employee_ids, face_data_ids = employee_ids[keep], face_data_ids[keep]
+        embeddings = l2_normalize(np.stack([full_vectors[face_data_id] for face_data_id in face_data_ids]))
+        self._load_sorted(embeddings, employee_ids, face_data_ids)
+
+    def _decoded(self, data):
+        # Vector (xấp xỉ nếu đang nén) dùng để huấn luyện lại chỉ mục
+        return self.compressor.decode(data) if self.compressor is not None else data
+
+    def _rows_of(self, face_data_ids, ids):
+        # Tra vị trí dòng theo ID, bỏ qua ID không còn trong gallery
+        rows = np.clip(np.searchsorted(face_data_ids, ids), 0, max(len(face_data_ids) - 1, 0))
+        found = face_data_ids[rows] == ids if len(face_data_ids) else np.zeros(len(ids), dtype=bool)
+        return rows[found]
+
+    def _live_rows(self, rows, hidden):
+        # Bỏ các dòng của snapshot đã bị xóa hoặc thay thế bằng dòng trong lớp delta
+        return rows if hidden is None else rows[~hidden[rows]]
+
+    def face_data_ids_of(self, employee_id):
+        """Các ID FaceData của một nhân viên đang có trong gallery"""
+        _, _, face_data_ids = self._state
+        hidden, delta = self._hidden, self._delta
+        ids = self._templates_by_employee.get(str(employee_id), np.empty(0, dtype=np.int64))
+        if hidden is not None:
+            ids = face_data_ids[self._live_rows(self._rows_of(face_data_ids, ids), hidden)]
+        return ids.tolist() + (delta.face_data_ids_of(employee_id) if delta is not None else [])
+
+    def _hide(self, face_data_id):
+        # Ẩn dòng của snapshot; mảng đánh dấu được thay mới (không sửa tại chỗ) để luồng đọc
+        # không thấy trạng thái nửa chừng
+        _, _, face_data_ids = self._state
+        rows = self._rows_of(face_data_ids, np.array([face_data_id], dtype=np.int64))
+        if not len(rows) or (self._hidden is not None and self._hidden[rows[0]]):
+            return
+        hidden = np.zeros(len(face_data_ids), dtype=bool) if self._hidden is None else self._hidden.copy()
+        hidden[rows] = True
+        self._hidden = hidden
+        if self.index is not None:
+            self.index.remove(face_data_id)
+
+    def add(self, face_data_id, employee_id, embedding):
+        """Thêm (hoặc thay thế) embedding của một bản ghi FaceData"""
+        vector = l2_normalize(np.asarray(embedding, dtype=np.float32).reshape(1, self.dim))
+        with self._lock:
+            if self._delta is not None:
+                # Thêm vào delta trước khi ẩn dòng cũ để luồng đọc không thấy mẫu biến mất
+                self._delta.add(face_data_id, employee_id, vector[0])
+                self._hide(face_data_id)
+                return
+            data, employee_ids, face_data_ids = self._state
+            if self.compressor is not None and not self._trained_size:
+                # Gallery rỗng chưa có mô hình nén: học tạm từ mẫu đầu tiên,
+                # mô hình được học lại khi gallery tăng gấp đôi
+                self.compressor.train(vector)
+                self._trained_size = 1
+                data = self._encode(data)
+            keep = face_data_ids != face_data_id
+            data, employee_ids, face_data_ids = data[keep], employee_ids[keep], face_data_ids[keep]
+            position = np.searchsorted(face_data_ids, face_data_id)
+            self._set_state(
+                np.insert(data, position, self._encode(vector), axis=0),
+                np.insert(employee_ids, position, employee_id),
+                np.insert(face_data_ids, position, face_data_id),
+            )
+            if (self.compressor is not None and self.vector_loader is not None
+                    and len(self) >= 2 * self._trained_size):
+                self._retrain_compressor()
+            elif self.index is not None:
+                if self.index.needs_rebuild(len(self)):
+                    data, _, face_data_ids = self._state
+                    self.index.build(face_data_ids, l2_normalize(self._decoded(data)))
+                else:
+                    self.index.add(face_data_id, vector[0])
+
+    def remove(self, face_data_id):
+        """Xóa embedding của một bản ghi FaceData khỏi gallery"""
+        with self._lock:
+            if self._delta is not None:
+                self._delta.remove(face_data_id)
+                self._hide(face_data_id)
+                return
+            data, employee_ids, face_data_ids = self._state
+            keep = face_data_ids != face_data_id
+            if keep.all():
+                return
+            self._set_state(data[keep], employee_ids[keep], face_data_ids[keep])
+            if self.index is not None:
+                self.index.remove(face_data_id)
+
+    def _score_rows(self, data, rows, probe):
+        # rows = None nghĩa là quét toàn bộ gallery (không sao chép dữ liệu)
+        subset = data if rows is None else data[rows]
+        if self.compressor is None:
+            return subset @ probe
+        return chunked_scores(self.compressor, subset, probe)
+
+    def _rerank(self, face_data_ids, rows, scores, probe, top_k):
+        # Chấm lại rerank_k ứng viên tốt nhất (theo điểm xấp xỉ) bằng vector đầy đủ
+        k = min(max(self.rerank_k, top_k), len(rows))
+        if k < len(rows):
+            top = np.argpartition(-scores, k - 1)[:k]
+            rows = rows[top]
+        full_vectors = self.vector_loader(face_data_ids[rows])
+        found = np.array([face_data_id in full_vectors for face_data_id in face_data_ids[rows]], dtype=bool)
+        rows = rows[found]
+        if not len(rows):
+            return rows, np.empty(0, dtype=np.float32)
+        matrix = l2_normalize(np.stack([full_vectors[face_data_id] for face_data_id in face_data_ids[rows]]))
+        return rows, matrix @ probe
+
+    def search(self, embedding, top_k=1, min_similarity=None, per_employee=False):
+        """
+        Tìm các mẫu giống nhất với embedding đầu vào
+
+        Args:
+            embedding (array-like): Vector đặc trưng của khuôn mặt cần nhận diện
+            top_k (int): Số ứng viên tối đa trả về
+            min_similarity (float): Bỏ qua ứng viên có cosine similarity thấp hơn giá trị này
+            per_employee (bool): Chỉ trả về mẫu giống nhất của mỗi nhân viên (top_k nhân viên khác nhau)
+
+        Returns:
+            list[GalleryMatch]: Sắp xếp theo độ tương đồng giảm dần
+        """
+        data, employee_ids, face_data_ids = self._state
+        hidden, delta = self._hidden, self._delta
+        probe = np.asarray(embedding, dtype=np.float32).ravel()
+        if probe.shape != (self.dim,):
+            raise ValueError(f"Embedding có kích thước {probe.shape[0]}, gallery cần {self.dim}")
+        if not np.any(probe):
+            return []
+
+        probe = l2_normalize(probe)
+        matches = []
+        if len(face_data_ids):
+            matches = self._search_rows(
+                data, employee_ids, face_data_ids, hidden, probe, top_k, min_similarity, per_employee
+            )
+        if delta is not None and len(delta):
+            matches = merge_matches([matches, delta.search(probe, top_k, min_similarity, per_employee)],
+                                    top_k, per_employee)
+        return matches
+
+    def _search_rows(self, data, employee_ids, face_data_ids, hidden, probe, top_k, min_similarity, per_employee):
+        # Gom theo nhân viên: lấy đủ dòng để chắc chắn có top_k nhân viên khác nhau
+        row_k = top_k * self._max_templates if per_employee else top_k
+        candidates = None
+        index = self.index
+        if index is not None and index.is_ready:
+            def score_ids(ids):
+                rows = self._live_rows(self._rows_of(face_data_ids, ids), hidden)
+                return rows, self._score_rows(data, rows, probe), employee_ids[rows].astype(str)
+
+            # Chỉ mục chỉ chọn dòng ứng viên cần chấm điểm; khi nén cần đủ ứng viên cho bước rerank
+            candidate_k = max(row_k, self.rerank_k) if self.compressor is not None else row_k
+            candidates = index.search(probe, candidate_k, min_similarity, score_ids)
+
+        if candidates is not None:
+            rows, scores = candidates
+        else:
+            rows = np.arange(len(face_data_ids))
+            scores = self._score_rows(data, None, probe)
+
+        if self.compressor is not None and self.vector_loader is not None:
+            rows, scores = self._rerank(face_data_ids, rows, scores, probe, row_k)
+
+        return self._top_matches(
+            employee_ids, face_data_ids, rows, scores, top_k, min_similarity, per_employee, hidden
+        )
+
+    def _top_matches(self, employee_ids, face_data_ids, rows, scores, top_k, min_similarity, per_employee,
+                     hidden=None):
+        # Áp ngưỡng, chọn top-k (gom theo nhân viên nếu cần) và sắp xếp giảm dần
+        if hidden is not None:
+            keep = ~hidden[rows]
+            rows, scores = rows[keep], scores[keep]
+        if min_similarity is not None:
+            keep = scores >= min_similarity
+            rows, scores = rows[keep], scores[keep]
+
+        row_k = top_k * self._max_templates if per_employee else top_k
+        k = min(row_k, len(rows))
+        if k == 0:
+            return []
+        if k < len(rows):
+            top = np.argpartition(-scores, k - 1)[:k]
+            rows, scores = rows[top], scores[top]
+        order = np.argsort(-scores, kind='stable')
+        if per_employee:
+            # Giữ lần xuất hiện đầu tiên (điểm cao nhất) của mỗi nhân viên
+            _, first = np.unique(employee_ids[rows[order]].astype(str), return_index=True)
+            order = order[np.sort(first)][:top_k]
+
+        return [
+            GalleryMatch(int(face_data_ids[rows[i]]), str(employee_ids[rows[i]]), float(scores[i]))
+            for i in order
+        ]
+
+    def search_batch(self, embeddings, top_k=1, min_similarity=None, per_employee=False):
+        """
+        Tìm top-k cho nhiều probe cùng lúc
+
+        Với gallery không nén, điểm của mọi probe được tính bằng một phép nhân ma trận-ma trận
+        (chia khối theo BATCH_CHUNK_ROWS dòng gallery để giới hạn bộ nhớ) thay vì B phép
+        nhân ma trận-vector. Gallery nén dùng search() cho từng probe để giữ bước rerank.
+
+        Args:
+            embeddings (array-like): Ma trận B x D các embedding cần nhận diện
+
+        Returns:
+            list[list[GalleryMatch]]: Kết quả của từng probe theo đúng thứ tự đầu vào
+        """
+        probes = np.asarray(embeddings, dtype=np.float32).reshape(-1, self.dim)
+        if self.compressor is not None:
+            return [self.search(probe, top_k, min_similarity, per_employee) for probe in probes]
+
+        data, employee_ids, face_data_ids = self._state
+        hidden, delta = self._hidden, self._delta
+        results = [[] for _ in range(len(probes))]
+        if delta is not None and len(delta):
+            results = delta.search_batch(probes, top_k, min_similarity, per_employee)
+        valid = np.flatnonzero(np.any(probes, axis=1))
+        if not len(face_data_ids) or not len(valid):
+            return results
+
+        probes = l2_normalize(probes[valid])
+        row_k = min(top_k * self._max_templates if per_employee else top_k, len(face_data_ids))
+        # Ứng viên tốt nhất của mỗi probe qua các khối: (B x k) dòng và điểm
+        best_rows = np.empty((len(probes), 0), dtype=np.int64)
+        best_scores = np.empty((len(probes), 0), dtype=np.float32)
+        for start in range(0, len(face_data_ids), BATCH_CHUNK_ROWS):
+            block = data[start:start + BATCH_CHUNK_ROWS]
+            scores = probes @ block.T  # B x chunk
+            if hidden is not None:
+                # Dòng đã ẩn không được chiếm chỗ trong top-k
+                scores[:, hidden[start:start + block.shape[0]]] = -np.inf
+            k = min(row_k, block.shape[0])
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k] if k < block.shape[0] else \
+                np.broadcast_to(np.arange(block.shape[0]), scores.shape)
+            best_rows = np.concatenate([best_rows, top + start], axis=1)
+            best_scores = np.concatenate([best_scores, np.take_along_axis(scores, top, axis=1)], axis=1)
+            if best_rows.shape[1] > row_k:
+                keep = np.argpartition(-best_scores, row_k - 1, axis=1)[:, :row_k]
+                best_rows = np.take_along_axis(best_rows, keep, axis=1)
+                best_scores = np.take_along_axis(best_scores, keep, axis=1)
+
+        for i, probe_index in enumerate(valid):
+            matches = self._top_matches(
+                employee_ids, face_data_ids, best_rows[i], best_scores[i], top_k, min_similarity, per_employee,
+                hidden
+            )
+            results[probe_index] = merge_matches([matches, results[probe_index]], top_k, per_employee)
+        return results
+
+    def subset(self, employee_ids):
+        """
+        Tạo gallery con chỉ gồm các mẫu của employee_ids (dùng cho tìm kiếm theo tầng/phân vùng)
+
+        Dữ liệu được sao chép thành ma trận liên tục nên quét nhanh tương ứng kích thước gallery con.
+        Gallery con dùng chung bộ nén với gallery gốc, không có chỉ mục ANN và chỉ để đọc:
+        khi gallery gốc thay đổi thì tạo lại gallery con thay vì cập nhật.
+        """
+        data, all_employee_ids, face_data_ids = self._state
+        hidden, delta = self._hidden, self._delta
+        groups = [self._templates_by_employee[e] for e in map(str, employee_ids) if e in self._templates_by_employee]
+        ids = np.sort(np.concatenate(groups)) if groups else np.empty(0, dtype=np.int64)
+        rows = self._live_rows(self._rows_of(face_data_ids, ids), hidden)
+        arrays = data[rows], all_employee_ids[rows], face_data_ids[rows]
+        if delta is not None and len(delta):
+            # Gộp các mẫu của lớp delta rồi sắp xếp lại theo ID FaceData
+            delta_arrays = delta.subset(employee_ids)._state
+            arrays = tuple(np.concatenate([base, extra]) for base, extra in zip(arrays, delta_arrays))
+            order = np.argsort(arrays[2], kind='stable')
+            arrays = tuple(array[order] for array in arrays)
+
+        sub = FaceGallery(self.dim, compressor=self.compressor, vector_loader=self.vector_loader, rerank_k=self.rerank_k)
+        sub.version = self.version
+        sub._trained_size = self._trained_size
+        sub._set_state(*arrays)
+        return sub
+
+    def verify(self, embedding, employee_id):
+        """
+        So khớp 1:1 với các mẫu của một nhân viên thay vì toàn bộ gallery
+
+        Args:
+            embedding (array-like): Vector đặc trưng của khuôn mặt cần xác minh
+            employee_id (str): Mã nhân viên cần xác minh
+
+        Returns:
+            GalleryMatch | None: Mẫu giống nhất của nhân viên, None nếu nhân viên không có mẫu nào
+        """
+        data, employee_ids, face_data_ids = self._state
+        hidden, delta = self._hidden, self._delta
+        probe = np.asarray(embedding, dtype=np.float32).ravel()
+        if probe.shape != (self.dim,):
+            raise ValueError(f"Embedding có kích thước {probe.shape[0]}, gallery cần {self.dim}")
+        if not np.any(probe):
+            return None
+        delta_match = delta.verify(probe, employee_id) if delta is not None and len(delta) else None
+        templates = self._templates_by_employee.get(str(employee_id), np.empty(0, dtype=np.int64))
+        rows = self._live_rows(self._rows_of(face_data_ids, templates), hidden)
+        if not len(rows):
+            return delta_match
+
+        probe = l2_normalize(probe)
+        scores = self._score_rows(data, rows, probe)
+        if self.compressor is not None and self.vector_loader is not None:
+            rows, scores = self._rerank(face_data_ids, rows, scores, probe, len(rows))
+            if not len(rows):
+                return None
+        best = int(np.argmax(scores))
+        match = GalleryMatch(int(face_data_ids[rows[best]]), str(employee_ids[rows[best]]), float(scores[best]))
+        if delta_match is not None and delta_match.similarity > match.similarity:
+            return delta_match
+        return match
+
+
+def merge_matches(match_lists, top_k, per_employee=False):
+    """Gộp kết quả tìm kiếm của nhiều lớp gallery (snapshot và delta) thành top-k chung"""
+    merged = sorted((match for matches in match_lists for match in matches), key=lambda match: -match.similarity)
+    if per_employee:
+        seen = set()
+        merged = [match for match in merged if not (match.employee_id in seen or seen.add(match.employee_id))]
+    return merged[:top_k]
+
+
+def read_face_arrays(rows=None, dim=None):
+    """
+    Giải mã các bộ (face_data_id, employee_id, face_encoding) thành mảng dùng cho gallery
+
+    Args:
+        rows (iterable): Mặc định đọc FaceData của các nhân viên đang hoạt động
+        dim (int): Số chiều embedding, mặc định theo FACE_RECOGNITION
+
+    Returns:
+        tuple: (embeddings float32 đã chuẩn hóa L2, employee_ids, face_data_ids)
+    """
+    if rows is None:
+        from .models import FaceData
+
+        rows = (
+            FaceData.objects.filter(employee__is_active=True)
+            .values_list('id', 'employee_id', 'face_encoding')
+            .iterator()
+        )
+    dim = dim or face_setting('EMBEDDING_DIM')
+
+    vectors, employee_ids, face_data_ids = [], [], []
+    for face_data_id, employee_id, blob in rows:
+        try:
+            embedding = decode_face_encoding(blob)
+        except Exception as e:
+            logger.error(f"Lỗi khi giải mã dữ liệu khuôn mặt ID {face_data_id}: {str(e)}")
+            continue
+        if embedding is None or embedding.shape != (dim,):
+            logger.warning(f"Bỏ qua dữ liệu khuôn mặt không hợp lệ cho ID: {face_data_id}")
+            continue
+        vectors.append(embedding)
+        employee_ids.append(employee_id)
+        face_data_ids.append(face_data_id)
+
+    embeddings = l2_normalize(np.stack(vectors)) if vectors else np.empty((0, dim), dtype=np.float32)
+    arrays = embeddings, np.array(employee_ids, dtype=object), np.array(face_data_ids, dtype=np.int64)
+    return aggregate_templates(*arrays) if uses_centroids() else arrays
+
+
+def load_vectors_from_db(face_data_ids):
+    """Đọc embedding đầy đủ của các bản ghi FaceData, dùng để chấm lại ứng viên khi gallery bị nén"""
+    from .models import FaceData
+
+    ids = [int(i) for i in face_data_ids]
+    if uses_centroids():
+        # Mỗi dòng gallery là vector trung tâm của mọi mẫu thuộc cùng nhân viên
+        employees = FaceData.objects.filter(id__in=ids).values('employee_id')
+        rows = FaceData.objects.filter(employee_id__in=employees).values_list('id', 'employee_id', 'face_encoding')
+        embeddings, _, representative_ids = read_face_arrays(rows)
+        return {int(i): v for i, v in zip(representative_ids, embeddings) if int(i) in set(ids)}
+
+    vectors = {}
+    rows = FaceData.objects.filter(id__in=ids).values_list('id', 'face_encoding')
+    for face_data_id, blob in rows:
+        embedding = decode_face_encoding(blob)
+        if embedding is not None:
+            vectors[face_data_id] = embedding
+    return vectors
+
+
+def create_face_gallery():
+    """Tạo gallery rỗng theo cấu hình FACE_RECOGNITION (chỉ mục, bộ nén)"""
+    return FaceGallery(
+        face_setting('EMBEDDING_DIM'),
+        index=create_index(face_setting('GALLERY_INDEX'), **face_setting('GALLERY_INDEX_OPTIONS')),
+        compressor=create_compressor(
+            face_setting('GALLERY_COMPRESSION'),
+            **face_setting('GALLERY_COMPRESSION_OPTIONS')
+        ),
+        vector_loader=load_vectors_from_db,
+        rerank_k=face_setting('GALLERY_RERANK_K'),
+    )
+
+
+_gallery = None
+_gallery_lock = threading.Lock()
+_sync_lock = threading.Lock()
+_next_sync = 0.0
+
+
+def current_gallery_version():
+    """Số phiên bản gallery trong CSDL (ID GalleryChange lớn nhất)"""
+    from django.db.models import Max
+    from .models import GalleryChange
+
+    return GalleryChange.objects.aggregate(version=Max('id'))['version'] or 0
+
+
+def record_gallery_change(employee_id, face_data_id=None):
+    """
+    Ghi nhận một thay đổi gallery để mọi worker cập nhật theo
+
+    Args:
+        employee_id (str): Mã nhân viên bị ảnh hưởng; chuỗi rỗng nếu thay đổi không gắn với
+            nhân viên nào (ví dụ giờ ca làm việc) và chỉ cần tăng phiên bản gallery
+        face_data_id (int): ID FaceData thay đổi, None nếu cần xét lại mọi mẫu của nhân viên
+    """
+    global _next_sync
+    from .models import GalleryChange
+
+    GalleryChange.objects.create(employee_id=employee_id, face_data_id=face_data_id)
+    # Tiến trình vừa thay đổi dữ liệu đồng bộ ngay ở lần gọi get_face_gallery() tiếp theo
+    _next_sync = 0.0
+    if employee_id:
+        schedule_snapshot_rebuild()
+
+
+def prune_gallery_changes():
+    """Xóa nhật ký thay đổi cũ; worker tụt lại quá xa sẽ nạp lại toàn bộ gallery"""
+    from datetime import timedelta
+    from django.utils import timezone
+    from .models import GalleryChange
+
+    cutoff = timezone.now() - timedelta(days=face_setting('GALLERY_CHANGE_RETENTION_DAYS'))
+    GalleryChange.objects.filter(created_at__lt=cutoff).delete()
+
+
+def _open_snapshot_gallery(snapshot):
+    gallery = create_face_gallery()
+    gallery.load_arrays(snapshot.embeddings, snapshot.employee_ids, snapshot.face_data_ids)
+    gallery.version = snapshot.meta['version']
+    gallery.snapshot_name = snapshot.name
+    logger.info(f"Đã mở snapshot gallery khuôn mặt {snapshot.name} (v{gallery.version}) với {len(gallery)} mẫu")
+    # Áp dụng các thay đổi sau thời điểm ghi snapshot
+    return _sync(gallery)
+
+
+def _build_gallery():
+    if face_setting('GALLERY_SNAPSHOT'):
+        snapshot = open_snapshot()
+        if snapshot is not None and 'version' in snapshot.meta:
+            return _open_snapshot_gallery(snapshot)
+
+    gallery = create_face_gallery()
+    # Lấy phiên bản trước khi đọc: thay đổi xen giữa sẽ được áp dụng lại (idempotent)
+    version = current_gallery_version()
+    arrays = read_face_arrays()
+    gallery.load_arrays(*arrays)
+    gallery.version = version
+    logger.info(f"Đã xây dựng gallery khuôn mặt v{version} từ CSDL với {len(gallery)} mẫu")
+    if face_setting('GALLERY_SNAPSHOT'):
+        try:
+            write_snapshot(*arrays, extra_meta={'version': version})
+        except OSError as e:
+            logger.warning(f"Không thể ghi snapshot gallery: {str(e)}")
+    return gallery
+
+
+def _sync(gallery):
+    """
+    Áp dụng các thay đổi GalleryChange mới hơn gallery.version.
+
+    Returns:
+        FaceGallery: Chính gallery đó, hoặc gallery mới nếu phải nạp lại toàn bộ
+    """
+    from .models import GalleryChange
+
+    max_changes = face_setting('GALLERY_SYNC_MAX_CHANGES')
+    changes = list(
+        GalleryChange.objects.filter(id__gt=gallery.version)
+        .order_by('id')
+        .values_list('id', 'employee_id', 'face_data_id')[:max_changes + 1]
+    )
+    if not changes:
+        return gallery
+    if len(changes) > max_changes or _missed_changes(gallery.version, changes[0][0]):
+        logger.info(f"Gallery v{gallery.version} tụt lại quá nhiều thay đổi, nạp lại toàn bộ")
+        return _build_fresh_gallery()
+
+    _apply_changes(gallery, changes)
+    gallery.version = changes[-1][0]
+    return gallery
+
+
+def _remap_snapshot(gallery):
+    """
+    Mở snapshot mới khi CURRENT đã trỏ sang snapshot khác snapshot gallery đang dùng
+
+    Giữa hai lần ghi snapshot, thay đổi chỉ nằm trong lớp delta riêng của từng worker. Snapshot
+    được ghi lại ở nền sau mỗi thay đổi (schedule_snapshot_rebuild); khi worker chuyển sang
+    snapshot đó, lớp delta được bỏ và các worker lại dùng chung một bản trong page cache.
+
+    Returns:
+        FaceGallery: Chính gallery đó, hoặc gallery mở từ snapshot mới
+    """
+    if not face_setting('GALLERY_SNAPSHOT'):
+        return gallery
+    name = current_snapshot_name()
+    if name is None or name == gallery.snapshot_name:
+        return gallery
+    snapshot = open_snapshot()
+    if snapshot is None or 'version' not in snapshot.meta:
+        return gallery
+    return _open_snapshot_gallery(snapshot)
+
+
+def _missed_changes(version, first_pending_id):
+    # Nhật ký đã bị xóa bớt (prune_gallery_changes) phía sau phiên bản của gallery
+    if first_pending_id == version + 1:
+        return False
+    from .models import GalleryChange
+
+    oldest = GalleryChange.objects.order_by('id').values_list('id', flat=True).first()
+    return oldest is not None and oldest > version + 1 and version > 0
+
+
+def _build_fresh_gallery():
+    gallery = create_face_gallery()
+    gallery.version = current_gallery_version()
+    gallery.load_arrays(*read_face_arrays())
+    return gallery
+
+
+def _apply_changes(gallery, changes):
+    from django.db.models import Q
+    from .models import FaceData
+
+    employee_ids = {employee_id for _, employee_id, _ in changes if employee_id}
+    face_data_ids = {face_data_id for _, _, face_data_id in changes if face_data_id is not None}
+    # Mọi dòng có thể bị ảnh hưởng; dòng nào không còn hợp lệ trong CSDL sẽ bị xóa
+    affected = set(face_data_ids)
+    for employee_id in employee_ids:
+        affected.update(gallery.face_data_ids_of(employee_id))
+
+    rows = (
+        FaceData.objects.filter(Q(id__in=face_data_ids) | Q(employee_id__in=employee_ids))
+        .filter(employee__is_active=True)
+        .values_list('id', 'employee_id', 'face_encoding')
+    )
+    # Mẫu không giải mã được vẫn nằm trong affected nên bị xóa khỏi gallery
+    embeddings, row_employee_ids, row_face_data_ids = read_face_arrays(rows, gallery.dim)
+    for embedding, employee_id, face_data_id in zip(embeddings, row_employee_ids, row_face_data_ids):
+        affected.discard(int(face_data_id))
+        gallery.add(int(face_data_id), employee_id, embedding)
+
+    for face_data_id in affected:
+        gallery.remove(face_data_id)
+    logger.info(
+        f"Đồng bộ gallery tới v{changes[-1][0]}: cập nhật {len(row_face_data_ids)} mẫu, xóa {len(affected)} mẫu"
+    )
+
+
+def get_face_gallery():
+    """
+    Trả về gallery dùng chung của tiến trình.
+
+    Lần gọi đầu tiên mở snapshot trên đĩa bằng memory-map (hoặc đọc từ CSDL rồi ghi
+    snapshot mới). Sau đó, tối đa mỗi GALLERY_SYNC_INTERVAL giây, gallery kiểm tra
+    nhật ký GalleryChange và áp dụng các thay đổi từ worker khác theo từng dòng (vào lớp
+    delta), rồi mở lại snapshot nếu đã có snapshot mới hơn (xem _remap_snapshot).
+    """
+    global _gallery, _next_sync
+    if _gallery is None:
+        with _gallery_lock:
+            if _gallery is None:
+                _gallery = _build_gallery()
+                _next_sync = time.monotonic() + face_setting('GALLERY_SYNC_INTERVAL')
+        return _gallery
+
+    now = time.monotonic()
+    # Chỉ một luồng đồng bộ; các luồng khác dùng gallery hiện tại
+    if now >= _next_sync and _sync_lock.acquire(blocking=False):
+        try:
+            _next_sync = now + face_setting('GALLERY_SYNC_INTERVAL')
+            gallery = _sync(_remap_snapshot(_gallery))
+            if gallery is not _gallery:
+                with _gallery_lock:
+                    _gallery = gallery
+        except Exception as e:
+            logger.error(f"Lỗi khi đồng bộ gallery khuôn mặt: {str(e)}")
+        finally:
+            _sync_lock.release()
+    return _gallery
+
+
+def reset_face_gallery():
+    """Bỏ gallery hiện tại, lần gọi get_face_gallery() tiếp theo sẽ xây dựng lại"""
+    global _gallery
+    with _gallery_lock:
+        _gallery = None
@@ -0,0 +1,242 @@
+import logging
+import math
+import threading
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class IVFIndex:
+    """
+    Chỉ mục IVF (inverted file) cho gallery khuôn mặt lớn, viết hoàn toàn bằng NumPy.
+
+    Các embedding (đã chuẩn hóa L2) được chia thành nlist cụm bằng spherical k-means,
+    mỗi cụm lưu mảng ID FaceData của các thành viên và bán kính góc của cụm (góc lớn nhất
+    giữa tâm và một thành viên). Các ứng viên được chấm điểm chính xác trên vector gốc.
+
+    Kết quả giống hệt quét vét cạn: với probe q, mọi thành viên của cụm có tâm c và bán kính r
+    có độ tương đồng không vượt quá cos(max(0, góc(q, c) - r)). search() duyệt các cụm theo cận
+    trên này giảm dần (ít nhất nprobe cụm) và chỉ dừng khi cận trên của mọi cụm còn lại thấp
+    hơn cả điểm của ứng viên thứ top_k lẫn ngưỡng min_similarity, tức là không mẫu nào chưa
+    chấm điểm có thể lọt vào kết quả. Khi phải duyệt gần hết các cụm thì trả về None để gallery
+    quét vét cạn bằng một phép nhân ma trận.
+
+    Bảo đảm này áp dụng cho gallery không nén; với GALLERY_COMPRESSION, điểm xấp xỉ của bộ nén
+    có thể vượt cận trên nên IVF có thể cho kết quả khác quét vét cạn trên cùng dữ liệu nén.
+    Cận trên chỉ loại được cụm khi các cụm đủ chặt; với embedding phân tán (nhiều chiều, bán kính
+    cụm lớn) search() gần như luôn trả về None và không nhanh hơn quét vét cạn.
+
+    exact=False: chỉ duyệt nprobe cụm có tâm gần probe nhất và quét vét cạn khi ứng viên tốt nhất
+    không vượt ngưỡng min_similarity ít nhất accept_margin, hoặc nhân viên thứ hai cách chưa tới
+    ambiguity_margin. Nhanh hơn nhưng là tìm kiếm xấp xỉ: một mẫu giống hơn của nhân viên khác
+    trong cụm chưa duyệt sẽ không được thấy, nên kết quả nhận diện có thể khác quét vét cạn.
+    """
+
+    # Số dòng tối đa trong một lần nhân ma trận khi gán cụm, tránh tốn bộ nhớ
+    assign_chunk_size = 16384
+    # Bù sai số làm tròn float32 khi so sánh cận trên với điểm đã chấm
+    bound_tolerance = 1e-4
+
+    def __init__(self, nlist=None, nprobe=16, exact=True, max_probe_fraction=0.5, accept_margin=0.1,
+                 ambiguity_margin=0.1, train_iterations=10, min_train_size=10000, seed=0):
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.exact = exact
+        self.accept_margin = accept_margin
+        self.ambiguity_margin = ambiguity_margin
+        # Phải duyệt nhiều hơn tỉ lệ này của gallery thì quét vét cạn nhanh hơn
+        self.max_probe_fraction = max_probe_fraction
+        self.train_iterations = train_iterations
+        self.min_train_size = min_train_size
+        self.seed = seed
+        self._lock = threading.Lock()
+        # (centroids, lists, min_cosines); thay bằng một phép gán để search() không thấy trạng thái dở dang
+        self._layout = None
+        self._list_of = {}
+        self.trained_size = 0
+
+    @property
+    def is_ready(self):
+        return self._layout is not None
+
+    def __len__(self):
+        return len(self._list_of)
+
+    def build(self, ids, vectors):
+        """Huấn luyện tâm cụm và gán toàn bộ vector; dưới min_train_size thì không dùng chỉ mục"""
+        if len(ids) < self.min_train_size:
+            with self._lock:
+                self._layout, self._list_of, self.trained_size = None, {}, 0
+            return
+        # Huấn luyện trên biến cục bộ, search() vẫn dùng bố cục cũ cho tới khi thay
+        nlist = self.nlist or int(min(4096, max(16, round(math.sqrt(len(ids))))))
+        centroids = self._train(vectors, nlist)
+        assignments, cosines = self._assign(vectors, centroids)
+
+        order = np.argsort(assignments, kind='stable')
+        bounds = np.searchsorted(assignments[order], np.arange(nlist + 1))
+        ids = np.asarray(ids, dtype=np.int64)
+        lists = [ids[order[bounds[i]:bounds[i + 1]]] for i in range(nlist)]
+        min_cosines = np.ones(nlist, dtype=np.float64)
+        np.minimum.at(min_cosines, assignments, cosines)
+        list_of = dict(zip(ids.tolist(), assignments.tolist()))
+        with self._lock:
+            self._layout = (centroids, lists, min_cosines)
+            self._list_of = list_of
+            self.trained_size = len(ids)
+        logger.info(f"Đã xây dựng chỉ mục IVF với {nlist} cụm cho {len(ids)} mẫu")
+
+    def needs_rebuild(self, size):
+        """Gallery tăng gấp đôi kể từ lần huấn luyện trước (hoặc vừa đủ để huấn luyện)"""
+        if not self.is_ready:
+            return size >= self.min_train_size
+        return size >= 2 * self.trained_size
+
+    def add(self, face_data_id, vector):
+        with self._lock:
+            if self._layout is None:
+                return
+            centroids, lists, min_cosines = self._layout
+            self._discard(face_data_id)
+            similarities = centroids @ vector
+            list_no = int(np.argmax(similarities))
+            # Nới bán kính trước khi thêm thành viên để cận trên luôn đúng với search() đồng thời
+            cosine = float(similarities[list_no]) / max(float(np.linalg.norm(vector)), 1e-12)
+            min_cosines[list_no] = min(min_cosines[list_no], cosine)
+            lists[list_no] = np.append(lists[list_no], np.int64(face_data_id))
+            self._list_of[face_data_id] = list_no
+
+    def remove(self, face_data_id):
+        with self._lock:
+            if self._layout is None:
+                return
+            self._discard(face_data_id)
+
+    def _discard(self, face_data_id):
+        # Bán kính cụm giữ nguyên khi xóa: cận trên vẫn đúng, chỉ lỏng hơn tới lần xây dựng sau
+        list_no = self._list_of.pop(face_data_id, None)
+        if list_no is not None:
+            lists = self._layout[1]
+            members = lists[list_no]
+            lists[list_no] = members[members != face_data_id]
+
+    def search(self, probe, top_k, min_similarity, score_ids):
+        """
+        Tìm ứng viên cho vector probe đã chuẩn hóa
+
+        Args:
+            probe (numpy.ndarray): Vector truy vấn đã chuẩn hóa L2
+            top_k (int): Số dòng cần trả về đúng như quét vét cạn
+            min_similarity (float | None): Ngưỡng của lời gọi; mẫu dưới ngưỡng không cần chấm điểm
+            score_ids (callable): Nhận mảng ID FaceData, trả về (rows, scores, labels) với điểm
+                chính xác và mã nhân viên của từng dòng
+
+        Returns:
+            tuple | None: (rows, scores) chứa top_k dòng tốt nhất của cả gallery (và mọi dòng đạt
+                min_similarity trong số đó), hoặc None nếu cần quét vét cạn
+        """
+        layout = self._layout
+        if layout is None:
+            return None
+        if not self.exact:
+            return self._search_probed(layout, probe, min_similarity, score_ids)
+        centroids, lists, min_cosines = layout
+
+        sizes = np.array([len(members) for members in lists], dtype=np.int64)
+        upper = self._upper_bounds(centroids @ probe, min_cosines)
+        upper[sizes == 0] = -np.inf
+        order = np.argsort(-upper, kind='stable')
+        budget = self.max_probe_fraction * sizes.sum()
+        floor = -np.inf if min_similarity is None else min_similarity
+
+        chunks, scored, probed = [], 0, 0
+        kth = -np.inf
+        while probed < len(order):
+            if probed >= min(self.nprobe, len(order)) and upper[order[probed]] < max(kth, floor):
+                break
+            step = order[probed:probed + max(1, self.nprobe)]
+            probed += len(step)
+            scored += int(sizes[step].sum())
+            if scored > budget:
+                return None
+            rows, scores, _ = score_ids(np.concatenate([lists[i] for i in step]))
+            chunks.append((rows, scores))
+            all_scores = np.concatenate([scores for _, scores in chunks])
+            if len(all_scores) >= top_k:
+                kth = float(np.partition(all_scores, len(all_scores) - top_k)[len(all_scores) - top_k])
+
+        rows = np.concatenate([rows for rows, _ in chunks]) if chunks else np.empty(0, dtype=np.int64)
+        scores = np.concatenate([scores for _, scores in chunks]) if chunks else np.empty(0, dtype=np.float32)
+        return rows, scores
+
+    def _search_probed(self, layout, probe, min_similarity, score_ids):
+        # exact=False: chỉ nprobe cụm gần nhất, quét vét cạn khi kết quả không đủ chắc chắn
+        centroids, lists, _ = layout
+        if min_similarity is None:
+            return None
+        nprobe = min(self.nprobe, len(centroids))
+        probed = np.argpartition(-(centroids @ probe), nprobe - 1)[:nprobe]
+        rows, scores, labels = score_ids(np.concatenate([lists[i] for i in probed]))
+        if not len(scores):
+            return None
+        best = int(np.argmax(scores))
+        if scores[best] < min_similarity + self.accept_margin:
+            return None
+        # Nhân viên thứ hai gần bằng nhân viên tốt nhất: cụm chưa duyệt có thể đổi thứ tự
+        others = scores[labels != labels[best]]
+        if len(others) and scores[best] - others.max() < self.ambiguity_margin:
+            return None
+        return rows, scores
+
+    def _upper_bounds(self, centroid_similarities, min_cosines):
+        # Cận trên của độ tương đồng giữa probe và mọi thành viên của từng cụm
+        angle = np.arccos(np.clip(centroid_similarities, -1.0, 1.0))
+        radius = np.arccos(np.clip(min_cosines, -1.0, 1.0))
+        return np.cos(np.maximum(0.0, angle - radius)) + self.bound_tolerance
+
+    def _train(self, vectors, nlist):
+        rng = np.random.default_rng(self.seed)
+        # Huấn luyện trên mẫu con để chi phí không tăng theo kích thước gallery
+        sample_size = min(len(vectors), nlist * 64)
+        sample = vectors[rng.choice(len(vectors), sample_size, replace=False)]
+        centroids = sample[rng.choice(sample_size, nlist, replace=False)].copy()
+        for _ in range(self.train_iterations):
+            assignments = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignments, sample)
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            empty = norms[:, 0] == 0
+            # Cụm rỗng giữ nguyên tâm cũ
+            sums[empty] = centroids[empty]
+            norms[empty] = 1.0
+            centroids = (sums / norms).astype(np.float32)
+        return centroids
+
+    def _assign(self, vectors, centroids):
+        # Cụm gần nhất của từng vector và cosine giữa vector với tâm cụm đó
+        assignments = np.empty(len(vectors), dtype=np.int64)
+        cosines = np.empty(len(vectors), dtype=np.float64)
+        for start in range(0, len(vectors), self.assign_chunk_size):
+            chunk = np.asarray(vectors[start:start + self.assign_chunk_size], dtype=np.float32)
+            similarities = chunk @ centroids.T
+            best = np.argmax(similarities, axis=1)
+            norms = np.maximum(np.linalg.norm(chunk, axis=1), 1e-12)
+            assignments[start:start + len(chunk)] = best
+            cosines[start:start + len(chunk)] = similarities[np.arange(len(chunk)), best] / norms
+        return assignments, cosines
+
+
+# Các loại chỉ mục có thể chọn qua FACE_RECOGNITION['GALLERY_INDEX']
+INDEX_BACKENDS = {
+    'brute_force': None,
+    'ivf': IVFIndex,
+}
+
+
+def create_index(name, **options):
+    """Tạo chỉ mục theo tên cấu hình, trả về None cho tìm kiếm vét cạn"""
+    if name not in INDEX_BACKENDS:
+        raise ValueError(f"Loại chỉ mục gallery không hợp lệ: {name}")
+    backend = INDEX_BACKENDS[name]
+    return backend(**options) if backend is not None else None
@@ -0,0 +1,127 @@
+import logging
+import os
+import threading
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+
+from .face_settings import face_setting
+
+logger = logging.getLogger(__name__)
+
+
+def onnx_model_path():
+    """Đường dẫn file ONNX của mô hình embedding; mặc định BASE_DIR/face_models/<model>.onnx"""
+    configured = face_setting('EMBEDDING_ONNX_PATH')
+    if configured:
+        return Path(configured)
+    return Path(settings.BASE_DIR) / 'face_models' / f"{face_setting('MODEL_NAME').lower()}.onnx"
+
+
+def prepare_batch(crops, target_size):
+    """
+    Tiền xử lý khuôn mặt giống DeepFace.represent (detector_backend='skip'): đổi BGR sang RGB, thu
+    nhỏ giữ tỉ lệ, thêm viền đen cho đủ target_size (cao, rộng) và chia 255 cho từng ảnh
+
+    Returns:
+        numpy.ndarray: float32 (N x cao x rộng x 3), kênh màu RGB
+    """
+    import cv2
+
+    height, width = target_size
+    batch = np.zeros((len(crops), height, width, 3), dtype=np.float32)
+    for i, crop in enumerate(crops):
+        factor = min(height / crop.shape[0], width / crop.shape[1])
+        resized = cv2.resize(crop[:, :, ::-1], (int(crop.shape[1] * factor), int(crop.shape[0] * factor)))
+        pad_y = (height - resized.shape[0]) // 2
+        pad_x = (width - resized.shape[1]) // 2
+        face = batch[i, pad_y:pad_y + resized.shape[0], pad_x:pad_x + resized.shape[1]]
+        face[:] = resized
+        if resized.max() > 1:
+            face /= 255.0
+    return batch
+
+
+def export_onnx_model(output_path, opset=13, quantize=False):
+    """
+    Xuất mô hình Keras mà DeepFace đang dùng (MODEL_NAME) sang ONNX
+
+    Args:
+        output_path: File ONNX cần ghi
+        opset (int): Phiên bản opset ONNX
+        quantize (bool): Lượng tử hóa động trọng số sang int8 (nhỏ hơn ~4 lần, nhanh hơn trên CPU)
+
+    Returns:
+        Path: File đã ghi
+    """
+    import tensorflow as tf
+    import tf2onnx
+    from deepface import DeepFace
+
+    output_path = Path(output_path)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    keras_model = DeepFace.build_model(face_setting('MODEL_NAME')).model
+    signature = (tf.TensorSpec((None,) + tuple(keras_model.input_shape[1:]), tf.float32, name='input'),)
+
+    float_path = output_path.with_name(f"{output_path.name}.float.tmp")
+    tf2onnx.convert.from_keras(keras_model, input_signature=signature, opset=opset, output_path=str(float_path))
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        quantized_path = output_path.with_name(f"{output_path.name}.int8.tmp")
+        quantize_dynamic(str(float_path), str(quantized_path), weight_type=QuantType.QInt8)
+        os.remove(float_path)
+        float_path = quantized_path
+    os.replace(float_path, output_path)
+    logger.info(f"Đã xuất mô hình {face_setting('MODEL_NAME')} sang {output_path} (int8: {quantize})")
+    return output_path
+
+
+class OnnxEmbedder:
+    """
+    Trích xuất embedding bằng ONNX Runtime trên CPU từ file do export_onnx_model tạo ra.
+
+    Không cần TensorFlow khi chạy; một phiên ONNX Runtime dùng chung cho mọi luồng của tiến trình.
+    """
+
+    def __init__(self, path, threads=0):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+        self.path = str(path)
+        self.session = ort.InferenceSession(self.path, sess_options=options, providers=['CPUExecutionProvider'])
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        self.target_size = tuple(model_input.shape[1:3])
+
+    def embed(self, crops):
+        """Embedding (list[float]) cho từng khuôn mặt BGR uint8 trong crops, một lần chạy cho cả lô"""
+        if not len(crops):
+            return []
+        batch = prepare_batch(crops, self.target_size)
+        embeddings = self.session.run(None, {self.input_name: batch})[0]
+        return [embedding.tolist() for embedding in np.asarray(embeddings).reshape(len(crops), -1)]
+
+
+_embedder = None
+_embedder_lock = threading.Lock()
+
+
+def get_onnx_embedder():
+    """Trả về OnnxEmbedder dùng chung của tiến trình (nạp ở lần dùng đầu tiên)"""
+    global _embedder
+    if _embedder is None:
+        with _embedder_lock:
+            if _embedder is None:
+                path = onnx_model_path()
+                if not path.exists():
+                    raise FileNotFoundError(
+                        f"Không tìm thấy mô hình ONNX {path}. Tạo bằng: python manage.py export_embedding_model"
+                    )
+                _embedder = OnnxEmbedder(path, threads=face_setting('EMBEDDING_ONNX_THREADS'))
+                logger.info(f"Đã nạp mô hình embedding ONNX {path}")
+    return _embedder
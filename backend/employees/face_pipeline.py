@@ -0,0 +1,330 @@
+import logging
+from collections import namedtuple
+
+import numpy as np
+
+from .face_backends import get_anti_spoofing, get_detector, get_embedder
+from .face_settings import face_setting
+
+logger = logging.getLogger(__name__)
+
+# Kết quả xử lý một ảnh:
+#   face_count     - số khuôn mặt phát hiện được
+#   is_real        - khuôn mặt thật/giả (None nếu không có đúng một khuôn mặt hoặc ảnh không đạt
+#                    chất lượng, khi đó chưa chạy anti-spoofing)
+#   liveness_score - điểm kiểm tra khuôn mặt thật
+#   facial_area    - vùng khuôn mặt trên ảnh gốc (x, y, w, h, ...)
+#   embedding      - vector đặc trưng, None nếu không có đúng một khuôn mặt thật
+#   detector       - bộ phát hiện khuôn mặt đã cho kết quả (xem DETECTOR_CASCADE)
+#   quality_issue  - lý do khuôn mặt bị loại ở bước lọc nhanh LivenessDetector ('face_too_small',
+#                    'blurry', 'flat', 'low_score'), None nếu không bị loại
+FaceAnalysis = namedtuple(
+    'FaceAnalysis',
+    ['face_count', 'is_real', 'liveness_score', 'facial_area', 'embedding', 'detector', 'quality_issue'],
+    defaults=(None, None)
+)
+
+
+def decode_image(data):
+    """
+    Giải mã ảnh tải lên trực tiếp trong bộ nhớ (không ghi ra file tạm)
+
+    Args:
+        data (bytes): Nội dung file ảnh (JPEG, PNG, ...)
+
+    Returns:
+        numpy.ndarray: Ảnh BGR 3 kênh như cv2.imread
+
+    Raises:
+        ValueError: Nếu dữ liệu không phải ảnh hợp lệ
+    """
+    import cv2
+
+    img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if img is None:
+        raise ValueError('Không đọc được ảnh')
+    return img
+
+
+# Các điểm mốc DeepFace trả về trong facial_area (ngoài x, y, w, h)
+LANDMARK_KEYS = ('left_eye', 'right_eye', 'nose', 'mouth_left', 'mouth_right')
+
+
+def detection_input(img):
+    """
+    Thu nhỏ ảnh để cạnh dài nhất không vượt quá DETECTION_MAX_SIDE trước khi phát hiện khuôn mặt
+
+    Chi phí phát hiện tăng theo số điểm ảnh, trong khi khung hình webcam thường lớn hơn nhiều
+    so với mức cần để tìm một khuôn mặt. Ảnh được thu nhỏ bằng INTER_AREA (ít răng cưa).
+
+    Returns:
+        tuple: (ảnh dùng để phát hiện, hệ số nhân tọa độ về ảnh gốc)
+    """
+    import cv2
+
+    max_side = face_setting('DETECTION_MAX_SIDE')
+    height, width = img.shape[:2]
+    if not max_side or max(height, width) <= max_side:
+        return img, 1.0
+
+    factor = max_side / float(max(height, width))
+    size = (max(1, int(round(width * factor))), max(1, int(round(height * factor))))
+    small = cv2.resize(img, size, interpolation=cv2.INTER_AREA)
+    return small, width / float(size[0])
+
+
+def scale_facial_area(facial_area, scale):
+    """Đổi tọa độ vùng khuôn mặt (và các điểm mốc) từ ảnh đã thu nhỏ về ảnh gốc"""
+    if not facial_area or scale == 1.0:
+        return facial_area
+    scaled = dict(facial_area)
+    for key in ('x', 'y', 'w', 'h'):
+        scaled[key] = int(round(facial_area[key] * scale))
+    for key in LANDMARK_KEYS:
+        if facial_area.get(key) is not None:
+            scaled[key] = tuple(int(round(value * scale)) for value in facial_area[key])
+    return scaled
+
+
+def aligned_crop(img, facial_area):
+    """
+    Cắt và căn chỉnh khuôn mặt từ ảnh gốc độ phân giải đầy đủ giống DeepFace.extract_faces (align=True)
+
+    Các bước như deepface.modules.detection.extract_face: lấy vùng khuôn mặt mở rộng thêm 50% mỗi
+    phía (thiếu thì thêm điểm ảnh đen), xoay quanh tâm vùng đó (INTER_CUBIC) để hai mắt nằm ngang,
+    rồi cắt lại vùng w x h đã chiếu theo góc xoay. Chỉ biến đổi vùng mở rộng, không xoay cả ảnh.
+
+    Returns:
+        numpy.ndarray: Khuôn mặt BGR uint8
+    """
+    import cv2
+
+    x, y, w, h = (int(facial_area[key]) for key in ('x', 'y', 'w', 'h'))
+    left_eye, right_eye = facial_area.get('left_eye'), facial_area.get('right_eye')
+    if left_eye is None or right_eye is None:
+        return np.ascontiguousarray(img[max(0, y):y + h, max(0, x):x + w])
+
+    sub_img, relative_x, relative_y = _extract_sub_image(img, x, y, w, h)
+    if sub_img.shape[0] == 0 or sub_img.shape[1] == 0:
+        return np.ascontiguousarray(img[max(0, y):y + h, max(0, x):x + w])
+    angle = float(np.degrees(np.arctan2(left_eye[1] - right_eye[1], left_eye[0] - right_eye[0])))
+    height, width = sub_img.shape[:2]
+    matrix = cv2.getRotationMatrix2D((width // 2, height // 2), angle, 1.0)
+    rotated = cv2.warpAffine(
+        sub_img, matrix, (width, height), flags=cv2.INTER_CUBIC,
+        borderMode=cv2.BORDER_CONSTANT, borderValue=(0, 0, 0)
+    )
+    x1, y1, x2, y2 = _project_facial_area((relative_x, relative_y, relative_x + w, relative_y + h), angle, (height, width))
+    return np.ascontiguousarray(rotated[int(y1):int(y2), int(x1):int(x2)])
+
+
+def _extract_sub_image(img, x, y, w, h):
+    # Vùng khuôn mặt mở rộng thêm 50% mỗi phía; phần nằm ngoài ảnh là điểm ảnh đen
+    relative_x, relative_y = int(0.5 * w), int(0.5 * h)
+    x1, y1 = x - relative_x, y - relative_y
+    x2, y2 = x + w + relative_x, y + h + relative_y
+    if x1 >= 0 and y1 >= 0 and x2 <= img.shape[1] and y2 <= img.shape[0]:
+        return img[y1:y2, x1:x2], relative_x, relative_y
+
+    cropped = img[max(0, y1):min(img.shape[0], y2), max(0, x1):min(img.shape[1], x2)]
+    sub_img = np.zeros((h + 2 * relative_y, w + 2 * relative_x) + img.shape[2:], dtype=img.dtype)
+    start_x, start_y = max(0, relative_x - x), max(0, relative_y - y)
+    sub_img[start_y:start_y + cropped.shape[0], start_x:start_x + cropped.shape[1]] = cropped
+    return sub_img, relative_x, relative_y
+
+
+def _project_facial_area(facial_area, angle, size):
+    # Vị trí (x1, y1, x2, y2) của vùng khuôn mặt sau khi xoay ảnh size (cao, rộng) quanh tâm một góc angle độ
+    direction = 1 if angle >= 0 else -1
+    angle = abs(angle) % 360
+    if angle == 0:
+        return facial_area
+    angle = angle * np.pi / 180
+    height, width = size
+    x = (facial_area[0] + facial_area[2]) / 2 - width / 2
+    y = (facial_area[1] + facial_area[3]) / 2 - height / 2
+    x_new = x * np.cos(angle) + y * direction * np.sin(angle) + width / 2
+    y_new = -x * direction * np.sin(angle) + y * np.cos(angle) + height / 2
+    half_w = (facial_area[2] - facial_area[0]) / 2
+    half_h = (facial_area[3] - facial_area[1]) / 2
+    return (
+        max(int(x_new - half_w), 0),
+        max(int(y_new - half_h), 0),
+        min(int(x_new + half_w), width),
+        min(int(y_new + half_h), height),
+    )
+
+
+_liveness_detector = None
+
+
+def get_liveness_detector():
+    """LivenessDetector dùng chung của tiến trình, tham số lấy từ LIVENESS_PREGATE_OPTIONS"""
+    global _liveness_detector
+    if _liveness_detector is None:
+        from .anti_spoofing import LivenessDetector
+
+        _liveness_detector = LivenessDetector(**face_setting('LIVENESS_PREGATE_OPTIONS'))
+    return _liveness_detector
+
+
+def check_spoofing(img, facial_area):
+    """
+    Kiểm tra khuôn mặt thật/giả bằng backend ANTI_SPOOFING_BACKEND (xem face_backends)
+
+    Args:
+        img (numpy.ndarray): Ảnh BGR đã dùng để phát hiện khuôn mặt
+        facial_area (dict): Vùng khuôn mặt trên img
+
+    Returns:
+        tuple: (is_real, liveness_score); liveness_score None nếu backend không chấm điểm
+    """
+    return get_anti_spoofing().check(img, facial_area)
+
+
+def detect_faces(img):
+    """
+    Phát hiện khuôn mặt bằng backend DETECTION_BACKEND (xem face_backends)
+
+    Args:
+        img (numpy.ndarray): Ảnh BGR (xem decode_image)
+
+    Returns:
+        tuple: (list[dict] khuôn mặt dạng DeepFace.extract_faces, tên bộ phát hiện đã dùng)
+    """
+    return get_detector().detect(img)
+
+
+def face_crop(face_obj):
+    """
+    Khuôn mặt đã cắt và căn chỉnh từ kết quả detect_faces, dạng BGR uint8 như cv2.imread
+
+    extract_faces trả về ảnh RGB dạng float trong [0, 1]; mô hình nhận ảnh BGR như khi
+    DeepFace.represent tự đọc ảnh.
+    """
+    face = np.asarray(face_obj["face"])
+    if face.dtype != np.uint8:
+        face = np.clip(face * 255.0, 0, 255).astype(np.uint8)
+    return np.ascontiguousarray(face[:, :, ::-1])
+
+
+def embed_faces(crops):
+    """
+    Trích xuất embedding cho nhiều khuôn mặt bằng một lần chạy mô hình cho cả lô
+
+    Dùng mô hình Keras của DeepFace hoặc mô hình ONNX tùy EMBEDDING_BACKEND.
+
+    Returns:
+        list: Embedding (list[float] | None) theo đúng thứ tự crops
+    """
+    return get_embedder().embed(crops)
+
+
+def _inspect_detected(img, scale, face_objs, detector):
+    """
+    Lọc nhanh và kiểm tra khuôn mặt thật cho các khuôn mặt đã phát hiện trên ảnh img thu nhỏ scale lần
+
+    Returns:
+        list[tuple]: (FaceAnalysis với embedding=None, khuôn mặt đã căn chỉnh hoặc None nếu khuôn
+        mặt không đạt) theo thứ tự face_objs
+    """
+    facial_areas, crops = [], []
+    for face_obj in face_objs:
+        facial_area = scale_facial_area(face_obj.get("facial_area"), scale)
+        facial_areas.append(facial_area)
+        crops.append(face_crop(face_obj) if scale == 1.0 or not facial_area else aligned_crop(img, facial_area))
+
+    # Bước lọc nhanh: khuôn mặt quá nhỏ, mờ hoặc phẳng bị loại trước các mô hình nặng
+    pregate, pregate_ms = [(True, None, None)] * len(crops), 0.0
+    if face_setting('LIVENESS_PREGATE') and crops:
+        pregate, timings = get_liveness_detector().check_liveness_batch(crops)
+        pregate_ms = sum(timings.values())
+
+    results = []
+    for face_obj, facial_area, crop, (passed, confidence, details) in zip(face_objs, facial_areas, crops, pregate):
+        if not passed:
+            logger.info(
+                f"Khuôn mặt bị loại ở bước lọc nhanh ({details['reason']}), điểm: {confidence:.2f}, "
+                f"thời gian: {pregate_ms:.2f} ms"
+            )
+            analysis = FaceAnalysis(len(face_objs), None, confidence, facial_area, None, detector, details['reason'])
+            results.append((analysis, None))
+            continue
+
+        # Anti-spoofing chạy trên ảnh gốc độ phân giải đầy đủ như khuôn mặt dùng cho embedding
+        is_real, liveness_score = check_spoofing(img, facial_area)
+        if liveness_score is None:
+            liveness_score = confidence if confidence is not None else 1.0
+        logger.info(f"Kết quả kiểm tra khuôn mặt thật/giả: {is_real}, điểm: {liveness_score:.2f}")
+
+        analysis = FaceAnalysis(len(face_objs), is_real, liveness_score, facial_area, None, detector)
+        results.append((analysis, crop if is_real else None))
+    return results
+
+
+def inspect_face(img):
+    """
+    Phát hiện khuôn mặt và kiểm tra khuôn mặt thật, chưa trích xuất embedding
+
+    Việc phát hiện chạy trên ảnh đã thu nhỏ (detection_input); khi ảnh bị thu nhỏ, vùng khuôn
+    mặt được đổi về tọa độ ảnh gốc, khuôn mặt được cắt và căn chỉnh từ ảnh gốc (aligned_crop) để giữ
+    chất lượng embedding và anti-spoofing cũng chạy trên ảnh gốc.
+    Khuôn mặt đi qua LivenessDetector (lọc nhanh, khi bật LIVENESS_PREGATE) rồi mới tới anti-spoofing
+    (ANTI_SPOOFING_BACKEND); khuôn mặt bị loại ở bước lọc nhanh có quality_issue, không phải is_real=False.
+
+    Returns:
+        tuple: (FaceAnalysis với embedding=None, khuôn mặt đã căn chỉnh hoặc None nếu không
+        có đúng một khuôn mặt thật)
+    """
+    small, scale = detection_input(img)
+    face_objs, detector = detect_faces(small)
+    logger.info(f"Số khuôn mặt phát hiện được: {len(face_objs)} ({detector})")
+
+    if len(face_objs) != 1:
+        return FaceAnalysis(len(face_objs), None, None, None, None, detector), None
+    return _inspect_detected(img, scale, face_objs, detector)[0]
+
+
+def inspect_faces(img, max_faces=None):
+    """
+    Như inspect_face nhưng cho ảnh có nhiều khuôn mặt (recognize_faces_batch)
+
+    Args:
+        img (numpy.ndarray): Ảnh BGR (xem decode_image)
+        max_faces (int): Chỉ kiểm tra tối đa chừng này khuôn mặt đầu tiên; None = không giới hạn
+
+    Returns:
+        tuple: (số khuôn mặt phát hiện được trong ảnh, kể cả phần bị bỏ qua vì max_faces,
+        list[tuple] (FaceAnalysis với embedding=None, khuôn mặt đã căn chỉnh hoặc None) cho từng
+        khuôn mặt đã kiểm tra)
+    """
+    small, scale = detection_input(img)
+    face_objs, detector = detect_faces(small)
+    logger.info(f"Số khuôn mặt phát hiện được: {len(face_objs)} ({detector})")
+
+    checked = face_objs if max_faces is None else face_objs[:max(0, max_faces)]
+    results = _inspect_detected(img, scale, checked, detector)
+    # face_count là số khuôn mặt của cả ảnh
+    return len(face_objs), [(analysis._replace(face_count=len(face_objs)), crop) for analysis, crop in results]
+
+
+def analyze_face(img):
+    """
+    Phát hiện khuôn mặt một lần rồi dùng lại vùng đã căn chỉnh cho kiểm tra khuôn mặt thật
+    và trích xuất embedding
+
+    Embedding chỉ được tính khi ảnh có đúng một khuôn mặt và khuôn mặt đó là thật; các view
+    tự quyết định thông báo lỗi dựa trên face_count, quality_issue, is_real và embedding.
+
+    Hàm không dùng trạng thái hay file dùng chung nên có thể gọi đồng thời từ nhiều luồng.
+
+    Args:
+        img (numpy.ndarray): Ảnh BGR (xem decode_image)
+
+    Returns:
+        FaceAnalysis
+    """
+    analysis, crop = inspect_face(img)
+    if crop is None:
+        return analysis
+    return analysis._replace(embedding=embed_faces([crop])[0])
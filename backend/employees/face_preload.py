@@ -0,0 +1,110 @@
+import importlib
+import logging
+import os
+import time
+
+from .face_settings import face_setting
+
+logger = logging.getLogger(__name__)
+
+
+def process_memory():
+    """
+    Bộ nhớ của tiến trình hiện tại (MB)
+
+    rss tính cả trang nhớ dùng chung với master (copy-on-write) nên cộng RSS của các worker sẽ
+    lớn hơn thực tế; pss chia trang dùng chung cho số tiến trình dùng nó, private là phần riêng
+    của tiến trình. Ngoài Linux chỉ có rss lớn nhất.
+    """
+    fields = {'Rss': 'rss', 'Pss': 'pss', 'Shared_Clean': 'shared', 'Shared_Dirty': 'shared',
+              'Private_Clean': 'private', 'Private_Dirty': 'private'}
+    memory = {}
+    try:
+        with open('/proc/self/smaps_rollup') as rollup:
+            for line in rollup:
+                name, _, value = line.partition(':')
+                if name in fields:
+                    key = fields[name]
+                    memory[key] = memory.get(key, 0.0) + int(value.split()[0]) / 1024.0
+    except OSError:
+        import resource
+
+        memory['max_rss'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+    return {key: round(value, 1) for key, value in memory.items()}
+
+
+# Module được import trong master trước khi fork: chỉ nạp mã và dữ liệu, không tạo luồng
+FORK_SAFE_MODULES = ('numpy', 'cv2')
+
+
+def preload_for_fork():
+    """
+    Nạp trước trong tiến trình master của server prefork (gunicorn --preload), trước khi fork worker
+
+    Chỉ nạp những phần an toàn khi fork; worker dùng chung các trang nhớ này theo cơ chế copy-on-write:
+    - NumPy và OpenCV (FORK_SAFE_MODULES).
+    - Mô hình embedding ONNX khi EMBEDDING_BACKEND='onnx' và EMBEDDING_ONNX_THREADS=1. Phiên
+      ONNX Runtime một luồng không có thread pool nên dùng được sau khi fork.
+    - Gallery khuôn mặt (memory-map snapshot).
+
+    TensorFlow, PyTorch và DeepFace không được import ở master: import TensorFlow đã khởi tạo
+    runtime (thread pool, trạng thái CUDA/oneDNN) và không có gì bảo đảm runtime đó còn dùng được
+    trong tiến trình con sau khi fork. Các framework này được import và mô hình được nạp trong từng
+    worker sau khi fork (after_fork), nên với backend Keras/FasNet phần dùng chung chỉ gồm các mục trên.
+
+    Returns:
+        dict: Thời gian (mili giây) từng bước
+    """
+    from django.db import connections
+
+    timings = {}
+    before = process_memory()
+    for module in FORK_SAFE_MODULES:
+        started = time.perf_counter()
+        importlib.import_module(module)
+        timings[f"import:{module}"] = round((time.perf_counter() - started) * 1000.0, 1)
+
+    if face_setting('EMBEDDING_BACKEND') == 'onnx':
+        if face_setting('EMBEDDING_ONNX_THREADS') == 1:
+            from .face_onnx import get_onnx_embedder
+
+            started = time.perf_counter()
+            get_onnx_embedder()
+            timings['onnx_embedder'] = round((time.perf_counter() - started) * 1000.0, 1)
+        else:
+            logger.warning("Bỏ qua nạp trước mô hình ONNX: cần EMBEDDING_ONNX_THREADS=1 để dùng chung sau khi fork")
+    else:
+        logger.warning(
+            f"Mô hình embedding {face_setting('EMBEDDING_BACKEND')} không nạp được trước khi fork: mỗi worker "
+            f"có một bản riêng. Xuất mô hình ONNX (export_embedding_model) để các worker dùng chung"
+        )
+
+    try:
+        from .face_gallery import get_face_gallery
+
+        started = time.perf_counter()
+        get_face_gallery()
+        timings['gallery'] = round((time.perf_counter() - started) * 1000.0, 1)
+    except Exception as e:
+        # Worker sẽ tự nạp gallery ở lần dùng đầu tiên
+        logger.warning(f"Không nạp trước được gallery khuôn mặt: {str(e)}")
+    finally:
+        # Kết nối CSDL không được dùng chung giữa các tiến trình
+        connections.close_all()
+
+    logger.info(
+        f"Master {os.getpid()} đã nạp trước {timings}; bộ nhớ trước {before}, sau {process_memory()}"
+    )
+    return timings
+
+
+def after_fork():
+    """
+    Chạy trong worker ngay sau khi fork: nạp phần còn lại của pipeline trên luồng nền khi
+    WARMUP_ON_STARTUP, ngược lại mô hình được nạp ở yêu cầu nhận diện đầu tiên
+    """
+    from .face_warmup import start_warmup
+
+    logger.info(f"Worker {os.getpid()} sau khi fork, bộ nhớ {process_memory()}")
+    if face_setting('WARMUP_ON_STARTUP'):
+        start_warmup()
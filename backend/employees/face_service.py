@@ -0,0 +1,403 @@
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import Future, ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from .face_backends import backend_summary
+from .face_batching import MicroBatcher, latency_summary
+from .face_pipeline import decode_image, embed_faces, inspect_face, inspect_faces
+from .face_settings import face_setting
+from .face_warmup import warmup_process
+
+logger = logging.getLogger(__name__)
+
+# Số lần xử lý gần nhất được giữ lại để tính phân vị độ trễ
+LATENCY_WINDOW = 1000
+
+
+class RecognitionBusy(Exception):
+    """Hàng đợi suy luận đã đầy, yêu cầu bị từ chối ngay thay vì chờ vô hạn"""
+
+
+class RecognitionTimeout(Exception):
+    """Không có kết quả suy luận trước hạn chót INFERENCE_TIMEOUT_SECONDS"""
+
+
+def _init_worker():
+    logger.info(f"Tiến trình suy luận {os.getpid()} đã khởi động")
+    # Nạp mô hình trước khi nhận ảnh đầu tiên; tiến trình chưa nạp xong không lấy việc từ hàng đợi
+    try:
+        warmup_process()
+    except Exception as e:
+        logger.error(f"Tiến trình suy luận {os.getpid()} không nạp được mô hình: {str(e)}")
+
+
+def _warmup_worker():
+    return os.getpid(), warmup_process()
+
+
+def _inspect_bytes(data):
+    # Chạy trong tiến trình suy luận: nhận bytes (nhỏ hơn ảnh đã giải mã), phát hiện khuôn mặt
+    # và kiểm tra khuôn mặt thật; embedding được tính sau theo lô
+    return inspect_face(decode_image(data))
+
+
+def _analyze_bytes(data):
+    # Chạy trong tiến trình suy luận khi không gom lô embedding (EMBEDDING_BATCH_SIZE=1): phát hiện,
+    # kiểm tra và trích xuất embedding trong cùng một job
+    analysis, crop = inspect_face(decode_image(data))
+    if crop is not None:
+        analysis = analysis._replace(embedding=embed_faces([crop])[0])
+    return analysis
+
+
+def _analyze_images(images, max_faces):
+    # Chạy trong tiến trình suy luận cho recognize_faces_batch: phát hiện và kiểm tra mọi khuôn mặt
+    # của từng ảnh (tổng cộng tối đa max_faces), rồi trích xuất embedding của các khuôn mặt thật
+    # bằng một lần chạy mô hình. Mỗi ảnh cho (face_count, list[FaceAnalysis], lỗi hoặc None)
+    results, crops, owners = [], [], []
+    for data in images:
+        try:
+            face_count, inspected = inspect_faces(decode_image(data), max_faces=max_faces)
+        except Exception as e:
+            logger.warning(f"Không phát hiện được khuôn mặt trong ảnh của lô: {str(e)}")
+            results.append((0, [], str(e)))
+            continue
+        max_faces -= len(inspected)
+        analyses = []
+        for analysis, crop in inspected:
+            if crop is not None:
+                crops.append(crop)
+                owners.append((len(results), len(analyses)))
+            analyses.append(analysis)
+        results.append((face_count, analyses, None))
+
+    if crops:
+        for (image, face), embedding in zip(owners, embed_faces(crops)):
+            analyses = results[image][1]
+            analyses[face] = analyses[face]._replace(embedding=embedding)
+    return results
+
+
+class RecognitionService:
+    """
+    Dịch vụ suy luận khuôn mặt chạy trên một nhóm tiến trình giữ sẵn mô hình.
+
+    Các luồng request không còn tranh nhau phiên TensorFlow: mỗi ảnh được gửi sang một tiến trình
+    suy luận và luồng request chờ kết quả có giới hạn thời gian. Số ảnh đang xử lý cộng đang chờ
+    không vượt quá workers + queue_depth; vượt quá thì từ chối ngay (RecognitionBusy) để kiosk
+    thử lại thay vì dồn ứ yêu cầu khi cao điểm.
+
+    Mỗi ảnh đi qua hai bước: phát hiện + kiểm tra khuôn mặt thật (một job cho mỗi ảnh), sau đó
+    khuôn mặt đã căn chỉnh được gom lô với khuôn mặt của các yêu cầu đồng thời khác và trích xuất
+    embedding bằng một lần chạy mô hình cho cả lô (xem MicroBatcher). Khuôn mặt vì vậy đi qua lại
+    giữa tiến trình web và tiến trình suy luận hai lần: lô embedding gồm khuôn mặt do nhiều tiến
+    trình suy luận khác nhau phát hiện nên chỉ ghép được ở tiến trình web. Chi phí thêm đo được
+    khoảng 0.6 ms cho khuôn mặt 160x160 và 2 ms cho 300x300, nhỏ so với một lần chạy Facenet512
+    trên CPU. Khi không gom lô (EMBEDDING_BATCH_SIZE=1) hai bước chạy trong cùng một job.
+
+    Tiến trình suy luận được tạo bằng 'spawn' (không fork từ tiến trình web có thể đã nạp
+    TensorFlow) và nạp mô hình ngay khi khởi động (xem face_warmup). workers=0 thì chạy ngay
+    trong tiến trình web.
+    """
+
+    def __init__(self, workers=0, queue_depth=16, timeout=10.0, batch_size=16, batch_wait_ms=5.0):
+        self.workers = max(0, int(workers))
+        self.capacity = self.workers + max(0, int(queue_depth))
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max(1, self.capacity))
+        self._lock = threading.Lock()
+        self._executor = None
+        self._in_flight = 0
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self._counters = {'submitted': 0, 'completed': 0, 'failed': 0, 'rejected': 0, 'timed_out': 0}
+        # Số ảnh được từng tầng của DETECTOR_CASCADE phát hiện xong
+        self._detector_hits = Counter()
+        self._batcher = MicroBatcher(
+            self._run_embedding_batch, max_batch_size=batch_size, max_wait_ms=batch_wait_ms,
+            name='face-embedding-batcher'
+        )
+
+    def analyze(self, data, timeout=None):
+        """
+        Phát hiện, kiểm tra khuôn mặt thật và trích xuất embedding cho một ảnh
+
+        Args:
+            data (bytes): Nội dung file ảnh
+            timeout (float): Thời gian chờ tối đa (giây), mặc định INFERENCE_TIMEOUT_SECONDS
+
+        Returns:
+            FaceAnalysis
+
+        Raises:
+            RecognitionBusy: Hàng đợi đã đầy
+            RecognitionTimeout: Quá thời gian chờ
+        """
+        timeout = self.timeout if timeout is None else timeout
+        if self.workers == 0:
+            return self._analyze_inline(data, timeout)
+
+        started = time.monotonic()
+        if self._batcher.max_batch_size == 1:
+            executor, result = self._submit(_analyze_bytes, data)
+            inspected = result
+        else:
+            executor, inspected = self._submit(_inspect_bytes, data)
+            result = self._chain_embedding(inspected)
+        # Chỗ trong hàng đợi chỉ được trả lại khi tiến trình suy luận thực sự xong (hoặc ảnh bị hủy
+        # khi chưa chạy), kể cả khi luồng request đã thôi chờ vì quá hạn
+        result.add_done_callback(self._release)
+
+        try:
+            analysis = result.result(timeout=timeout)
+        except FutureTimeoutError:
+            inspected.cancel()
+            self._count('timed_out')
+            raise RecognitionTimeout(f"Không có kết quả suy luận sau {timeout} giây")
+        except BrokenProcessPool:
+            # Tiến trình suy luận bị dừng đột ngột (ví dụ hết bộ nhớ): tạo nhóm mới ở yêu cầu sau
+            self._discard(executor)
+            self._count('failed')
+            raise
+        except Exception:
+            self._count('failed')
+            raise
+
+        self._record(time.monotonic() - started, analysis)
+        return analysis
+
+    def analyze_batch(self, images, max_faces, timeout=None):
+        """
+        Phát hiện, kiểm tra khuôn mặt thật và trích xuất embedding cho mọi khuôn mặt trong nhiều ảnh
+
+        Cả lô là một job trên tiến trình suy luận (chiếm một chỗ trong hàng đợi như một ảnh của
+        analyze) và embedding của các khuôn mặt thật được tính bằng một lần chạy mô hình.
+
+        Args:
+            images (list[bytes]): Nội dung các file ảnh
+            max_faces (int): Số khuôn mặt tối đa được kiểm tra cho cả lô; phần vượt quá bị bỏ qua
+            timeout (float): Thời gian chờ tối đa (giây), mặc định BATCH_TIMEOUT_SECONDS
+
+        Returns:
+            list[tuple]: (face_count, list[FaceAnalysis], lỗi hoặc None) theo thứ tự images
+
+        Raises:
+            RecognitionBusy: Hàng đợi đã đầy
+            RecognitionTimeout: Quá thời gian chờ
+        """
+        timeout = face_setting('BATCH_TIMEOUT_SECONDS') if timeout is None else timeout
+        started = time.monotonic()
+        if self.workers == 0:
+            self._count('submitted')
+            try:
+                results = _analyze_images(images, max_faces)
+            except Exception:
+                self._count('failed')
+                raise
+        else:
+            executor, future = self._submit(_analyze_images, images, max_faces)
+            future.add_done_callback(self._release)
+            try:
+                results = future.result(timeout=timeout)
+            except FutureTimeoutError:
+                future.cancel()
+                self._count('timed_out')
+                raise RecognitionTimeout(f"Không có kết quả suy luận sau {timeout} giây")
+            except BrokenProcessPool:
+                self._discard(executor)
+                self._count('failed')
+                raise
+            except Exception:
+                self._count('failed')
+                raise
+
+        self._record(time.monotonic() - started, *(analyses[0] for _, analyses, _ in results if analyses))
+        return results
+
+    def stats(self):
+        """Số liệu hàng đợi và độ trễ (mili giây) của tiến trình web hiện tại"""
+        with self._lock:
+            counters = dict(self._counters)
+            in_flight = self._in_flight
+            latencies = list(self._latencies)
+            detector_hits = dict(self._detector_hits)
+        detected = sum(detector_hits.values())
+        return {
+            'pid': os.getpid(),
+            'workers': self.workers,
+            'capacity': self.capacity,
+            'in_flight': in_flight,
+            'queued': max(0, in_flight - self.workers),
+            'timeout_seconds': self.timeout,
+            **counters,
+            'latency_ms': latency_summary(latencies),
+            'embedding_batches': self._batcher.stats(),
+            'backends': backend_summary(),
+            'detector_hits': detector_hits,
+            # Tỉ lệ ảnh mà từng tầng phát hiện khuôn mặt đã cho kết quả (tầng cuối = tỉ lệ phải dùng RetinaFace)
+            'detector_hit_rates': {
+                name: round(count / detected, 4) for name, count in detector_hits.items()
+            },
+        }
+
+    def warmup(self, timeout=None):
+        """
+        Tạo nhóm tiến trình suy luận và chờ mô hình được nạp xong
+
+        Returns:
+            dict: Thời gian nạp (mili giây) theo pid của tiến trình đã nạp mô hình
+        """
+        if self.workers == 0:
+            return {os.getpid(): warmup_process()}
+        executor = self._get_executor()
+        # Mỗi job chờ tiến trình nhận nó nạp xong mô hình; gửi đủ số tiến trình để cả nhóm được tạo
+        futures = [executor.submit(_warmup_worker) for _ in range(self.workers)]
+        try:
+            return dict(future.result(timeout=timeout) for future in futures)
+        except FutureTimeoutError:
+            raise RecognitionTimeout(f"Chưa nạp xong mô hình sau {timeout} giây")
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+    def _analyze_inline(self, data, timeout):
+        started = time.monotonic()
+        self._count('submitted')
+        try:
+            analysis, crop = _inspect_bytes(data)
+            if crop is not None:
+                remaining = max(0.0, timeout - (time.monotonic() - started))
+                analysis = analysis._replace(embedding=self._batcher.submit(crop).result(timeout=remaining))
+        except FutureTimeoutError:
+            self._count('timed_out')
+            raise RecognitionTimeout(f"Không có kết quả suy luận sau {timeout} giây")
+        except Exception:
+            self._count('failed')
+            raise
+        self._record(time.monotonic() - started, analysis)
+        return analysis
+
+    def _submit(self, fn, *args):
+        # Giữ một chỗ trong hàng đợi rồi gửi job sang nhóm tiến trình suy luận; người gọi trả chỗ
+        # bằng _release khi job xong
+        if not self._slots.acquire(blocking=False):
+            self._count('rejected')
+            raise RecognitionBusy(f"Hàng đợi suy luận đã đầy ({self.capacity} ảnh)")
+
+        executor = self._get_executor()
+        try:
+            future = executor.submit(fn, *args)
+        except (BrokenProcessPool, RuntimeError):
+            self._slots.release()
+            self._discard(executor)
+            self._count('failed')
+            raise
+        with self._lock:
+            self._in_flight += 1
+            self._counters['submitted'] += 1
+        return executor, future
+
+    def _chain_embedding(self, inspected):
+        # Future của FaceAnalysis đầy đủ: khi bước phát hiện xong thì đưa khuôn mặt vào lô embedding
+        result = Future()
+
+        def on_embedded(embedded, analysis):
+            try:
+                embedding = embedded.result()
+            except Exception as e:
+                result.set_exception(e)
+                return
+            result.set_result(analysis._replace(embedding=embedding))
+
+        def on_inspected(done):
+            if done.cancelled():
+                result.cancel()
+                result.set_running_or_notify_cancel()
+                return
+            try:
+                analysis, crop = done.result()
+            except Exception as e:
+                result.set_exception(e)
+                return
+            if crop is None:
+                result.set_result(analysis)
+                return
+            self._batcher.submit(crop).add_done_callback(lambda embedded: on_embedded(embedded, analysis))
+
+        inspected.add_done_callback(on_inspected)
+        return result
+
+    def _run_embedding_batch(self, crops):
+        if self.workers == 0:
+            return embed_faces(crops)
+        return self._get_executor().submit(embed_faces, crops)
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_init_worker,
+                )
+                logger.info(f"Đã tạo nhóm {self.workers} tiến trình suy luận (hàng đợi tối đa {self.capacity} ảnh)")
+            return self._executor
+
+    def _discard(self, executor):
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        logger.error("Nhóm tiến trình suy luận bị lỗi, sẽ tạo lại ở yêu cầu tiếp theo")
+        executor.shutdown(wait=False)
+
+    def _release(self, future):
+        with self._lock:
+            self._in_flight -= 1
+        self._slots.release()
+
+    def _record(self, seconds, *analyses):
+        # Một lần xử lý (ảnh hoặc lô); mỗi FaceAnalysis đại diện cho một ảnh khi đếm bộ phát hiện
+        with self._lock:
+            self._counters['completed'] += 1
+            self._latencies.append(seconds)
+            for analysis in analyses:
+                if analysis.detector:
+                    self._detector_hits[analysis.detector] += 1
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_recognition_service():
+    """Trả về dịch vụ suy luận dùng chung của tiến trình web (tạo ở lần dùng đầu tiên)"""
+    global _service
+    if _service is None:
+        with _service_lock:
+            if _service is None:
+                _service = RecognitionService(
+                    workers=face_setting('INFERENCE_WORKERS'),
+                    queue_depth=face_setting('INFERENCE_QUEUE_DEPTH'),
+                    timeout=face_setting('INFERENCE_TIMEOUT_SECONDS'),
+                    batch_size=face_setting('EMBEDDING_BATCH_SIZE'),
+                    batch_wait_ms=face_setting('EMBEDDING_BATCH_WAIT_MS'),
+                )
+    return _service
+
+
+def analyze_upload(upload):
+    """Xử lý file ảnh tải lên qua dịch vụ suy luận; con trỏ file được đặt lại để lưu ảnh gốc sau đó"""
+    data = upload.read()
+    upload.seek(0)
+    return get_recognition_service().analyze(data)
@@ -0,0 +1,129 @@
+from django.conf import settings
+
+# Giá trị mặc định cho cấu hình nhận diện khuôn mặt.
+# Có thể ghi đè bằng dict FACE_RECOGNITION trong settings.py
+DEFAULTS = {
+    'MODEL_NAME': 'Facenet512',
+    'EMBEDDING_DIM': 512,
+    # Kiểu dữ liệu khi lưu embedding vào FaceData.face_encoding: 'float32' hoặc 'float16'
+    'EMBEDDING_DTYPE': 'float32',
+    # Số ứng viên lấy ra từ gallery cho mỗi lần so khớp
+    'GALLERY_TOP_K': 5,
+    # Chỉ mục gallery: 'brute_force' (vét cạn) hoặc 'ivf' (phân cụm, cho gallery rất lớn)
+    'GALLERY_INDEX': 'brute_force',
+    # Tham số truyền cho chỉ mục, ví dụ {'nlist': 1024, 'min_train_size': 10000}. 'ivf' mặc định cho
+    # kết quả giống quét vét cạn với gallery không nén (khi dùng GALLERY_COMPRESSION có thể khác);
+    # {'exact': False} nhanh hơn nhưng THAY ĐỔI kết quả nhận diện (xem employees/face_index.py)
+    'GALLERY_INDEX_OPTIONS': {},
+    # Nén gallery trong bộ nhớ: 'none', 'int8', 'pca' (512 -> 128 chiều) hoặc 'pq'
+    'GALLERY_COMPRESSION': 'none',
+    # Tham số truyền cho bộ nén, ví dụ {'n_components': 128} hoặc {'n_subspaces': 64}
+    'GALLERY_COMPRESSION_OPTIONS': {},
+    # Số ứng viên (theo điểm xấp xỉ) được chấm lại bằng vector đầy đủ khi gallery bị nén
+    'GALLERY_RERANK_K': 50,
+    # Ghi gallery ra snapshot trên đĩa để các worker mở chung bằng memory-map
+    'GALLERY_SNAPSHOT': True,
+    # Thư mục snapshot; None = BASE_DIR/gallery_snapshot (không đặt trong MEDIA_ROOT vì được phục vụ công khai)
+    'GALLERY_SNAPSHOT_DIR': None,
+    # Ghi lại snapshot khi không có thay đổi gallery mới trong chừng này giây (gộp nhiều thay đổi
+    # liên tiếp thành một lần đọc toàn bộ FaceData) ...
+    'GALLERY_SNAPSHOT_REBUILD_DELAY': 5.0,
+    # ... nhưng không chờ quá chừng này giây kể từ thay đổi đầu tiên
+    'GALLERY_SNAPSHOT_REBUILD_MAX_DELAY': 60.0,
+    # Khoảng thời gian tối thiểu (giây) giữa hai lần kiểm tra nhật ký GalleryChange của mỗi worker
+    'GALLERY_SYNC_INTERVAL': 1.0,
+    # Tụt lại nhiều thay đổi hơn giá trị này thì nạp lại toàn bộ gallery thay vì cập nhật từng dòng
+    'GALLERY_SYNC_MAX_CHANGES': 1000,
+    # Số ngày giữ nhật ký GalleryChange
+    'GALLERY_CHANGE_RETENTION_DAYS': 7,
+    # Số mẫu khuôn mặt tối đa của mỗi nhân viên (đăng ký thêm sẽ loại bớt mẫu cũ)
+    'MAX_TEMPLATES_PER_EMPLOYEE': 5,
+    # Chọn mẫu bị loại khi vượt giới hạn: 'oldest' hoặc 'redundant' (giống các mẫu còn lại nhất)
+    'TEMPLATE_EVICTION': 'oldest',
+    # Chấm điểm nhân viên nhiều mẫu: 'max' (mẫu giống nhất) hoặc 'centroid' (vector trung tâm)
+    'TEMPLATE_SCORING': 'max',
+    # Tìm trước trong gallery con gồm nhân viên sắp vào/tan ca, quét toàn bộ nếu không đạt ngưỡng
+    'SHIFT_TIER': True,
+    # Nhân viên có giờ vào hoặc ra ca cách thời điểm hiện tại không quá số phút này
+    'SHIFT_TIER_WINDOW_MINUTES': 60,
+    # Thời gian (giây) trước khi tạo lại gallery con theo ca
+    'SHIFT_TIER_REFRESH_SECONDS': 300,
+    # Độ tương đồng tối thiểu để chấp nhận kết quả của gallery con; None = 1 - DISTANCE_THRESHOLD
+    'SHIFT_TIER_ACCEPT_SIMILARITY': None,
+    # Điểm hoạt động gần đây khi điểm danh: mỗi lần check-in cộng RECENCY_CHECKIN_WEIGHT,
+    # giảm một nửa sau mỗi RECENCY_HALF_LIFE_DAYS ngày
+    'RECENCY_HALF_LIFE_DAYS': 7,
+    'RECENCY_CHECKIN_WEIGHT': 0.05,
+    # Số ngày check-in được đọc khi xây dựng lại điểm từ CSDL
+    'RECENCY_HORIZON_DAYS': 30,
+    # Chu kỳ (giây) xây dựng lại điểm từ CSDL (trên luồng nền) để gộp check-in của các worker khác;
+    # giữa hai lần, điểm của một nhân viên có thể khác nhau giữa các worker
+    'RECENCY_REFRESH_SECONDS': 600,
+    # Số ảnh/embedding tối đa mỗi yêu cầu recognize_faces_batch
+    'BATCH_MAX_PROBES': 64,
+    # Số khuôn mặt tối đa được kiểm tra và trích xuất embedding trong các ảnh của một yêu cầu
+    # recognize_faces_batch; khuôn mặt vượt quá bị bỏ qua và báo lỗi trong kết quả
+    'BATCH_MAX_FACES': 64,
+    # Thời gian chờ tối đa cho cả lô ảnh của recognize_faces_batch
+    'BATCH_TIMEOUT_SECONDS': 60.0,
+    # Cạnh dài nhất (pixel) của ảnh dùng để phát hiện khuôn mặt; ảnh lớn hơn được thu nhỏ trước khi
+    # phát hiện, khuôn mặt vẫn được cắt từ ảnh gốc. None/0 = không thu nhỏ
+    'DETECTION_MAX_SIDE': 640,
+    # Backend phát hiện khuôn mặt (xem face_backends): 'deepface' (chuỗi DETECTOR_CASCADE qua DeepFace,
+    # cần TensorFlow) hoặc 'yunet' (OpenCV FaceDetectorYN, không cần DeepFace/TensorFlow)
+    'DETECTION_BACKEND': 'deepface',
+    # Tham số truyền cho backend phát hiện, ví dụ {'nms_threshold': 0.3} cho 'yunet'
+    'DETECTION_OPTIONS': {},
+    # File trọng số YuNet cho DETECTION_BACKEND='yunet'; None = file DeepFace tải về ~/.deepface/weights
+    'YUNET_MODEL_PATH': None,
+    # Chuỗi bộ phát hiện khuôn mặt (tên detector_backend của DeepFace). Các tầng trước là bộ phát hiện
+    # nhanh ('yunet', 'opencv'), chỉ được chấp nhận khi thấy đúng một khuôn mặt đủ tin cậy; tầng cuối
+    # (RetinaFace) chạy khi không thấy, thấy nhiều khuôn mặt hoặc độ tin cậy thấp
+    'DETECTOR_CASCADE': ['yunet', 'retinaface'],
+    # Độ tin cậy tối thiểu của từng bộ phát hiện nhanh (thang điểm khác nhau giữa các bộ phát hiện)
+    'DETECTOR_MIN_CONFIDENCE': {'yunet': 0.9, 'opencv': 0.0},
+    # Lọc nhanh khuôn mặt quá nhỏ/mờ/phẳng bằng LivenessDetector trước anti-spoofing và Facenet512.
+    # Tắt mặc định: các ngưỡng chưa được hiệu chỉnh trên ảnh thật/giả của kiosk
+    'LIVENESS_PREGATE': False,
+    # Tham số truyền cho LivenessDetector, ví dụ {'blur_threshold': 50.0, 'min_face_size': 50}
+    'LIVENESS_PREGATE_OPTIONS': {},
+    # Kiểm tra khuôn mặt thật/giả: 'fasnet' (FasNet của DeepFace, cần PyTorch) hoặc 'none' (chỉ dùng
+    # bước lọc nhanh LIVENESS_PREGATE nếu bật, để triển khai không cần PyTorch)
+    'ANTI_SPOOFING_BACKEND': 'fasnet',
+    # Mô hình trích xuất embedding: 'keras' (DeepFace/TensorFlow) hoặc 'onnx' (ONNX Runtime trên CPU,
+    # tạo file bằng lệnh export_embedding_model)
+    'EMBEDDING_BACKEND': 'keras',
+    # File ONNX; None = BASE_DIR/face_models/<model>.onnx
+    'EMBEDDING_ONNX_PATH': None,
+    # Số luồng ONNX Runtime cho mỗi tiến trình; 0 = để ONNX Runtime tự chọn
+    'EMBEDDING_ONNX_THREADS': 0,
+    # Số tiến trình suy luận (DeepFace/TensorFlow) dùng chung của mỗi worker web; 0 = chạy ngay trong luồng request
+    'INFERENCE_WORKERS': 0,
+    # Số yêu cầu được xếp hàng chờ ngoài số đang xử lý; hàng đợi đầy thì từ chối ngay (HTTP 503)
+    'INFERENCE_QUEUE_DEPTH': 16,
+    # Thời gian tối đa (giây) chờ kết quả của một ảnh, tính cả thời gian xếp hàng
+    'INFERENCE_TIMEOUT_SECONDS': 10.0,
+    # Gom khuôn mặt của các yêu cầu đồng thời để trích xuất embedding theo lô: lô được chạy khi đủ
+    # EMBEDDING_BATCH_SIZE khuôn mặt hoặc sau EMBEDDING_BATCH_WAIT_MS mili giây kể từ khuôn mặt đầu tiên
+    'EMBEDDING_BATCH_SIZE': 16,
+    'EMBEDDING_BATCH_WAIT_MS': 5.0,
+    # Kiểm tra file trọng số (xem lệnh stage_face_models) khi tiến trình web khởi động và dừng ngay
+    # nếu thiếu: None = không kiểm tra, 'size' = có file và đúng kích thước trong manifest,
+    # 'sha256' = tính lại checksum
+    'MODEL_ARTIFACTS_CHECK': None,
+    # Nạp mô hình và gallery trên luồng nền ngay khi tiến trình web khởi động (AppConfig.ready);
+    # endpoint /api/health/ trả về 503 cho tới khi nạp xong
+    'WARMUP_ON_STARTUP': False,
+    # Thời gian tối đa (giây) chờ các tiến trình suy luận nạp xong mô hình
+    'WARMUP_TIMEOUT_SECONDS': 300.0,
+    # Ngưỡng cosine distance cho recognize_face
+    'DISTANCE_THRESHOLD': 0.4,
+}
+
+
+def face_setting(name):
+    """Lấy một giá trị cấu hình nhận diện khuôn mặt, ưu tiên settings.FACE_RECOGNITION"""
+    overrides = getattr(settings, 'FACE_RECOGNITION', {}) or {}
+    if name in overrides:
+        return overrides[name]
+    return DEFAULTS[name]
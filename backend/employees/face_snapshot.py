@@ -0,0 +1,220 @@
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import namedtuple
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+
+from .face_settings import face_setting
+
+logger = logging.getLogger(__name__)
+
+# Cấu trúc thư mục snapshot:
+#
+#   <GALLERY_SNAPSHOT_DIR>/
+#       CURRENT                  tên thư mục snapshot đang dùng (thay bằng os.replace)
+#       snapshot-<timestamp>-<pid>/
+#           embeddings.npy       float32 (N x D) đã chuẩn hóa L2, sắp xếp theo ID FaceData
+#           face_data_ids.npy    int64 (N,)
+#           employee_ids.npy     unicode (N,)
+#           meta.json            model, số chiều, số mẫu, phiên bản gallery (GalleryChange) lúc ghi
+#
+# Mọi worker mở embeddings.npy bằng np.load(mmap_mode='r') nên dùng chung một bản
+# trong page cache. Snapshot mới được ghi vào thư mục tạm rồi đổi tên, sau đó
+# CURRENT mới được trỏ sang, nên worker không bao giờ đọc snapshot ghi dở.
+
+SNAPSHOT_FORMAT = 1
+POINTER_FILE = 'CURRENT'
+# Số snapshot cũ giữ lại cho worker còn đang mmap
+KEEP_SNAPSHOTS = 2
+
+GallerySnapshot = namedtuple('GallerySnapshot', ['embeddings', 'employee_ids', 'face_data_ids', 'meta', 'name'])
+
+
+def snapshot_dir():
+    """Thư mục chứa snapshot; mặc định không nằm trong MEDIA_ROOT vì MEDIA_ROOT được phục vụ công khai"""
+    configured = face_setting('GALLERY_SNAPSHOT_DIR')
+    return Path(configured) if configured else Path(settings.BASE_DIR) / 'gallery_snapshot'
+
+
+def write_snapshot(embeddings, employee_ids, face_data_ids, extra_meta=None):
+    """
+    Ghi snapshot gallery và chuyển CURRENT sang snapshot mới một cách nguyên tử
+
+    Args:
+        embeddings (numpy.ndarray): float32 (N x D) đã chuẩn hóa L2
+        employee_ids (numpy.ndarray): Mã nhân viên của từng dòng
+        face_data_ids (numpy.ndarray): ID FaceData của từng dòng (tăng dần)
+        extra_meta (dict): Thông tin bổ sung lưu vào meta.json
+
+    Returns:
+        Path: Thư mục snapshot vừa ghi
+    """
+    root = snapshot_dir()
+    root.mkdir(parents=True, exist_ok=True)
+    name = f"snapshot-{time.time_ns()}-{os.getpid()}"
+    tmp_dir = Path(tempfile.mkdtemp(prefix=f".{name}.", dir=root))
+    try:
+        np.save(tmp_dir / 'embeddings.npy', np.ascontiguousarray(embeddings, dtype=np.float32))
+        np.save(tmp_dir / 'face_data_ids.npy', np.asarray(face_data_ids, dtype=np.int64))
+        np.save(tmp_dir / 'employee_ids.npy', np.asarray(employee_ids, dtype=str))
+        meta = {
+            'format': SNAPSHOT_FORMAT,
+            'model_name': face_setting('MODEL_NAME'),
+            'template_scoring': face_setting('TEMPLATE_SCORING'),
+            'dim': int(embeddings.shape[1]),
+            'count': int(len(face_data_ids)),
+            'max_face_data_id': int(face_data_ids[-1]) if len(face_data_ids) else 0,
+            'created_at': time.time(),
+        }
+        meta.update(extra_meta or {})
+        (tmp_dir / 'meta.json').write_text(json.dumps(meta))
+        os.replace(tmp_dir, root / name)
+    except Exception:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+    pointer_tmp = root / f".{POINTER_FILE}.{os.getpid()}.{threading.get_ident()}"
+    pointer_tmp.write_text(name)
+    os.replace(pointer_tmp, root / POINTER_FILE)
+    logger.info(f"Đã ghi snapshot gallery {name} với {len(face_data_ids)} mẫu")
+
+    _cleanup_old_snapshots(root, name)
+    return root / name
+
+
+def _cleanup_old_snapshots(root, current):
+    snapshots = sorted(p for p in root.glob('snapshot-*') if p.is_dir() and p.name != current)
+    # Trên Linux, worker đang mmap tệp đã xóa vẫn đọc được cho tới khi đóng
+    for path in snapshots[:-(KEEP_SNAPSHOTS - 1) or None]:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def current_snapshot_name():
+    """Tên thư mục snapshot mà CURRENT đang trỏ tới, None nếu chưa có snapshot"""
+    try:
+        return (snapshot_dir() / POINTER_FILE).read_text().strip()
+    except FileNotFoundError:
+        return None
+
+
+def open_snapshot():
+    """
+    Mở snapshot hiện tại bằng memory-map
+
+    Returns:
+        GallerySnapshot | None: None nếu chưa có snapshot hoặc snapshot không khớp cấu hình
+    """
+    root = snapshot_dir()
+    try:
+        name = (root / POINTER_FILE).read_text().strip()
+        path = root / name
+        meta = json.loads((path / 'meta.json').read_text())
+        if (meta.get('format') != SNAPSHOT_FORMAT
+                or meta.get('model_name') != face_setting('MODEL_NAME')
+                or meta.get('template_scoring') != face_setting('TEMPLATE_SCORING')
+                or meta.get('dim') != face_setting('EMBEDDING_DIM')):
+            logger.info(f"Snapshot gallery {name} không khớp cấu hình hiện tại, bỏ qua")
+            return None
+        return GallerySnapshot(
+            np.load(path / 'embeddings.npy', mmap_mode='r'),
+            np.load(path / 'employee_ids.npy'),
+            np.load(path / 'face_data_ids.npy'),
+            meta,
+            name,
+        )
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.warning(f"Không thể mở snapshot gallery: {str(e)}")
+        return None
+
+
+def snapshot_version():
+    """Phiên bản gallery (GalleryChange) của snapshot CURRENT, None nếu chưa có snapshot đọc được"""
+    root = snapshot_dir()
+    try:
+        name = (root / POINTER_FILE).read_text().strip()
+        return json.loads((root / name / 'meta.json').read_text()).get('version')
+    except (OSError, ValueError):
+        return None
+
+
+def rebuild_snapshot(force=True):
+    """
+    Đọc toàn bộ embedding từ CSDL và ghi snapshot mới
+
+    Args:
+        force (bool): False thì bỏ qua khi snapshot CURRENT đã ở phiên bản gallery mới nhất (ví dụ
+            một worker khác vừa ghi)
+
+    Returns:
+        Path | None: Thư mục snapshot vừa ghi, None nếu bỏ qua
+    """
+    from .face_gallery import current_gallery_version, read_face_arrays
+
+    # Lấy phiên bản trước khi đọc: worker mở snapshot sẽ áp dụng lại các thay đổi xen giữa
+    version = current_gallery_version()
+    if not force:
+        written = snapshot_version()
+        if written is not None and written >= version:
+            logger.info(f"Snapshot gallery đã ở phiên bản {written}, không cần ghi lại")
+            return None
+    embeddings, employee_ids, face_data_ids = read_face_arrays()
+    return write_snapshot(embeddings, employee_ids, face_data_ids, extra_meta={'version': version})
+
+
+_rebuild_lock = threading.Lock()
+_rebuild_pending = threading.Event()
+_rebuild_thread = None
+
+
+def schedule_snapshot_rebuild():
+    """
+    Yêu cầu ghi lại snapshot ở luồng nền sau khi gallery thay đổi.
+
+    Các yêu cầu được gộp lại: luồng nền chờ tới khi không có thay đổi mới trong
+    GALLERY_SNAPSHOT_REBUILD_DELAY giây (nhưng không quá GALLERY_SNAPSHOT_REBUILD_MAX_DELAY giây kể
+    từ yêu cầu đầu tiên) rồi mới ghi một lần, và bỏ qua nếu worker khác đã ghi snapshot mới hơn.
+    """
+    global _rebuild_thread
+    if not face_setting('GALLERY_SNAPSHOT'):
+        return
+    _rebuild_pending.set()
+    with _rebuild_lock:
+        if _rebuild_thread is None or not _rebuild_thread.is_alive():
+            _rebuild_thread = threading.Thread(target=_rebuild_worker, name='gallery-snapshot', daemon=True)
+            _rebuild_thread.start()
+
+
+def _wait_for_quiet_period():
+    # Chờ tới khi không có yêu cầu mới trong delay giây, tối đa max_delay giây
+    delay = face_setting('GALLERY_SNAPSHOT_REBUILD_DELAY')
+    deadline = time.monotonic() + max(delay, face_setting('GALLERY_SNAPSHOT_REBUILD_MAX_DELAY'))
+    _rebuild_pending.clear()
+    while delay > 0:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0 or not _rebuild_pending.wait(min(delay, remaining)):
+            return
+        _rebuild_pending.clear()
+
+
+def _rebuild_worker():
+    from django.db import close_old_connections
+    from .face_gallery import prune_gallery_changes
+
+    while _rebuild_pending.is_set():
+        _wait_for_quiet_period()
+        try:
+            rebuild_snapshot(force=False)
+            prune_gallery_changes()
+        except Exception as e:
+            logger.error(f"Lỗi khi ghi snapshot gallery: {str(e)}")
+        finally:
+            close_old_connections()
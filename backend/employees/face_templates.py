@@ -0,0 +1,126 @@
+import logging
+
+import numpy as np
+
+from .face_encoding import decode_embedding
+from .face_settings import face_setting
+
+logger = logging.getLogger(__name__)
+
+# Cách chấm điểm khi một nhân viên có nhiều mẫu khuôn mặt:
+#   'max'      - mỗi mẫu là một dòng trong gallery, điểm của nhân viên là điểm mẫu giống nhất
+#   'centroid' - gộp các mẫu thành một vector trung tâm, gallery chỉ có một dòng mỗi nhân viên
+TEMPLATE_SCORING_MODES = ('max', 'centroid')
+
+# Chọn mẫu bị xóa khi nhân viên vượt quá MAX_TEMPLATES_PER_EMPLOYEE:
+#   'oldest'    - xóa mẫu đăng ký sớm nhất
+#   'redundant' - xóa mẫu giống các mẫu còn lại nhất, giữ các mẫu đa dạng (kính, râu, ánh sáng)
+TEMPLATE_EVICTION_POLICIES = ('oldest', 'redundant')
+
+
+def uses_centroids():
+    scoring = face_setting('TEMPLATE_SCORING')
+    if scoring not in TEMPLATE_SCORING_MODES:
+        raise ValueError(f"Cách chấm điểm mẫu khuôn mặt không hợp lệ: {scoring}")
+    return scoring == 'centroid'
+
+
+def aggregate_templates(embeddings, employee_ids, face_data_ids):
+    """
+    Gộp các mẫu của cùng một nhân viên thành vector trung tâm đã chuẩn hóa L2
+
+    Mỗi nhân viên được đại diện bởi ID FaceData nhỏ nhất trong các mẫu của mình.
+
+    Returns:
+        tuple: (embeddings, employee_ids, face_data_ids) với một dòng mỗi nhân viên
+    """
+    if not len(face_data_ids):
+        return embeddings, employee_ids, face_data_ids
+    keys, inverse = np.unique(np.asarray(employee_ids, dtype=str), return_inverse=True)
+    sums = np.zeros((len(keys), embeddings.shape[1]), dtype=np.float32)
+    np.add.at(sums, inverse, embeddings)
+    representative_ids = np.full(len(keys), np.iinfo(np.int64).max, dtype=np.int64)
+    np.minimum.at(representative_ids, inverse, np.asarray(face_data_ids, dtype=np.int64))
+
+    norms = np.linalg.norm(sums, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return sums / norms, keys.astype(object), representative_ids
+
+
+def enforce_template_cap(employee, keep_id=None):
+    """
+    Xóa bớt mẫu khuôn mặt khi nhân viên có nhiều hơn MAX_TEMPLATES_PER_EMPLOYEE mẫu
+
+    Args:
+        employee (Employee): Nhân viên cần kiểm tra
+        keep_id (int): ID FaceData không được xóa (thường là mẫu vừa đăng ký)
+
+    Returns:
+        list[int]: ID các bản ghi FaceData đã bị xóa
+    """
+    from .models import FaceData
+
+    cap = max(1, face_setting('MAX_TEMPLATES_PER_EMPLOYEE'))
+    templates = list(FaceData.objects.filter(employee=employee).order_by('created_at', 'id'))
+    excess = len(templates) - cap
+    if excess <= 0:
+        return []
+
+    policy = face_setting('TEMPLATE_EVICTION')
+    if policy == 'oldest':
+        victims = [t for t in templates if t.id != keep_id][:excess]
+    elif policy == 'redundant':
+        victims = _most_redundant(templates, excess, keep_id)
+    else:
+        raise ValueError(f"Chính sách loại bỏ mẫu khuôn mặt không hợp lệ: {policy}")
+
+    evicted = []
+    for template in victims:
+        evicted.append(template.id)
+        template.delete()
+    logger.info(
+        f"Nhân viên {employee.employee_id} vượt quá {cap} mẫu khuôn mặt, "
+        f"đã xóa {len(evicted)} mẫu theo chính sách '{policy}': {evicted}"
+    )
+    return evicted
+
+
+def _most_redundant(templates, count, keep_id):
+    # Mẫu không giải mã được bị xóa trước
+    vectors, valid, broken = [], [], []
+    for template in templates:
+        try:
+            record = decode_embedding(template.face_encoding)
+        except Exception:
+            record = None
+        if record is None or record.model_name != face_setting('MODEL_NAME'):
+            if template.id != keep_id:
+                broken.append(template)
+            continue
+        vectors.append(record.embedding)
+        valid.append(template)
+
+    victims = broken[:count]
+    remaining = count - len(victims)
+    if remaining <= 0 or len(valid) < 2:
+        return victims
+
+    matrix = np.stack(vectors)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    matrix /= norms
+    similarity = matrix @ matrix.T
+    np.fill_diagonal(similarity, -np.inf)
+
+    alive = np.ones(len(valid), dtype=bool)
+    protected = np.array([t.id == keep_id for t in valid], dtype=bool)
+    for _ in range(remaining):
+        # Độ trùng lặp của mỗi mẫu = độ tương đồng lớn nhất với một mẫu khác còn giữ lại
+        redundancy = np.where(alive[None, :], similarity, -np.inf).max(axis=1)
+        redundancy[~alive | protected] = -np.inf
+        victim = int(np.argmax(redundancy))
+        if not np.isfinite(redundancy[victim]):
+            break
+        alive[victim] = False
+        victims.append(valid[victim])
+    return victims
@@ -0,0 +1,156 @@
+import logging
+import threading
+import time
+import weakref
+
+import numpy as np
+from django.utils import timezone
+
+from .face_settings import face_setting
+
+logger = logging.getLogger(__name__)
+
+MINUTES_PER_DAY = 24 * 60
+
+
+def _minutes_of_day(value):
+    return value.hour * 60 + value.minute + value.second / 60.0
+
+
+def on_shift_employee_ids(now=None, window_minutes=None):
+    """
+    Mã các nhân viên đang hoạt động có giờ bắt đầu hoặc kết thúc ca gần thời điểm now
+
+    Khoảng cách giờ được tính vòng quanh nửa đêm nên ca qua đêm (ví dụ 22:00 - 06:00)
+    và thời điểm 23:50 / 00:10 đều được xử lý đúng.
+
+    Args:
+        now (datetime): Mặc định là thời điểm hiện tại (theo múi giờ TIME_ZONE)
+        window_minutes (int): Độ rộng cửa sổ quanh giờ vào/ra ca, mặc định theo FACE_RECOGNITION
+    """
+    from .models import Employee
+
+    window = face_setting('SHIFT_TIER_WINDOW_MINUTES') if window_minutes is None else window_minutes
+    current = _minutes_of_day(timezone.localtime(now or timezone.now()))
+    rows = list(
+        Employee.objects.filter(is_active=True, shift__isnull=False)
+        .values_list('employee_id', 'shift__start_time', 'shift__end_time')
+    )
+    if not rows:
+        return []
+
+    employee_ids, starts, ends = zip(*rows)
+    boundaries = np.array(
+        [[_minutes_of_day(start), _minutes_of_day(end)] for start, end in zip(starts, ends)],
+        dtype=np.float64,
+    )
+    distance = np.abs(boundaries - current) % MINUTES_PER_DAY
+    distance = np.minimum(distance, MINUTES_PER_DAY - distance)
+    near = (distance <= window).any(axis=1)
+    return [employee_id for employee_id, keep in zip(employee_ids, near) if keep]
+
+
+class ShiftTier:
+    """
+    Gallery con gồm các nhân viên sắp vào ca hoặc sắp tan ca, được tìm trước gallery đầy đủ.
+
+    Gallery con được tạo lại khi hết hạn (SHIFT_TIER_REFRESH_SECONDS, vì tập nhân viên phụ thuộc
+    giờ hiện tại) hoặc khi gallery gốc đổi phiên bản. Thay đổi Employee/Shift đều ghi GalleryChange
+    nên mọi worker tạo lại gallery con ngay ở lần đồng bộ tiếp theo.
+
+    Mỗi gallery gốc (gallery đầy đủ hoặc một phân vùng theo phòng ban) có gallery con riêng.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # gallery gốc -> (phiên bản, thời điểm hết hạn, gallery con)
+        self._cache = weakref.WeakKeyDictionary()
+
+    def get(self, gallery):
+        cached = self._cache.get(gallery)
+        if cached is not None and cached[0] == gallery.version and time.monotonic() < cached[1]:
+            return cached[2]
+
+        with self._lock:
+            cached = self._cache.get(gallery)
+            if cached is not None and cached[0] == gallery.version and time.monotonic() < cached[1]:
+                return cached[2]
+            version = gallery.version
+            sub_gallery = gallery.subset(on_shift_employee_ids())
+            expires = time.monotonic() + face_setting('SHIFT_TIER_REFRESH_SECONDS')
+            self._cache[gallery] = (version, expires, sub_gallery)
+            logger.info(f"Đã tạo gallery theo ca làm việc với {len(sub_gallery)}/{len(gallery)} mẫu")
+            return sub_gallery
+
+
+class DepartmentPartitions:
+    """
+    Phân vùng gallery theo tập phòng ban (mỗi kiosk/địa điểm một phân vùng trong bộ nhớ).
+
+    Chi phí quét và rủi ro nhận nhầm giảm theo kích thước phân vùng. Phân vùng được tạo lại
+    khi gallery gốc đổi phiên bản (ví dụ nhân viên chuyển phòng ban).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # gallery gốc -> {tập phòng ban: (phiên bản, phân vùng)}
+        self._cache = weakref.WeakKeyDictionary()
+
+    def get(self, gallery, department_names):
+        from .models import Employee
+
+        key = frozenset(department_names)
+        cached = self._cache.get(gallery, {}).get(key)
+        if cached is not None and cached[0] == gallery.version:
+            return cached[1]
+
+        with self._lock:
+            partitions = self._cache.setdefault(gallery, {})
+            cached = partitions.get(key)
+            if cached is not None and cached[0] == gallery.version:
+                return cached[1]
+            version = gallery.version
+            employee_ids = Employee.objects.filter(
+                is_active=True, department__name__in=key
+            ).values_list('employee_id', flat=True)
+            partition = gallery.subset(list(employee_ids))
+            partitions[key] = (version, partition)
+            logger.info(
+                f"Đã tạo phân vùng gallery cho phòng ban {sorted(key)} với {len(partition)}/{len(gallery)} mẫu"
+            )
+            return partition
+
+
+_shift_tier = ShiftTier()
+_department_partitions = DepartmentPartitions()
+
+
+def department_partition(gallery, department_names):
+    """Gallery con chỉ gồm nhân viên thuộc department_names; trả về gallery gốc nếu không giới hạn"""
+    if not department_names:
+        return gallery
+    return _department_partitions.get(gallery, department_names)
+
+
+def search_shift_tiered(gallery, embedding, top_k=1, min_similarity=None, per_employee=False):
+    """
+    Tìm trong gallery con theo ca làm việc trước, chỉ quét gallery đầy đủ khi không có
+    ứng viên nào đạt SHIFT_TIER_ACCEPT_SIMILARITY
+
+    Returns:
+        tuple: (list[GalleryMatch], tên tầng đã dùng: 'shift' hoặc 'full')
+    """
+    if face_setting('SHIFT_TIER'):
+        accept = face_setting('SHIFT_TIER_ACCEPT_SIMILARITY')
+        if accept is None:
+            accept = 1.0 - face_setting('DISTANCE_THRESHOLD')
+        sub_gallery = _shift_tier.get(gallery)
+        if len(sub_gallery):
+            matches = sub_gallery.search(
+                embedding, top_k=top_k, min_similarity=min_similarity, per_employee=per_employee
+            )
+            if matches and matches[0].similarity >= accept:
+                return matches, 'shift'
+
+    matches = gallery.search(embedding, top_k=top_k, min_similarity=min_similarity, per_employee=per_employee)
+    return matches, 'full'
@@ -0,0 +1,135 @@
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+
+from .face_preload import process_memory
+from .face_settings import face_setting
+
+logger = logging.getLogger(__name__)
+
+# Kích thước ảnh giả dùng để chạy thử (cao, rộng), giống khung hình webcam
+WARMUP_IMAGE_SHAPE = (480, 640)
+
+_state_lock = threading.Lock()
+_state = {
+    'status': 'idle',  # idle: chưa chạy, warming: đang nạp, ready: sẵn sàng, failed: lỗi
+    'error': None,
+    'started_at': None,
+    'finished_at': None,
+    'timings_ms': {},
+    'workers': {},
+}
+
+_process_lock = threading.Lock()
+_process_timings = None
+
+
+def _timed(timings, name, func):
+    started = time.perf_counter()
+    result = func()
+    timings[name] = round((time.perf_counter() - started) * 1000.0, 1)
+    return result
+
+
+def warmup_pipeline():
+    """
+    Nạp mọi mô hình mà pipeline đang cấu hình cần và chạy thử một lần trên ảnh giả
+
+    Gồm bộ phát hiện (DETECTION_BACKEND, mọi tầng của DETECTOR_CASCADE), LivenessDetector,
+    anti-spoofing (ANTI_SPOOFING_BACKEND) và mô hình embedding (EMBEDDING_BACKEND), cả đường chạy
+    một khuôn mặt lẫn theo lô.
+
+    Returns:
+        dict: Thời gian (mili giây) của từng bước
+    """
+    from .face_backends import get_detector
+    from .face_pipeline import check_spoofing, embed_faces, get_liveness_detector
+
+    timings = {}
+    image = np.random.default_rng(0).integers(0, 256, WARMUP_IMAGE_SHAPE + (3,), dtype=np.uint8)
+    height, width = WARMUP_IMAGE_SHAPE
+    facial_area = {'x': width // 4, 'y': height // 4, 'w': width // 2, 'h': height // 2}
+    crop = np.ascontiguousarray(image[facial_area['y']:facial_area['y'] + facial_area['h'],
+                                      facial_area['x']:facial_area['x'] + facial_area['w']])
+
+    timings.update(get_detector().warmup(image))
+
+    if face_setting('LIVENESS_PREGATE'):
+        _timed(timings, 'liveness_pregate', lambda: get_liveness_detector().check_liveness(crop))
+    _timed(timings, 'anti_spoofing', lambda: check_spoofing(image, facial_area))
+    _timed(timings, 'embedding', lambda: embed_faces([crop]))
+    _timed(timings, 'embedding_batch', lambda: embed_faces([crop, crop]))
+    return timings
+
+
+def warmup_process():
+    """Chạy warmup_pipeline một lần cho tiến trình hiện tại; các lần gọi sau trả lại kết quả đã có"""
+    global _process_timings
+    with _process_lock:
+        if _process_timings is None:
+            started = time.perf_counter()
+            _process_timings = warmup_pipeline()
+            logger.info(
+                f"Tiến trình {os.getpid()} đã nạp mô hình nhận diện trong "
+                f"{time.perf_counter() - started:.1f} giây: {_process_timings}"
+            )
+        return _process_timings
+
+
+def warmup(timeout=None):
+    """
+    Nạp mô hình cho dịch vụ suy luận và gallery khuôn mặt, cập nhật cờ sẵn sàng
+
+    Khi INFERENCE_WORKERS > 0 mô hình được nạp trong các tiến trình suy luận, không phải trong
+    tiến trình web.
+
+    Returns:
+        dict: Trạng thái sẵn sàng (xem readiness)
+    """
+    from .face_gallery import get_face_gallery
+    from .face_service import get_recognition_service
+
+    timeout = face_setting('WARMUP_TIMEOUT_SECONDS') if timeout is None else timeout
+    with _state_lock:
+        _state.update(status='warming', error=None, started_at=time.time(), finished_at=None)
+
+    timings = {}
+    try:
+        workers = _timed(timings, 'models', lambda: get_recognition_service().warmup(timeout=timeout))
+        _timed(timings, 'gallery', get_face_gallery)
+    except Exception as e:
+        logger.error(f"Nạp mô hình nhận diện thất bại: {str(e)}")
+        with _state_lock:
+            _state.update(status='failed', error=str(e), finished_at=time.time(), timings_ms=timings)
+        return readiness()
+
+    with _state_lock:
+        _state.update(status='ready', finished_at=time.time(), timings_ms=timings, workers=workers)
+    logger.info(
+        f"Nhận diện khuôn mặt sẵn sàng sau {timings['models'] + timings['gallery']:.0f} ms, "
+        f"bộ nhớ {process_memory()}"
+    )
+    return readiness()
+
+
+def start_warmup():
+    """Chạy warmup trên luồng nền (một lần cho mỗi tiến trình); trả về False nếu đã chạy trước đó"""
+    with _state_lock:
+        if _state['status'] != 'idle':
+            return False
+        _state['status'] = 'warming'
+    threading.Thread(target=warmup, name='face-warmup', daemon=True).start()
+    return True
+
+
+def readiness():
+    """Trạng thái nạp mô hình của tiến trình web hiện tại, dùng cho endpoint health"""
+    with _state_lock:
+        state = dict(_state)
+    state['ready'] = state['status'] == 'ready'
+    state['pid'] = os.getpid()
+    state['memory_mb'] = process_memory()
+    return state
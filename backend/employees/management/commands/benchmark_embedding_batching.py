@@ -0,0 +1,73 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from employees import face_pipeline
+from employees.face_batching import MicroBatcher, latency_summary
+from employees.face_settings import face_setting
+
+
+class Command(BaseCommand):
+    help = (
+        'Đo thông lượng và độ trễ tăng thêm khi gom lô trích xuất embedding '
+        '(mô phỏng nhiều kiosk điểm danh cùng lúc lúc đổi ca)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-sizes', nargs='+', type=int, default=[1, 4, 8, 16, 32],
+                            help='Các kích thước lô tối đa cần đo (1 = không gom lô)')
+        parser.add_argument('--max-wait-ms', type=float, default=face_setting('EMBEDDING_BATCH_WAIT_MS'),
+                            help='Thời gian gom lô tối đa (mili giây)')
+        parser.add_argument('--concurrency', type=int, default=32,
+                            help='Số yêu cầu gửi đồng thời (mặc định 32)')
+        parser.add_argument('--requests', type=int, default=256,
+                            help='Tổng số khuôn mặt cho mỗi cấu hình (mặc định 256)')
+        parser.add_argument('--crop-size', type=int, default=160,
+                            help='Kích thước khuôn mặt đã căn chỉnh (pixel)')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        if options['requests'] <= 0 or options['concurrency'] <= 0:
+            raise CommandError('--requests và --concurrency phải lớn hơn 0')
+
+        rng = np.random.default_rng(options['seed'])
+        size = options['crop_size']
+        crops = [rng.integers(0, 256, (size, size, 3), dtype=np.uint8) for _ in range(options['requests'])]
+
+        # Nạp mô hình trước để lần đo đầu không tính thời gian khởi tạo
+        started = time.perf_counter()
+        face_pipeline.embed_faces(crops[:1])
+        self.stdout.write(f"Nạp mô hình {face_setting('MODEL_NAME')}: {time.perf_counter() - started:.2f} giây")
+        self.stdout.write(
+            f"{len(crops)} khuôn mặt, {options['concurrency']} yêu cầu đồng thời, "
+            f"gom lô tối đa {options['max_wait_ms']} ms"
+        )
+        self.stdout.write(
+            f"{'Lô tối đa':<10}{'Ảnh/giây':>10}{'p50 (ms)':>10}{'p95 (ms)':>10}"
+            f"{'Chờ gom (ms)':>14}{'Lô TB':>8}{'Số lô':>8}"
+        )
+
+        for batch_size in options['batch_sizes']:
+            batcher = MicroBatcher(
+                face_pipeline.embed_faces, max_batch_size=batch_size, max_wait_ms=options['max_wait_ms'],
+                name=f'benchmark-batcher-{batch_size}'
+            )
+
+            def run_one(crop):
+                begin = time.perf_counter()
+                batcher.submit(crop).result()
+                return time.perf_counter() - begin
+
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=options['concurrency']) as pool:
+                latencies = list(pool.map(run_one, crops))
+            elapsed = time.perf_counter() - started
+
+            latency = latency_summary(latencies)
+            stats = batcher.stats()
+            self.stdout.write(
+                f"{batch_size:<10}{len(crops) / elapsed:>10.1f}{latency['p50']:>10.1f}{latency['p95']:>10.1f}"
+                f"{stats['mean_added_latency_ms']:>14.2f}{stats['mean_batch_size']:>8.1f}{stats['batches']:>8}"
+            )
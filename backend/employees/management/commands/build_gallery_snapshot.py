@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from employees.face_snapshot import open_snapshot, rebuild_snapshot
+
+
+class Command(BaseCommand):
+    help = (
+        'Ghi snapshot gallery khuôn mặt ra đĩa để các worker mở chung bằng memory-map. '
+        'Nên chạy trước khi khởi động máy chủ để worker đầu tiên không phải đọc cả bảng FaceData.'
+    )
+
+    def handle(self, *args, **options):
+        path = rebuild_snapshot()
+        snapshot = open_snapshot()
+        count = snapshot.meta['count'] if snapshot is not None else 0
+        size_mb = snapshot.embeddings.nbytes / 2 ** 20 if snapshot is not None else 0.0
+        self.stdout.write(self.style.SUCCESS(
+            f"Đã ghi snapshot {path.name}: {count} mẫu, {size_mb:.2f} MB embedding"
+        ))
@@ -0,0 +1,121 @@
+import time
+from pathlib import Path
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from employees.face_backends import KerasEmbedder
+from employees.face_onnx import OnnxEmbedder, export_onnx_model, onnx_model_path
+from employees.face_pipeline import decode_image, inspect_face
+from employees.face_settings import face_setting
+from employees.models import FaceData
+
+IMAGE_SUFFIXES = {'.jpg', '.jpeg', '.png', '.bmp', '.webp'}
+
+
+class Command(BaseCommand):
+    help = (
+        'Xuất mô hình embedding của DeepFace sang ONNX (tùy chọn lượng tử hóa int8) và kiểm tra '
+        'khoảng cách cosine so với mô hình Keras trên tập ảnh mẫu'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default=None,
+                            help='File ONNX cần ghi (mặc định EMBEDDING_ONNX_PATH hoặc face_models/<model>.onnx)')
+        parser.add_argument('--quantize', action='store_true',
+                            help='Lượng tử hóa động trọng số sang int8')
+        parser.add_argument('--opset', type=int, default=13)
+        parser.add_argument('--check-only', action='store_true',
+                            help='Không xuất lại, chỉ kiểm tra file ONNX đã có')
+        parser.add_argument('--no-check', action='store_true',
+                            help='Bỏ qua bước kiểm tra sai khác so với mô hình Keras')
+        parser.add_argument('--samples', default=None,
+                            help='Thư mục ảnh mẫu; mặc định dùng ảnh khuôn mặt đã đăng ký trong CSDL')
+        parser.add_argument('--limit', type=int, default=50,
+                            help='Số ảnh mẫu tối đa (mặc định 50)')
+        parser.add_argument('--tolerance', type=float, default=None,
+                            help='Sai khác khoảng cách cosine tối đa cho phép (mặc định 0.01, 0.03 khi --quantize)')
+
+    def handle(self, *args, **options):
+        path = Path(options['output']) if options['output'] else onnx_model_path()
+
+        if not options['check_only']:
+            try:
+                started = time.perf_counter()
+                export_onnx_model(path, opset=options['opset'], quantize=options['quantize'])
+            except ImportError as e:
+                raise CommandError(f"Thiếu thư viện để xuất mô hình ({str(e)}). Cài bằng: pip install -r requirements-export.txt")
+            self.stdout.write(
+                f"Đã xuất {face_setting('MODEL_NAME')} sang {path} "
+                f"({path.stat().st_size / 1024 / 1024:.1f} MB, {time.perf_counter() - started:.1f} giây)"
+            )
+        elif not path.exists():
+            raise CommandError(f"Không tìm thấy file ONNX {path}")
+
+        if options['no_check']:
+            return
+
+        tolerance = options['tolerance']
+        if tolerance is None:
+            tolerance = 0.03 if options['quantize'] else 0.01
+        self._check_parity(path, options['samples'], options['limit'], tolerance)
+
+    def _check_parity(self, path, samples, limit, tolerance):
+        crops = self._load_crops(samples, limit)
+        if len(crops) < 2:
+            raise CommandError('Cần ít nhất 2 ảnh mẫu có đúng một khuôn mặt để kiểm tra (dùng --samples)')
+
+        started = time.perf_counter()
+        reference = np.asarray(KerasEmbedder().embed(crops), dtype=np.float64)
+        keras_ms = (time.perf_counter() - started) * 1000 / len(crops)
+
+        embedder = OnnxEmbedder(path, threads=face_setting('EMBEDDING_ONNX_THREADS'))
+        embedder.embed(crops[:1])
+        started = time.perf_counter()
+        candidate = np.asarray(embedder.embed(crops), dtype=np.float64)
+        onnx_ms = (time.perf_counter() - started) * 1000 / len(crops)
+
+        reference /= np.linalg.norm(reference, axis=1, keepdims=True)
+        candidate /= np.linalg.norm(candidate, axis=1, keepdims=True)
+
+        # Khoảng cách giữa embedding Keras và ONNX của cùng một khuôn mặt
+        self_distance = 1.0 - np.sum(reference * candidate, axis=1)
+        # Sai khác của ma trận khoảng cách giữa các khuôn mặt (giá trị dùng để so với DISTANCE_THRESHOLD)
+        pairwise_error = np.abs((reference @ reference.T) - (candidate @ candidate.T))
+
+        self.stdout.write(f"{len(crops)} khuôn mặt mẫu")
+        self.stdout.write(
+            f"Khoảng cách Keras-ONNX cùng khuôn mặt: trung bình {self_distance.mean():.5f}, "
+            f"lớn nhất {self_distance.max():.5f}"
+        )
+        self.stdout.write(
+            f"Sai khác khoảng cách giữa các khuôn mặt: trung bình {pairwise_error.mean():.5f}, "
+            f"lớn nhất {pairwise_error.max():.5f} (cho phép {tolerance})"
+        )
+        self.stdout.write(f"Thời gian mỗi khuôn mặt (lô {len(crops)}): Keras {keras_ms:.1f} ms, ONNX {onnx_ms:.1f} ms")
+
+        if max(self_distance.max(), pairwise_error.max()) > tolerance:
+            raise CommandError('Mô hình ONNX sai khác quá ngưỡng so với mô hình Keras, không nên dùng EMBEDDING_BACKEND=onnx')
+        self.stdout.write(self.style.SUCCESS('Mô hình ONNX khớp với mô hình Keras trong ngưỡng cho phép'))
+
+    def _load_crops(self, samples, limit):
+        if samples:
+            paths = sorted(p for p in Path(samples).iterdir() if p.suffix.lower() in IMAGE_SUFFIXES)
+        else:
+            paths = [
+                Path(face_data.image.path)
+                for face_data in FaceData.objects.exclude(image='').order_by('-created_at')[:limit * 2]
+            ]
+
+        crops = []
+        for path in paths:
+            if len(crops) >= limit:
+                break
+            try:
+                _, crop = inspect_face(decode_image(path.read_bytes()))
+            except Exception as e:
+                self.stderr.write(f"Bỏ qua {path}: {str(e)}")
+                continue
+            if crop is not None:
+                crops.append(crop)
+        return crops
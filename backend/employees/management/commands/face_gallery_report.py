@@ -0,0 +1,113 @@
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from employees.face_compression import COMPRESSION_BACKENDS, create_compressor
+from employees.face_gallery import FaceGallery, decode_face_encoding, l2_normalize
+from employees.face_settings import face_setting
+from employees.models import FaceData
+
+
+class Command(BaseCommand):
+    help = (
+        'Báo cáo bộ nhớ mỗi mẫu và độ phủ (recall) của các kiểu nén gallery '
+        'so với gallery float32 không nén'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--modes', nargs='+', choices=sorted(COMPRESSION_BACKENDS),
+                            default=['none', 'int8', 'pca', 'pq'],
+                            help='Các kiểu nén cần đánh giá')
+        parser.add_argument('--queries', type=int, default=200,
+                            help='Số truy vấn lấy mẫu từ gallery (mặc định 200)')
+        parser.add_argument('--top-k', type=int, default=10,
+                            help='Tính recall trên top-k ứng viên (mặc định 10)')
+        parser.add_argument('--noise', type=float, default=0.03,
+                            help='Độ lệch chuẩn nhiễu cộng vào mỗi truy vấn để mô phỏng ảnh chụp mới')
+        parser.add_argument('--synthetic', type=int, default=0,
+                            help='Dùng N embedding ngẫu nhiên thay cho dữ liệu trong CSDL')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(options['seed'])
+        dim = face_setting('EMBEDDING_DIM')
+        embeddings, face_data_ids = self._load_embeddings(options['synthetic'], dim, rng)
+        if not len(face_data_ids):
+            raise CommandError('Không có dữ liệu khuôn mặt nào để đánh giá (dùng --synthetic N để thử)')
+
+        employee_ids = face_data_ids.astype(object)
+        top_k = min(options['top_k'], len(face_data_ids))
+        query_rows = rng.choice(len(face_data_ids), min(options['queries'], len(face_data_ids)), replace=False)
+        queries = embeddings[query_rows] + options['noise'] * rng.standard_normal((len(query_rows), dim))
+
+        full_vectors = dict(zip(face_data_ids.tolist(), embeddings))
+
+        def vector_loader(ids):
+            return {int(i): full_vectors[int(i)] for i in ids if int(i) in full_vectors}
+
+        baseline = FaceGallery(dim)
+        baseline.load_arrays(embeddings, employee_ids, face_data_ids)
+        expected = [[m.face_data_id for m in baseline.search(q, top_k)] for q in queries]
+
+        self.stdout.write(
+            f"Gallery: {len(face_data_ids)} mẫu, {len(queries)} truy vấn, top-{top_k}, "
+            f"float32 = {dim * 4} byte/mẫu"
+        )
+        self.stdout.write(
+            f"{'Kiểu nén':<10}{'Byte/mẫu':>12}{'Tổng (MB)':>12}"
+            f"{'Recall nén':>14}{'Recall rerank':>16}{'Top-1 khớp':>13}{'ms/truy vấn':>14}"
+        )
+
+        for mode in options['modes']:
+            # Tham số nén trong settings chỉ áp dụng cho kiểu nén đang được cấu hình
+            mode_options = {}
+            if mode == face_setting('GALLERY_COMPRESSION'):
+                mode_options = face_setting('GALLERY_COMPRESSION_OPTIONS')
+            compressor = create_compressor(mode, **mode_options)
+            gallery = FaceGallery(dim, compressor=compressor, rerank_k=face_setting('GALLERY_RERANK_K'))
+            gallery.load_arrays(embeddings, employee_ids, face_data_ids)
+
+            # Recall chỉ dùng điểm xấp xỉ trên dữ liệu nén
+            approximate = [[m.face_data_id for m in gallery.search(q, top_k)] for q in queries]
+
+            # Recall sau khi chấm lại bằng vector đầy đủ (cách gallery chạy thật)
+            gallery.vector_loader = vector_loader
+            started = time.perf_counter()
+            reranked = [[m.face_data_id for m in gallery.search(q, top_k)] for q in queries]
+            elapsed_ms = (time.perf_counter() - started) * 1000 / len(queries)
+
+            self.stdout.write(
+                f"{mode:<10}{gallery.nbytes / len(gallery):>12.1f}{gallery.nbytes / 2 ** 20:>12.2f}"
+                f"{self._recall(expected, approximate):>14.3f}{self._recall(expected, reranked):>16.3f}"
+                f"{self._top1(expected, reranked):>13.3f}{elapsed_ms:>14.2f}"
+            )
+
+    def _load_embeddings(self, synthetic, dim, rng):
+        if synthetic:
+            embeddings = l2_normalize(rng.standard_normal((synthetic, dim)).astype(np.float32))
+            return embeddings, np.arange(1, synthetic + 1, dtype=np.int64)
+
+        vectors, face_data_ids = [], []
+        for face_data_id, blob in FaceData.objects.values_list('id', 'face_encoding').iterator():
+            try:
+                embedding = decode_face_encoding(blob)
+            except Exception:
+                continue
+            if embedding is not None and embedding.shape == (dim,):
+                vectors.append(embedding)
+                face_data_ids.append(face_data_id)
+        if not vectors:
+            return np.empty((0, dim), dtype=np.float32), np.empty(0, dtype=np.int64)
+        return l2_normalize(np.stack(vectors)), np.array(face_data_ids, dtype=np.int64)
+
+    @staticmethod
+    def _recall(expected, actual):
+        hits = sum(len(set(e) & set(a)) for e, a in zip(expected, actual))
+        total = sum(len(e) for e in expected)
+        return hits / total if total else 0.0
+
+    @staticmethod
+    def _top1(expected, actual):
+        agree = sum(1 for e, a in zip(expected, actual) if e[:1] == a[:1])
+        return agree / len(expected) if expected else 0.0
@@ -0,0 +1,122 @@
+import json
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from employees.face_backends import backend_summary
+from employees.face_preload import preload_for_fork, process_memory
+
+
+class Command(BaseCommand):
+    help = (
+        'So sánh bộ nhớ của từng worker prefork khi master nạp trước (preload_for_fork) và khi '
+        'không nạp trước: fork một master cho mỗi chế độ, master fork các worker, mỗi worker nạp '
+        'pipeline rồi báo rss/pss/private trong lúc mọi worker còn sống'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=2, help='Số worker cho mỗi chế độ (mặc định 2)')
+        parser.add_argument('--gallery-only', action='store_true',
+                            help='Worker chỉ nạp gallery, không nạp mô hình (máy không có DeepFace/ONNX Runtime)')
+
+    def handle(self, *args, **options):
+        if not hasattr(os, 'fork'):
+            raise CommandError('Cần hệ điều hành hỗ trợ fork (Linux)')
+        if options['workers'] <= 0:
+            raise CommandError('--workers phải lớn hơn 0')
+
+        backends = backend_summary()
+        self.stdout.write(
+            f"{options['workers']} worker; phát hiện: {backends['detection']}, anti-spoofing: "
+            f"{backends['anti_spoofing']}, embedding: {backends['embedding']}"
+            f"{' (chỉ nạp gallery)' if options['gallery_only'] else ''}"
+        )
+        self.stdout.write(
+            f"{'Chế độ':<10}{'Master PSS':>12}{'RSS/worker':>12}{'PSS/worker':>12}"
+            f"{'Riêng/worker':>14}{'Tổng PSS':>10}  (MB)"
+        )
+        # Kết nối CSDL không được dùng chung giữa các tiến trình
+        connections.close_all()
+        for preload in (False, True):
+            result = _run_in_child(lambda: _measure(preload, options['workers'], options['gallery_only']))
+            if 'error' in result:
+                raise CommandError(f"Đo thất bại: {result['error']}")
+            workers = result['workers']
+            average = lambda key: sum(worker.get(key, 0.0) for worker in workers) / len(workers)
+            total = result['master'].get('pss', 0.0) + sum(worker.get('pss', 0.0) for worker in workers)
+            self.stdout.write(
+                f"{'preload' if preload else 'lazy':<10}{result['master'].get('pss', 0.0):>12.1f}"
+                f"{average('rss'):>12.1f}{average('pss'):>12.1f}{average('private'):>14.1f}{total:>10.1f}"
+            )
+
+
+def _measure(preload, count, gallery_only):
+    """Chạy trong master giả lập: nạp trước (tùy chế độ), fork worker và thu bộ nhớ của chúng"""
+    if preload:
+        preload_for_fork()
+    connections.close_all()
+
+    def load():
+        from employees.face_gallery import get_face_gallery
+        from employees.face_warmup import warmup_process
+
+        if not gallery_only:
+            warmup_process()
+        get_face_gallery()
+
+    release_read, release_write = os.pipe()
+    workers = []
+    for _ in range(count):
+        report_read, report_write = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(release_write)
+            os.close(report_read)
+            try:
+                load()
+                report = {'memory': process_memory()}
+            except Exception as e:
+                report = {'error': str(e)}
+            with os.fdopen(report_write, 'w') as stream:
+                stream.write(json.dumps(report))
+            # Giữ worker sống tới khi master đo xong mọi worker: PSS chia trang dùng chung cho các
+            # tiến trình đang dùng nó
+            os.read(release_read, 1)
+            os._exit(0)
+        os.close(report_write)
+        workers.append((pid, report_read))
+
+    reports = []
+    for pid, report_read in workers:
+        with os.fdopen(report_read) as stream:
+            reports.append(json.loads(stream.read() or '{"error": "worker thoát bất thường"}'))
+    master = process_memory()
+    os.close(release_write)
+    for pid, _ in workers:
+        os.waitpid(pid, 0)
+
+    errors = [report['error'] for report in reports if 'error' in report]
+    if errors:
+        return {'error': errors[0]}
+    return {'master': master, 'workers': [report['memory'] for report in reports]}
+
+
+def _run_in_child(func):
+    """Chạy func trong tiến trình con để mỗi chế độ bắt đầu từ cùng một trạng thái bộ nhớ"""
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        try:
+            result = func()
+        except Exception as e:
+            result = {'error': str(e)}
+        with os.fdopen(write_fd, 'w') as stream:
+            stream.write(json.dumps(result))
+        os._exit(0)
+    os.close(write_fd)
+    with os.fdopen(read_fd) as stream:
+        output = stream.read()
+    os.waitpid(pid, 0)
+    return json.loads(output or '{"error": "tiến trình đo thoát bất thường"}')
@@ -0,0 +1,83 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from employees.face_encoding import DTYPE_CODES, decode_embedding, encode_embedding, is_legacy_encoding
+from employees.face_settings import face_setting
+from employees.models import FaceData
+
+
+class Command(BaseCommand):
+    help = (
+        'Chuyển FaceData.face_encoding từ pickle cũ sang định dạng nhị phân theo từng lô. '
+        'Mỗi lô được commit riêng nên có thể dừng và chạy lại để tiếp tục.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Số bản ghi FaceData mỗi lô (mặc định 500)')
+        parser.add_argument('--start-id', type=int, default=0,
+                            help='Chỉ xử lý bản ghi có ID lớn hơn giá trị này (dùng để tiếp tục)')
+        parser.add_argument('--dtype', choices=sorted(DTYPE_CODES), default=None,
+                            help='Kiểu dữ liệu lưu embedding, mặc định theo FACE_RECOGNITION')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Chỉ thống kê, không ghi vào CSDL')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        if batch_size <= 0:
+            raise CommandError('--batch-size phải lớn hơn 0')
+        dtype = options['dtype'] or face_setting('EMBEDDING_DTYPE')
+        dry_run = options['dry_run']
+
+        last_id = options['start_id']
+        converted = skipped = invalid = 0
+
+        while True:
+            # Phân trang theo ID (keyset) để mỗi lô chỉ đọc đúng batch_size bản ghi
+            batch = list(
+                FaceData.objects.filter(id__gt=last_id)
+                .order_by('id')
+                .only('id', 'face_encoding')[:batch_size]
+            )
+            if not batch:
+                break
+
+            to_update = []
+            for face_data in batch:
+                if not is_legacy_encoding(face_data.face_encoding):
+                    skipped += 1
+                    continue
+                try:
+                    record = decode_embedding(face_data.face_encoding)
+                except Exception as e:
+                    invalid += 1
+                    self.stderr.write(f"Không giải mã được dữ liệu khuôn mặt ID {face_data.id}: {str(e)}")
+                    continue
+                if record is None:
+                    invalid += 1
+                    self.stderr.write(f"Dữ liệu khuôn mặt ID {face_data.id} không chứa embedding, bỏ qua")
+                    continue
+
+                face_data.face_encoding = encode_embedding(
+                    record.embedding,
+                    model_name=record.model_name,
+                    dtype=dtype,
+                    liveness_score=record.liveness_score
+                )
+                to_update.append(face_data)
+
+            if to_update and not dry_run:
+                with transaction.atomic():
+                    FaceData.objects.bulk_update(to_update, ['face_encoding'])
+
+            converted += len(to_update)
+            last_id = batch[-1].id
+            self.stdout.write(
+                f"Đã xử lý tới ID {last_id}: chuyển đổi {converted}, "
+                f"đã ở định dạng mới {skipped}, lỗi {invalid}"
+            )
+
+        prefix = '[dry-run] ' if dry_run else ''
+        self.stdout.write(self.style.SUCCESS(
+            f"{prefix}Hoàn tất: chuyển đổi {converted}, đã ở định dạng mới {skipped}, lỗi {invalid}"
+        ))
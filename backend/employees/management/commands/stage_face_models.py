@@ -0,0 +1,50 @@
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from employees.face_artifacts import (
+    ArtifactError, bundle_artifacts, required_artifacts, stage_artifacts, verify_artifacts, weights_dir,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Chép file trọng số của pipeline đang cấu hình từ thư mục hoặc file nén cục bộ (không cần mạng), '
+        'kiểm tra checksum và ghi manifest; hoặc đóng gói trọng số đang có để mang sang máy khác'
+    )
+
+    def add_arguments(self, parser):
+        action = parser.add_mutually_exclusive_group(required=True)
+        action.add_argument('--source',
+                            help='Thư mục hoặc file .tar/.tar.gz chứa file trọng số (và manifest checksum)')
+        action.add_argument('--bundle', metavar='OUTPUT',
+                            help='Đóng gói file trọng số đang có kèm manifest thành file .tar.gz')
+        action.add_argument('--verify', action='store_true',
+                            help='Chỉ kiểm tra file trọng số đã có, tính lại SHA-256 so với manifest')
+        parser.add_argument('--allow-unverified', action='store_true',
+                            help='Cho phép chép file không có checksum trong nguồn')
+
+    def handle(self, *args, **options):
+        artifacts = required_artifacts()
+        self.stdout.write(f"Pipeline cần {len(artifacts)} file trọng số: {', '.join(a.name for a in artifacts)}")
+
+        try:
+            if options['bundle']:
+                entries = bundle_artifacts(options['bundle'])
+                size_mb = sum(entry['size'] for entry in entries.values()) / 1024 / 1024
+                self.stdout.write(self.style.SUCCESS(
+                    f"Đã đóng gói {len(entries)} file ({size_mb:.1f} MB) vào {Path(options['bundle']).resolve()}"
+                ))
+                return
+            if options['source']:
+                manifest = stage_artifacts(options['source'], require_checksums=not options['allow_unverified'])
+                for name, entry in sorted(manifest['artifacts'].items()):
+                    self.stdout.write(f"{name:<40}{entry['sha256'][:16]}  {entry['path']}")
+                self.stdout.write(f"Manifest: {weights_dir()}")
+        except (ArtifactError, OSError) as e:
+            raise CommandError(str(e))
+
+        problems = verify_artifacts(checksums=True)
+        if problems:
+            raise CommandError(f"File trọng số chưa đầy đủ: {'; '.join(problems)}")
+        self.stdout.write(self.style.SUCCESS('Đủ file trọng số cho pipeline đang cấu hình'))
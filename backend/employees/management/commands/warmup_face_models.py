@@ -0,0 +1,33 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from employees.face_backends import backend_summary
+from employees.face_settings import face_setting
+from employees.face_warmup import warmup_pipeline
+
+
+class Command(BaseCommand):
+    help = (
+        'Nạp mọi mô hình nhận diện mà pipeline đang cấu hình cần (tải trọng số nếu chưa có) và chạy '
+        'thử một lần, in thời gian từng bước'
+    )
+
+    def handle(self, *args, **options):
+        backends = backend_summary()
+        self.stdout.write(
+            f"Phát hiện: {backends['detection']}, anti-spoofing: {backends['anti_spoofing']}, "
+            f"embedding: {face_setting('MODEL_NAME')} ({backends['embedding']}); "
+            f"framework: {', '.join(backends['frameworks'])}"
+        )
+        started = time.perf_counter()
+        try:
+            timings = warmup_pipeline()
+        except Exception as e:
+            raise CommandError(f"Nạp mô hình thất bại: {str(e)}")
+
+        for name, milliseconds in timings.items():
+            self.stdout.write(f"{name:<24}{milliseconds:>10.1f} ms")
+        self.stdout.write(self.style.SUCCESS(
+            f"Đã nạp mô hình nhận diện trong {time.perf_counter() - started:.1f} giây"
+        ))
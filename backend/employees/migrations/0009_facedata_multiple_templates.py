@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:30
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('employees', '0008_gallerychange'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='facedata',
+            name='employee',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='face_data', to='employees.employee'),
+        ),
+    ]
@@ -47,9 +47,19 @@ class Employee(models.Model):
         ordering = ['employee_id']
 
 class FaceData(models.Model):
-    employee = models.OneToOneField(Employee, on_delete=models.CASCADE, related_name='face_data')
+    # Mỗi nhân viên có thể có nhiều mẫu khuôn mặt (tối đa MAX_TEMPLATES_PER_EMPLOYEE)
+    employee = models.ForeignKey(Employee, on_delete=models.CASCADE, related_name='face_data')
     face_encoding = models.BinaryField()
     image = models.ImageField(upload_to='face_data/')
     created_at = models.DateTimeField(auto_now_add=True)
     def __str__(self):
-        return f"Face data for {self.employee.first_name} {self.employee.last_name}"
\ No newline at end of file
+        return f"Face data for {self.employee.first_name} {self.employee.last_name}"
+
+class GalleryChange(models.Model):
+    # Nhật ký thay đổi gallery khuôn mặt: ID tăng dần chính là số phiên bản gallery.
+    # Không dùng khóa ngoại để bản ghi vẫn còn sau khi nhân viên/khuôn mặt bị xóa
+    employee_id = models.CharField(max_length=20)
+    face_data_id = models.BigIntegerField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    def __str__(self):
+        return f"Gallery v{self.id}: {self.employee_id} / {self.face_data_id}"
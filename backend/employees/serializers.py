@@ -50,7 +50,7 @@ class EmployeeSerializer(serializers.ModelSerializer):
 class EmployeeDetailSerializer(serializers.ModelSerializer):
     department = DepartmentSerializer(read_only=True)
     shift = ShiftSerializer(read_only=True)
-    face_data = FaceDataSerializer(read_only=True)
+    face_data = FaceDataSerializer(many=True, read_only=True)
     
     class Meta:
         model = Employee
@@ -0,0 +1,65 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .face_gallery import record_gallery_change
+from .models import Employee, FaceData, Shift
+
+
+# Mọi thay đổi ảnh hưởng tới gallery (đăng ký/xóa khuôn mặt, ngừng kích hoạt/xóa nhân viên)
+# được ghi vào GalleryChange sau khi transaction commit. Các worker (kể cả trên máy khác)
+# đọc nhật ký này để cập nhật gallery của mình theo từng dòng thay vì nạp lại toàn bộ.
+
+@receiver(post_save, sender=FaceData)
+@receiver(post_delete, sender=FaceData)
+def face_data_changed(sender, instance, **kwargs):
+    employee_id, face_data_id = instance.employee_id, instance.id
+    transaction.on_commit(lambda: record_gallery_change(employee_id, face_data_id))
+
+
+# Các trường của Employee ảnh hưởng tới gallery: nhân viên ngừng kích hoạt bị loại khỏi gallery,
+# phòng ban và ca làm việc quyết định gallery con của kiosk và của giờ cao điểm (face_tiers)
+GALLERY_FIELDS = ('is_active', 'department_id', 'shift_id')
+_GALLERY_FIELD_NAMES = {'is_active', 'department', 'department_id', 'shift', 'shift_id'}
+
+
+@receiver(pre_save, sender=Employee)
+def remember_gallery_fields(sender, instance, update_fields=None, **kwargs):
+    # Giá trị trước khi lưu, để post_save chỉ ghi nhận thay đổi khi một trường của gallery đổi
+    instance._gallery_fields = None
+    if kwargs.get('raw') or instance._state.adding:
+        return
+    if update_fields is not None and not set(update_fields) & _GALLERY_FIELD_NAMES:
+        # save(update_fields=[...]) không đụng tới trường nào của gallery: khỏi đọc lại CSDL
+        instance._gallery_fields = _gallery_fields(instance)
+        return
+    instance._gallery_fields = (
+        sender.objects.filter(pk=instance.pk).values_list(*GALLERY_FIELDS).first()
+    )
+
+
+@receiver(post_save, sender=Employee)
+def employee_saved(sender, instance, created, **kwargs):
+    # Nhân viên mới chưa có mẫu khuôn mặt nào; đổi tên, email, số điện thoại... không ảnh hưởng gallery
+    if created or getattr(instance, '_gallery_fields', None) == _gallery_fields(instance):
+        return
+    employee_id = instance.employee_id
+    transaction.on_commit(lambda: record_gallery_change(employee_id))
+
+
+@receiver(post_delete, sender=Employee)
+def employee_deleted(sender, instance, **kwargs):
+    employee_id = instance.employee_id
+    transaction.on_commit(lambda: record_gallery_change(employee_id))
+
+
+def _gallery_fields(instance):
+    return tuple(getattr(instance, field) for field in GALLERY_FIELDS)
+
+
+@receiver(post_save, sender=Shift)
+@receiver(post_delete, sender=Shift)
+def shift_changed(sender, instance, **kwargs):
+    # Giờ ca thay đổi không ảnh hưởng dòng nào trong gallery, chỉ tăng phiên bản
+    # để các gallery con theo ca làm việc (face_tiers) được tạo lại
+    transaction.on_commit(lambda: record_gallery_change(''))
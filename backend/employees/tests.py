@@ -1,3 +1,1073 @@
-from django.test import TestCase
+import ast
+import importlib.util
+import time
+import unittest
+from datetime import datetime
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from django.conf import settings
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from .face_encoding import decode_embedding, encode_embedding, is_legacy_encoding
+from .face_gallery import FaceGallery, l2_normalize
+from .face_index import IVFIndex
+
+
+def clustered_gallery(rng, dim=64, clusters=32, employees=1500, templates=2, spread=1.2, noise=0.4):
+    """
+    Gallery tổng hợp: nhân viên dồn quanh vài tâm cụm, mỗi nhân viên vài mẫu gần nhau
+
+    Với tham số mặc định, probe (xem _probes) giống mẫu đúng khoảng 0.8 và nhân viên đứng thứ hai
+    khoảng 0.55, gần với phân bố điểm của Facenet512.
+    """
+    centers = l2_normalize(rng.standard_normal((clusters, dim)))
+    identities = l2_normalize(
+        centers[rng.integers(0, clusters, employees)] + spread * l2_normalize(rng.standard_normal((employees, dim)))
+    )
+    employee_of = np.repeat(np.arange(employees), templates)
+    embeddings = l2_normalize(
+        identities[employee_of] + noise * l2_normalize(rng.standard_normal((len(employee_of), dim)))
+    )
+    return identities, embeddings, np.array([f"E{e:05d}" for e in employee_of], dtype=object)
+
+
+def legacy_encoding(embedding, **extra):
+    """FaceData.face_encoding dạng pickle như trước khi có định dạng nhị phân"""
+    import pickle
+
+    return pickle.dumps({'encoding': list(map(float, embedding)), 'employee_id': 'E001', **extra})
+
+
+class FaceEncodingTests(SimpleTestCase):
+    """Định dạng nhị phân của FaceData.face_encoding và dữ liệu pickle cũ"""
+
+    def setUp(self):
+        self.embedding = np.random.default_rng(0).standard_normal(512).astype(np.float32)
+
+    def test_float32_round_trip(self):
+        blob = encode_embedding(self.embedding, model_name='Facenet512', liveness_score=0.87)
+        record = decode_embedding(blob)
+        np.testing.assert_array_equal(record.embedding, self.embedding)
+        self.assertEqual(record.model_name, 'Facenet512')
+        self.assertAlmostEqual(record.liveness_score, 0.87, places=6)
+        self.assertEqual(record.version, 1)
+        self.assertFalse(record.is_legacy)
+        self.assertFalse(is_legacy_encoding(blob))
+        # Phần dữ liệu căn theo 8 byte và được đọc trực tiếp, không sao chép
+        self.assertEqual((len(blob) - 512 * 4) % 8, 0)
+        self.assertTrue(np.shares_memory(record.embedding, np.frombuffer(blob, dtype=np.uint8)))
+
+    def test_float16_round_trip(self):
+        blob = encode_embedding(self.embedding, model_name='ArcFace', dtype='float16')
+        record = decode_embedding(blob)
+        self.assertEqual(record.embedding.dtype, np.float16)
+        np.testing.assert_allclose(record.embedding.astype(np.float32), self.embedding, rtol=1e-3, atol=1e-3)
+        self.assertEqual(record.model_name, 'ArcFace')
+        self.assertIsNone(record.liveness_score)
+
+    def test_invalid_input(self):
+        with self.assertRaises(ValueError):
+            encode_embedding(self.embedding, model_name='Facenet512', dtype='int8')
+        blob = bytearray(encode_embedding(self.embedding, model_name='Facenet512'))
+        blob[4] = 2  # phiên bản định dạng
+        with self.assertRaises(ValueError):
+            decode_embedding(bytes(blob))
+
+    def test_legacy_pickle(self):
+        blob = legacy_encoding(self.embedding, liveness_score=0.9)
+        self.assertTrue(is_legacy_encoding(blob))
+        record = decode_embedding(blob)
+        self.assertTrue(record.is_legacy)
+        self.assertEqual(record.model_name, 'Facenet512')
+        self.assertEqual(record.liveness_score, 0.9)
+        np.testing.assert_array_equal(record.embedding, self.embedding)
+
+    def test_legacy_pickle_without_embedding(self):
+        import pickle
+
+        self.assertIsNone(decode_embedding(pickle.dumps({'face_img': [1, 2, 3]})))
+
+
+class MigrateFaceEncodingsTests(TestCase):
+    """Lệnh migrate_face_encodings chuyển pickle cũ sang định dạng nhị phân theo từng lô"""
+
+    def setUp(self):
+        from .models import Employee, FaceData
+
+        employee = Employee.objects.create(employee_id='E001', first_name='An', last_name='Nguyen')
+        rng = np.random.default_rng(1)
+        self.embeddings = rng.standard_normal((4, 8)).astype(np.float32)
+        blobs = [legacy_encoding(embedding, liveness_score=0.8) for embedding in self.embeddings[:3]]
+        blobs.append(encode_embedding(self.embeddings[3], model_name='Facenet512'))
+        blobs.append(legacy_encoding([])[:-1])  # pickle hỏng
+        self.ids = [
+            FaceData.objects.create(employee=employee, face_encoding=blob, image='face_data/a.jpg').id
+            for blob in blobs
+        ]
+
+    def _migrate(self, *args):
+        from io import StringIO
+
+        from django.core.management import call_command
+
+        stdout, stderr = StringIO(), StringIO()
+        call_command('migrate_face_encodings', *args, stdout=stdout, stderr=stderr)
+        return stdout.getvalue()
+
+    def _records(self):
+        from .models import FaceData
+
+        blobs = dict(FaceData.objects.values_list('id', 'face_encoding'))
+        return [bytes(blobs[face_data_id]) for face_data_id in self.ids]
+
+    def test_converts_in_batches(self):
+        output = self._migrate('--batch-size', '2')
+        self.assertIn('chuyển đổi 3, đã ở định dạng mới 1, lỗi 1', output)
+        # Ba lô: 2 + 2 + 1 bản ghi
+        self.assertEqual(output.count('Đã xử lý tới ID'), 3)
+        blobs = self._records()
+        for blob, embedding in zip(blobs[:4], self.embeddings):
+            record = decode_embedding(blob)
+            self.assertFalse(record.is_legacy)
+            np.testing.assert_array_equal(record.embedding, embedding)
+        self.assertAlmostEqual(decode_embedding(blobs[0]).liveness_score, 0.8, places=6)
+        self.assertTrue(is_legacy_encoding(blobs[4]))
+        # Chạy lại không còn gì để chuyển
+        self.assertIn('chuyển đổi 0, đã ở định dạng mới 4, lỗi 1', self._migrate())
+
+    def test_dry_run_and_resume(self):
+        before = self._records()
+        self._migrate('--dry-run')
+        self.assertEqual(self._records(), before)
+
+        self._migrate('--start-id', str(self.ids[1]))
+        blobs = self._records()
+        self.assertTrue(is_legacy_encoding(blobs[0]) and is_legacy_encoding(blobs[1]))
+        self.assertFalse(is_legacy_encoding(blobs[2]))
+
+
+class GalleryChangeSignalTests(TestCase):
+    """Chỉ ghi GalleryChange khi trường ảnh hưởng tới gallery của nhân viên thay đổi"""
+
+    def setUp(self):
+        from .models import Department, Employee, Shift
+
+        self.department = Department.objects.create(name='Kho')
+        self.shift = Shift.objects.create(name='Sáng', start_time='08:00', end_time='17:00')
+        self.employee = Employee.objects.create(employee_id='E001', first_name='An', last_name='Nguyen')
+
+    def _recorded(self, change):
+        with mock.patch('employees.signals.record_gallery_change') as record, \
+                self.captureOnCommitCallbacks(execute=True):
+            change(self.employee)
+        return [call.args for call in record.call_args_list]
+
+    def test_profile_changes_are_ignored(self):
+        def rename(employee):
+            employee.first_name = 'Binh'
+            employee.email = 'binh@example.com'
+            employee.save()
+
+        def touch(employee):
+            employee.phone = '0900000000'
+            employee.save(update_fields=['phone'])
+
+        self.assertEqual(self._recorded(rename), [])
+        self.assertEqual(self._recorded(touch), [])
+
+    def test_gallery_fields_are_recorded(self):
+        def deactivate(employee):
+            employee.is_active = False
+            employee.save(update_fields=['is_active'])
+
+        def move(employee):
+            employee.department = self.department
+            employee.save()
+
+        def reassign(employee):
+            employee.shift_id = self.shift.pk
+            employee.save(update_fields=['shift'])
+
+        for change in (deactivate, move, reassign):
+            self.assertEqual(self._recorded(change), [('E001',)], change.__name__)
+        self.assertEqual(self._recorded(lambda employee: employee.delete()), [('E001',)])
+
+
+class SnapshotRebuildTests(SimpleTestCase):
+    """Nhiều thay đổi gallery liên tiếp chỉ dẫn tới một lần ghi snapshot"""
+
+    def _options(self, **options):
+        return override_settings(FACE_RECOGNITION={**getattr(settings, 'FACE_RECOGNITION', {}), **options})
+
+    def test_changes_are_coalesced(self):
+        import threading
+
+        from . import face_snapshot
+
+        rebuilt = threading.Event()
+        with self._options(GALLERY_SNAPSHOT=True, GALLERY_SNAPSHOT_REBUILD_DELAY=0.2,
+                           GALLERY_SNAPSHOT_REBUILD_MAX_DELAY=5.0), \
+                mock.patch.object(face_snapshot, 'rebuild_snapshot', side_effect=lambda force: rebuilt.set()) as rebuild, \
+                mock.patch('employees.face_gallery.prune_gallery_changes'), \
+                mock.patch('django.db.close_old_connections'):
+            for _ in range(5):
+                face_snapshot.schedule_snapshot_rebuild()
+                time.sleep(0.05)
+            self.assertTrue(rebuilt.wait(5))
+            face_snapshot._rebuild_thread.join(5)
+        rebuild.assert_called_once_with(force=False)
+
+    def test_quiet_period_is_capped(self):
+        from . import face_snapshot
+
+        with self._options(GALLERY_SNAPSHOT_REBUILD_DELAY=0.1, GALLERY_SNAPSHOT_REBUILD_MAX_DELAY=0.3), \
+                mock.patch.object(face_snapshot, '_rebuild_pending') as pending:
+            # Luôn có yêu cầu mới: vẫn phải ghi sau tối đa max_delay giây
+            pending.wait.side_effect = lambda timeout: time.sleep(timeout) or True
+            started = time.monotonic()
+            face_snapshot._wait_for_quiet_period()
+        self.assertLess(time.monotonic() - started, 1.0)
+
+    def test_up_to_date_snapshot_is_skipped(self):
+        import tempfile
+
+        from . import face_snapshot
+
+        with tempfile.TemporaryDirectory() as directory, self._options(GALLERY_SNAPSHOT_DIR=directory), \
+                mock.patch('employees.face_gallery.current_gallery_version', return_value=7), \
+                mock.patch('employees.face_gallery.read_face_arrays') as read_face_arrays:
+            read_face_arrays.return_value = (
+                l2_normalize(np.ones((1, 512))), np.array(['E001']), np.array([1], dtype=np.int64)
+            )
+            self.assertIsNotNone(face_snapshot.rebuild_snapshot(force=False))
+            self.assertEqual(face_snapshot.snapshot_version(), 7)
+            self.assertIsNone(face_snapshot.rebuild_snapshot(force=False))
+            self.assertEqual(read_face_arrays.call_count, 1)
+
+
+class TemplateTests(TestCase):
+    """Nhiều mẫu khuôn mặt mỗi nhân viên: vector trung tâm và giới hạn MAX_TEMPLATES_PER_EMPLOYEE"""
+
+    def setUp(self):
+        from .models import Employee
+
+        self.employee = Employee.objects.create(employee_id='E001', first_name='An', last_name='Nguyen')
+
+    def test_aggregate_templates(self):
+        from .face_templates import aggregate_templates
+
+        embeddings = np.array([[1, 0, 0], [0, 1, 0], [0, 0, 1], [1, 1, 0]], dtype=np.float32)
+        centroids, employee_ids, face_data_ids = aggregate_templates(
+            embeddings, np.array(['E002', 'E001', 'E002', 'E001']), np.array([7, 9, 3, 4])
+        )
+        self.assertEqual(list(employee_ids), ['E001', 'E002'])
+        self.assertEqual(face_data_ids.tolist(), [4, 3])  # ID FaceData nhỏ nhất của từng nhân viên
+        np.testing.assert_allclose(centroids, [[1 / np.sqrt(5), 2 / np.sqrt(5), 0], [1 / np.sqrt(2), 0, 1 / np.sqrt(2)]],
+                                   rtol=1e-6)
+
+    def _templates(self, vectors):
+        from .face_settings import face_setting
+        from .models import FaceData
+
+        return [
+            FaceData.objects.create(
+                employee=self.employee, image='face_data/a.jpg',
+                face_encoding=vector if isinstance(vector, bytes) else encode_embedding(
+                    np.asarray(vector, dtype=np.float32), model_name=face_setting('MODEL_NAME')
+                ),
+            ).id
+            for vector in vectors
+        ]
+
+    def _enforce(self, policy, keep_id):
+        from .face_templates import enforce_template_cap
+        from .models import FaceData
+
+        options = {**getattr(settings, 'FACE_RECOGNITION', {}), 'MAX_TEMPLATES_PER_EMPLOYEE': 3, 'TEMPLATE_EVICTION': policy}
+        with override_settings(FACE_RECOGNITION=options):
+            evicted = enforce_template_cap(self.employee, keep_id=keep_id)
+        return evicted, sorted(FaceData.objects.filter(employee=self.employee).values_list('id', flat=True))
+
+    def test_oldest_eviction_keeps_new_template(self):
+        ids = self._templates(np.eye(5))
+        evicted, remaining = self._enforce('oldest', keep_id=ids[0])
+        self.assertEqual(evicted, ids[1:3])
+        self.assertEqual(remaining, [ids[0], ids[3], ids[4]])
+        self.assertEqual(self._enforce('oldest', keep_id=None)[0], [])
+
+    def test_redundant_eviction_keeps_diverse_templates(self):
+        near_duplicate = [1.0, 0.05, 0, 0]
+        ids = self._templates([[1, 0, 0, 0], [0, 1, 0, 0], b'broken', near_duplicate, [0, 0, 1, 0]])
+        # Mẫu hỏng bị xóa trước, sau đó một trong hai mẫu gần trùng nhau (không phải mẫu được giữ)
+        evicted, remaining = self._enforce('redundant', keep_id=ids[3])
+        self.assertEqual(evicted, [ids[2], ids[0]])
+        self.assertEqual(remaining, [ids[1], ids[3], ids[4]])
+
+    def test_invalid_policy(self):
+        self._templates(np.eye(4))
+        with self.assertRaises(ValueError):
+            self._enforce('random', keep_id=None)
+
+
+class ShiftTierTests(TestCase):
+    """Nhân viên sắp vào/tan ca được tìm trước, kể cả ca qua đêm"""
+
+    def setUp(self):
+        from .models import Employee, Shift
+
+        day = Shift.objects.create(name='Ngày', start_time='08:00', end_time='17:00')
+        night = Shift.objects.create(name='Đêm', start_time='22:00', end_time='06:00')
+        Employee.objects.create(employee_id='D1', first_name='An', last_name='Le', shift=day)
+        Employee.objects.create(employee_id='N1', first_name='Binh', last_name='Tran', shift=night)
+        Employee.objects.create(employee_id='N2', first_name='Chi', last_name='Pham', shift=night, is_active=False)
+        Employee.objects.create(employee_id='X1', first_name='Dung', last_name='Vo')
+
+    def _on_shift(self, hour, minute, window=30):
+        from django.utils import timezone
+
+        from .face_tiers import on_shift_employee_ids
+
+        now = timezone.make_aware(datetime(2024, 5, 20, hour, minute))
+        return sorted(on_shift_employee_ids(now=now, window_minutes=window))
+
+    def test_window_around_shift_boundaries(self):
+        self.assertEqual(self._on_shift(7, 45), ['D1'])
+        self.assertEqual(self._on_shift(17, 20), ['D1'])
+        self.assertEqual(self._on_shift(12, 0), [])
+        self.assertEqual(self._on_shift(16, 0, window=60), ['D1'])
+
+    def test_overnight_wrap_around(self):
+        # 22:00 - 06:00: khoảng cách tính vòng qua nửa đêm
+        self.assertEqual(self._on_shift(21, 40), ['N1'])
+        self.assertEqual(self._on_shift(6, 20), ['N1'])
+        self.assertEqual(self._on_shift(23, 50, window=120), ['N1'])
+        self.assertEqual(self._on_shift(0, 10, window=130), ['N1'])
+        self.assertEqual(self._on_shift(2, 0, window=60), [])
+
+    def test_tiered_search_falls_back_to_full_gallery(self):
+        from django.utils import timezone
+
+        from .face_tiers import search_shift_tiered
+
+        gallery = FaceGallery(4)
+        for face_data_id, employee_id in enumerate(('D1', 'N1', 'X1'), start=1):
+            gallery.add(face_data_id, employee_id, np.eye(4)[face_data_id - 1])
+        options = {**getattr(settings, 'FACE_RECOGNITION', {}), 'SHIFT_TIER': True,
+                   'SHIFT_TIER_ACCEPT_SIMILARITY': 0.9, 'SHIFT_TIER_WINDOW_MINUTES': 30}
+        with override_settings(FACE_RECOGNITION=options), \
+                mock.patch('employees.face_tiers.timezone.now',
+                           return_value=timezone.make_aware(datetime(2024, 5, 20, 7, 50))):
+            matches, tier = search_shift_tiered(gallery, np.eye(4)[0], top_k=1)
+            self.assertEqual((tier, matches[0].employee_id), ('shift', 'D1'))
+            matches, tier = search_shift_tiered(gallery, np.eye(4)[2], top_k=1)
+            self.assertEqual((tier, matches[0].employee_id), ('full', 'X1'))
+
+
+class DepartmentPartitionTests(TestCase):
+    """Phân vùng gallery theo phòng ban của kiosk, tạo lại khi gallery đổi phiên bản"""
+
+    def setUp(self):
+        from .models import Department, Employee
+
+        kho, van_phong = Department.objects.create(name='Kho'), Department.objects.create(name='Văn phòng')
+        Employee.objects.create(employee_id='K1', first_name='An', last_name='Le', department=kho)
+        Employee.objects.create(employee_id='K2', first_name='Binh', last_name='Tran', department=kho, is_active=False)
+        Employee.objects.create(employee_id='V1', first_name='Chi', last_name='Pham', department=van_phong)
+        self.gallery = FaceGallery(4)
+        for face_data_id, employee_id in enumerate(('K1', 'K2', 'V1'), start=1):
+            self.gallery.add(face_data_id, employee_id, np.eye(4)[face_data_id - 1])
+
+    def _members(self, gallery):
+        return [employee_id for employee_id in ('K1', 'K2', 'V1') if len(gallery.face_data_ids_of(employee_id))]
+
+    def test_membership(self):
+        from .face_tiers import DepartmentPartitions
+
+        partitions = DepartmentPartitions()
+        self.assertEqual(self._members(partitions.get(self.gallery, ['Kho'])), ['K1'])
+        self.assertEqual(self._members(partitions.get(self.gallery, ['Kho', 'Văn phòng'])), ['K1', 'V1'])
+        self.assertEqual(self._members(partitions.get(self.gallery, ['Khác'])), [])
+
+    def test_rebuilt_when_gallery_changes(self):
+        from .face_tiers import DepartmentPartitions
+        from .models import Employee
+
+        partitions = DepartmentPartitions()
+        first = partitions.get(self.gallery, ['Văn phòng'])
+        self.assertIs(partitions.get(self.gallery, {'Văn phòng'}), first)
+        Employee.objects.filter(employee_id='K1').update(department='Văn phòng')
+        # Lần đồng bộ tiếp theo đọc GalleryChange của thay đổi này và tăng phiên bản gallery
+        self.gallery.version += 1
+        self.assertEqual(self._members(partitions.get(self.gallery, ['Văn phòng'])), ['K1', 'V1'])
+
+    def test_unrestricted_kiosk_uses_full_gallery(self):
+        from .face_tiers import department_partition
+
+        self.assertIs(department_partition(self.gallery, []), self.gallery)
+
+
+class IVFIndexParityTests(SimpleTestCase):
+    """Chỉ mục IVF (mặc định exact=True) phải cho đúng kết quả của quét vét cạn"""
+
+    dim = 64
+    min_similarity = 0.6
+
+    def _galleries(self, rng, spread=1.2, **index_options):
+        identities, embeddings, employee_ids = clustered_gallery(rng, dim=self.dim, spread=spread)
+        face_data_ids = np.arange(1, len(embeddings) + 1, dtype=np.int64)
+        exact = FaceGallery(self.dim)
+        exact.load_arrays(embeddings, employee_ids, face_data_ids)
+        index = IVFIndex(nlist=300, nprobe=8, min_train_size=1, **index_options)
+        indexed = FaceGallery(self.dim, index=index)
+        indexed.load_arrays(embeddings, employee_ids, face_data_ids)
+        return identities, exact, indexed
+
+    def _probes(self, rng, identities, count=200, noise=0.6):
+        chosen = identities[rng.integers(0, len(identities), count)]
+        return l2_normalize(chosen + noise * l2_normalize(rng.standard_normal(chosen.shape)))
+
+    def _ids(self, gallery, probe, **options):
+        return [match.face_data_id for match in gallery.search(probe, top_k=5, **options)]
+
+    def _count_fallbacks(self, index):
+        search, fallbacks = index.search, []
+
+        def counted_search(*args):
+            candidates = search(*args)
+            fallbacks.append(candidates is None)
+            return candidates
+
+        index.search = counted_search
+        return fallbacks
+
+    def test_matches_brute_force(self):
+        # Cụm chặt (cận trên loại được cụm) và cụm phân tán (gần như luôn quét vét cạn)
+        for spread, max_fallback_rate in ((0.3, 0.1), (1.2, 1.0)):
+            rng = np.random.default_rng(7)
+            identities, exact, indexed = self._galleries(rng, spread=spread)
+            fallbacks = self._count_fallbacks(indexed.index)
+            for probe in self._probes(rng, identities):
+                for options in ({'min_similarity': self.min_similarity, 'per_employee': True},
+                                {'min_similarity': None, 'per_employee': False}):
+                    with self.subTest(spread=spread, **options):
+                        self.assertEqual(self._ids(exact, probe, **options), self._ids(indexed, probe, **options))
+            self.assertLessEqual(np.mean(fallbacks), max_fallback_rate)
+
+    def test_matches_brute_force_after_changes(self):
+        rng = np.random.default_rng(11)
+        identities, exact, indexed = self._galleries(rng, spread=0.3)
+        added = self._probes(rng, identities, count=20, noise=0.2)
+        for gallery in (exact, indexed):
+            for i, vector in enumerate(added):
+                gallery.add(100000 + i, f"N{i:03d}", vector)
+            for face_data_id in range(1, 400, 7):
+                gallery.remove(face_data_id)
+        for probe in self._probes(rng, identities, count=100):
+            options = {'min_similarity': self.min_similarity, 'per_employee': True}
+            self.assertEqual(self._ids(exact, probe, **options), self._ids(indexed, probe, **options))
+
+    def test_search_during_rebuild(self):
+        import threading
+
+        rng = np.random.default_rng(5)
+        _, embeddings, _ = clustered_gallery(rng, dim=self.dim, employees=500)
+        ids = np.arange(1, len(embeddings) + 1, dtype=np.int64)
+        index = IVFIndex(nlist=16, nprobe=2, min_train_size=1)
+        index.build(ids, embeddings)
+        errors, done = [], threading.Event()
+
+        def score_ids(found):
+            rows = np.asarray(found, dtype=np.int64) - 1
+            return rows, embeddings[rows] @ embeddings[0], np.zeros(len(rows))
+
+        def search():
+            try:
+                while not done.is_set():
+                    index.search(embeddings[0], 5, None, score_ids)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=search) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for _ in range(10):
+            index.build(ids, embeddings)
+        done.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
+    def _approximate_index(self):
+        index = IVFIndex(nlist=2, nprobe=1, exact=False, min_train_size=1)
+        index._layout = (np.eye(2, 3, dtype=np.float32), [np.array([1, 2]), np.array([3])], np.ones(2))
+        return index, l2_normalize(np.array([1.0, 0.0, 0.0], dtype=np.float32))
+
+    def test_approximate_close_runner_up_falls_back_to_full_scan(self):
+        index, probe = self._approximate_index()
+
+        def score_ids(ids):
+            # Ứng viên của cụm đã duyệt: hai nhân viên điểm sát nhau
+            return np.arange(2), np.array([0.82, 0.78], dtype=np.float32), np.array(['A', 'B'])
+
+        self.assertIsNone(index.search(probe, 1, 0.6, score_ids))
+
+    def test_approximate_score_near_threshold_falls_back_to_full_scan(self):
+        index, probe = self._approximate_index()
+
+        def near_threshold(ids):
+            return np.arange(1), np.array([0.65], dtype=np.float32), np.array(['A'])
+
+        def confident(ids):
+            return np.arange(1), np.array([0.9], dtype=np.float32), np.array(['A'])
+
+        self.assertIsNone(index.search(probe, 1, 0.6, near_threshold))
+        self.assertIsNotNone(index.search(probe, 1, 0.6, confident))
+
+
+class SharedGalleryTests(SimpleTestCase):
+    """Gallery mở từ snapshot memory-map giữ nguyên ma trận dùng chung khi thêm/xóa mẫu"""
+
+    dim = 16
+
+    def setUp(self):
+        import tempfile
+        from pathlib import Path
+
+        rng = np.random.default_rng(3)
+        self.embeddings = l2_normalize(rng.standard_normal((200, self.dim)))
+        self.employee_ids = np.array([f"E{i // 2:03d}" for i in range(200)], dtype=str)
+        self.face_data_ids = np.arange(1, 201, dtype=np.int64)
+        self.tmp = tempfile.TemporaryDirectory()
+        path = Path(self.tmp.name) / 'embeddings.npy'
+        np.save(path, self.embeddings)
+        self.mapped = np.load(path, mmap_mode='r')
+        self.rng = rng
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _galleries(self):
+        shared = FaceGallery(self.dim)
+        shared.load_arrays(self.mapped, self.employee_ids, self.face_data_ids)
+        private = FaceGallery(self.dim)
+        private.load_arrays(self.embeddings.copy(), self.employee_ids, self.face_data_ids)
+        return shared, private
+
+    def assertSameMatches(self, first, second):
+        # Điểm có thể lệch ở chữ số cuối giữa phép nhân ma trận-ma trận và ma trận-vector
+        rounded = lambda matches: [(m.face_data_id, m.employee_id, round(m.similarity, 5)) for m in matches]
+        self.assertEqual(rounded(first), rounded(second))
+
+    def test_changes_keep_snapshot_matrix(self):
+        shared, private = self._galleries()
+        self.assertTrue(shared.shared)
+        added = l2_normalize(self.embeddings[[7, 9, 12]] + 0.3 * self.rng.standard_normal((3, self.dim)))
+        for gallery in (shared, private):
+            gallery.add(5, 'E900', added[0])  # thay thế mẫu của snapshot
+            gallery.add(500, 'E001', added[1])  # mẫu mới
+            gallery.remove(11)
+            gallery.remove(500)
+            gallery.add(501, 'E002', added[2])
+        self.assertTrue(np.shares_memory(shared._state[0], self.mapped))
+        self.assertEqual(len(shared), len(private))
+        self.assertEqual(sorted(shared.face_data_ids_of('E002')), sorted(private.face_data_ids_of('E002')))
+
+        probes = l2_normalize(self.embeddings[:40] + 0.1 * self.rng.standard_normal((40, self.dim)))
+        for per_employee in (False, True):
+            shared_batch = shared.search_batch(probes, top_k=3, per_employee=per_employee)
+            private_batch = private.search_batch(probes, top_k=3, per_employee=per_employee)
+            for first, second in zip(shared_batch, private_batch):
+                self.assertSameMatches(first, second)
+            for probe in probes:
+                self.assertSameMatches(
+                    shared.search(probe, top_k=3, min_similarity=0.2, per_employee=per_employee),
+                    private.search(probe, top_k=3, min_similarity=0.2, per_employee=per_employee),
+                )
+        for employee_id in ('E002', 'E005', 'E900'):
+            self.assertSameMatches([shared.verify(probes[4], employee_id)], [private.verify(probes[4], employee_id)])
+        subset = shared.subset(['E002', 'E900'])
+        self.assertEqual(subset._state[2].tolist(), private.subset(['E002', 'E900'])._state[2].tolist())
+
+
+class LivenessPregateTests(SimpleTestCase):
+    """Mỗi lý do loại của LivenessDetector, trên ảnh gốc và khi đưa về analysis_size"""
+
+    def _bgr(self, gray):
+        return np.repeat(np.asarray(gray, dtype=np.uint8)[:, :, np.newaxis], 3, axis=2)
+
+    def _faces(self):
+        rng = np.random.default_rng(0)
+        gradient = np.tile(np.linspace(0, 255, 200), (200, 1))
+        return {
+            None: self._bgr(rng.integers(0, 256, (200, 200))),  # sắc nét, nhiều chi tiết
+            'face_too_small': self._bgr(rng.integers(0, 256, (30, 30))),
+            'blurry': self._bgr(gradient),  # tương phản cao nhưng không có chi tiết
+            'flat': self._bgr(rng.integers(110, 131, (200, 200))),  # sắc nét nhưng gần như đồng màu
+        }
+
+    def test_rejection_reasons(self):
+        from .anti_spoofing import LivenessDetector
+
+        for analysis_size in (None, 112):
+            detector = LivenessDetector(analysis_size=analysis_size)
+            for reason, face in self._faces().items():
+                with self.subTest(analysis_size=analysis_size, reason=reason):
+                    passed, _, details = detector.check_liveness(face)
+                    self.assertEqual(details['reason'], reason)
+                    self.assertEqual(passed, reason is None)
+
+    def test_low_score(self):
+        from .anti_spoofing import LivenessDetector
+
+        # Ngưỡng mờ/phẳng tắt: chỉ còn điểm tổng hợp quyết định
+        detector = LivenessDetector(blur_threshold=0.0, uniform_threshold=0.0)
+        passed, score, details = detector.check_liveness(self._bgr(np.tile(np.linspace(100, 140, 200), (200, 1))))
+        self.assertFalse(passed)
+        self.assertEqual(details['reason'], 'low_score')
+        self.assertLess(score, detector.liveness_threshold)
+
+    def test_batch_matches_single_checks(self):
+        from .anti_spoofing import LivenessDetector
+
+        faces = list(self._faces().values())
+        for analysis_size in (None, 112):
+            detector = LivenessDetector(analysis_size=analysis_size)
+            results, _ = detector.check_liveness_batch(faces)
+            single = [detector.check_liveness(face) for face in faces]
+            self.assertEqual([r[2]['reason'] for r in results], [r[2]['reason'] for r in single])
+            np.testing.assert_allclose([r[1] for r in results], [r[1] for r in single], rtol=1e-6)
+
+    def test_rejected_face_reports_quality_issue(self):
+        from . import face_pipeline
+
+        blurry = self._faces()['blurry']
+        face_obj = {
+            'face': blurry[:, :, ::-1] / 255.0,
+            'facial_area': {'x': 0, 'y': 0, 'w': 200, 'h': 200},
+        }
+        options = {**getattr(settings, 'FACE_RECOGNITION', {}), 'LIVENESS_PREGATE': True, 'DETECTION_MAX_SIDE': None}
+        with override_settings(FACE_RECOGNITION=options), \
+                mock.patch.object(face_pipeline, 'detect_faces', return_value=([face_obj], 'yunet')), \
+                mock.patch.object(face_pipeline, 'check_spoofing') as check_spoofing:
+            analysis, crop = face_pipeline.inspect_face(blurry)
+        self.assertEqual(analysis.quality_issue, 'blurry')
+        self.assertIsNone(analysis.is_real)
+        self.assertIsNone(crop)
+        check_spoofing.assert_not_called()
+
+
+class AlignedCropTests(SimpleTestCase):
+    """Khuôn mặt cắt từ ảnh gốc khi phát hiện trên ảnh thu nhỏ được căn chỉnh như DeepFace.extract_faces"""
+
+    def _scene(self, scale):
+        import cv2
+
+        # Khung hình có khuôn mặt giả nghiêng 15 độ: mảng màu bất đối xứng, đủ mượt để thu nhỏ không răng cưa
+        rng = np.random.default_rng(4)
+        pattern = cv2.resize(rng.integers(0, 256, (12, 12, 3), dtype=np.uint8), (240, 240), interpolation=cv2.INTER_CUBIC)
+        img = np.full((480, 640, 3), 90, dtype=np.uint8)
+        img[120:360, 200:440] = pattern
+        matrix = cv2.getRotationMatrix2D((320.0, 240.0), -15.0, 1.0)
+        img = cv2.warpAffine(img, matrix, (640, 480), flags=cv2.INTER_CUBIC, borderValue=(90, 90, 90))
+        angle = np.radians(15.0)
+        # Mắt trái của người (bên phải ảnh) thấp hơn mắt phải khi khuôn mặt nghiêng
+        offset = 60 * np.array([np.cos(angle), np.sin(angle)])
+        area = {
+            'x': 220, 'y': 140, 'w': 200, 'h': 200,
+            'left_eye': tuple(int(v) for v in (320, 200) + offset),
+            'right_eye': tuple(int(v) for v in (320, 200) - offset),
+        }
+        large = cv2.resize(img, (640 * scale, 480 * scale), interpolation=cv2.INTER_CUBIC)
+        return img, large, area
+
+    def test_full_resolution_matches_downscaled_alignment(self):
+        import cv2
+
+        from .face_pipeline import aligned_crop, scale_facial_area
+
+        small, large, area = self._scene(scale=2)
+        expected = aligned_crop(small, area)
+        crop = aligned_crop(large, scale_facial_area(area, 2.0))
+        self.assertEqual(crop.shape[:2], (2 * expected.shape[0], 2 * expected.shape[1]))
+        reduced = cv2.resize(crop, expected.shape[1::-1], interpolation=cv2.INTER_AREA)
+        self.assertLess(np.abs(reduced.astype(np.float64) - expected).mean(), 2.0)
+        # Khuôn mặt đã được xoay thẳng: khác hẳn vùng cắt chưa căn chỉnh
+        unaligned = small[area['y']:area['y'] + area['h'], area['x']:area['x'] + area['w']]
+        self.assertGreater(np.abs(unaligned.astype(np.float64) - expected).mean(), 10.0)
+
+    def test_face_at_border_is_padded(self):
+        from .face_pipeline import aligned_crop
+
+        small, _, area = self._scene(scale=1)
+        area = {**area, 'x': 0, 'y': 0}
+        crop = aligned_crop(small, area)
+        self.assertEqual(crop.dtype, np.uint8)
+        self.assertLessEqual(crop.shape[0], area['h'] + 1)
+        self.assertLessEqual(crop.shape[1], area['w'] + 1)
+
+    def test_anti_spoofing_on_full_resolution(self):
+        from . import face_pipeline
+
+        small, large, area = self._scene(scale=2)
+        face_obj = {'face': np.zeros((10, 10, 3)), 'facial_area': area}
+        options = {**getattr(settings, 'FACE_RECOGNITION', {}), 'DETECTION_MAX_SIDE': 640, 'LIVENESS_PREGATE': False}
+        with override_settings(FACE_RECOGNITION=options), \
+                mock.patch.object(face_pipeline, 'detect_faces', return_value=([face_obj], 'retinaface')) as detect, \
+                mock.patch.object(face_pipeline, 'check_spoofing', return_value=(True, 0.9)) as check_spoofing:
+            analysis, crop = face_pipeline.inspect_face(large)
+        self.assertEqual(detect.call_args[0][0].shape, small.shape)
+        img, facial_area = check_spoofing.call_args[0]
+        self.assertIs(img, large)
+        self.assertEqual(facial_area, face_pipeline.scale_facial_area(area, 2.0))
+        self.assertEqual(analysis.facial_area, facial_area)
+        np.testing.assert_array_equal(crop, face_pipeline.aligned_crop(large, facial_area))
+
+    @unittest.skipUnless(importlib.util.find_spec('deepface'), 'Cần deepface và TensorFlow (requirements-tensorflow.txt)')
+    def test_matches_deepface_extract_face(self):
+        from deepface.models.Detector import FacialAreaRegion
+        from deepface.modules.detection import extract_face
+
+        from .face_pipeline import aligned_crop
+
+        small, _, area = self._scene(scale=1)
+        for x, y in ((220, 140), (0, 0)):
+            region = FacialAreaRegion(x=x, y=y, w=area['w'], h=area['h'], left_eye=area['left_eye'],
+                                      right_eye=area['right_eye'], confidence=0.99)
+            expected = extract_face(facial_area=region, img=small, align=True, expand_percentage=0,
+                                    width_border=0, height_border=0).img
+            np.testing.assert_array_equal(aligned_crop(small, {**area, 'x': x, 'y': y}), expected)
+
+
+class BatchRecognitionTests(SimpleTestCase):
+    """recognize_faces_batch: giới hạn số khuôn mặt và một lần trích xuất embedding cho cả lô"""
+
+    def _face_objs(self, count):
+        rng = np.random.default_rng(1)
+        return [
+            {'face': rng.random((80, 80, 3)), 'facial_area': {'x': 100 * i, 'y': 0, 'w': 80, 'h': 80}}
+            for i in range(count)
+        ]
+
+    def test_inspect_faces_checks_at_most_max_faces(self):
+        from . import face_pipeline
+
+        with mock.patch.object(face_pipeline, 'detect_faces', return_value=(self._face_objs(3), 'retinaface')), \
+                mock.patch.object(face_pipeline, 'check_spoofing', return_value=(True, 0.9)) as check_spoofing:
+            face_count, inspected = face_pipeline.inspect_faces(np.zeros((100, 400, 3), dtype=np.uint8), max_faces=2)
+        self.assertEqual(face_count, 3)
+        self.assertEqual(len(inspected), 2)
+        self.assertEqual(check_spoofing.call_count, 2)
+        self.assertTrue(all(analysis.face_count == 3 and crop is not None for analysis, crop in inspected))
+
+    def test_one_embedding_call_for_real_faces_only(self):
+        from . import face_service
+        from .face_pipeline import FaceAnalysis
+
+        crop = np.zeros((80, 80, 3), dtype=np.uint8)
+        real = FaceAnalysis(2, True, 0.9, {}, None, 'retinaface')
+        spoof = FaceAnalysis(2, False, 0.2, {}, None, 'retinaface')
+        inspected = {
+            b'a': (2, [(real, crop), (spoof, None)]),
+            b'b': (3, [(real, crop)]),
+        }
+
+        def inspect_faces(data, max_faces):
+            face_count, faces = inspected[data]
+            return face_count, faces[:max_faces]
+
+        service = face_service.RecognitionService(workers=0)
+        with mock.patch.object(face_service, 'decode_image', side_effect=lambda data: data), \
+                mock.patch.object(face_service, 'inspect_faces', side_effect=inspect_faces), \
+                mock.patch.object(face_service, 'embed_faces', return_value=[[1.0], [2.0]]) as embed_faces:
+            results = service.analyze_batch([b'a', b'b', b'b'], max_faces=3)
+
+        embed_faces.assert_called_once()
+        self.assertEqual(len(embed_faces.call_args[0][0]), 2)
+        self.assertEqual([face_count for face_count, _, _ in results], [2, 3, 3])
+        self.assertEqual([[a.embedding for a in analyses] for _, analyses, _ in results], [[[1.0], None], [[2.0]], []])
+        self.assertEqual(service.stats()['completed'], 1)
+
+    def test_non_finite_embeddings_are_rejected(self):
+        import json
+
+        from django.contrib.auth.models import User
+        from rest_framework.test import APIRequestFactory, force_authenticate
+
+        from .views import EmployeeViewSet
+
+        view = EmployeeViewSet.as_view({'post': 'recognize_faces_batch'})
+        factory = APIRequestFactory()
+        valid = [0.1] * 512
+        requests = [
+            # json.loads trong view chấp nhận NaN khi embeddings gửi dạng chuỗi (multipart)
+            factory.post('/api/employees/recognize_faces_batch/',
+                         {'embeddings': json.dumps([valid, [float('nan')] * 512])}, format='multipart'),
+            # Vượt quá phạm vi float32 thành vô cùng
+            factory.post('/api/employees/recognize_faces_batch/', {'embeddings': [[1e39] + valid[1:]]}, format='json'),
+        ]
+        for request in requests:
+            force_authenticate(request, user=User(username='admin', is_staff=True))
+            with mock.patch('employees.views.get_face_gallery') as get_face_gallery:
+                response = view(request)
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('NaN', response.data['error'])
+            get_face_gallery.assert_not_called()
+
+    def test_pool_jobs_per_image(self):
+        from concurrent.futures import ThreadPoolExecutor
+
+        from . import face_service
+        from .face_pipeline import FaceAnalysis
+
+        crop = np.zeros((80, 80, 3), dtype=np.uint8)
+        inspected = (FaceAnalysis(1, True, 0.9, {}, None, 'retinaface'), crop)
+
+        def embed_faces(crops):
+            return [[1.0]] * len(crops)
+
+        class RecordingExecutor(ThreadPoolExecutor):
+            # Thay nhóm tiến trình suy luận: ghi lại các job được gửi sang
+            def submit(self, fn, *args):
+                jobs.append(fn.__name__)
+                return super().submit(fn, *args)
+
+        # Gom lô: phát hiện rồi gửi khuôn mặt trở lại nhóm để trích xuất embedding theo lô;
+        # không gom lô: một job cho cả hai bước
+        for batch_size, expected in ((4, ['_inspect_bytes', 'embed_faces']), (1, ['_analyze_bytes'])):
+            jobs = []
+            service = face_service.RecognitionService(workers=1, batch_size=batch_size, batch_wait_ms=0)
+            executor = RecordingExecutor(1)
+            with mock.patch.object(service, '_get_executor', return_value=executor), \
+                    mock.patch.object(face_service, 'decode_image', side_effect=lambda data: data), \
+                    mock.patch.object(face_service, 'inspect_face', return_value=inspected), \
+                    mock.patch.object(face_service, 'embed_faces', embed_faces):
+                analysis = service.analyze(b'a', timeout=5)
+            executor.shutdown()
+            self.assertEqual(analysis.embedding, [1.0])
+            self.assertEqual(jobs, expected)
+
+
+class ArtifactStagingTests(SimpleTestCase):
+    """Đóng gói trọng số kèm checksum, chép vào máy không có mạng và kiểm tra khi khởi động"""
+
+    def setUp(self):
+        import tempfile
+
+        self.tmp = tempfile.TemporaryDirectory()
+        root = Path(self.tmp.name)
+        self.online, self.offline = root / 'online', root / 'offline'
+        env = mock.patch.dict('os.environ', {'DEEPFACE_HOME': str(self.online)})
+        env.start()
+        self.addCleanup(env.stop)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _artifacts(self, home):
+        from .face_artifacts import Artifact
+
+        weights = home / '.deepface' / 'weights'
+        return [Artifact(name, weights / name) for name in ('retinaface.h5', 'facenet512_weights.h5')]
+
+    def _bundle(self):
+        from .face_artifacts import bundle_artifacts
+
+        for artifact in self._artifacts(self.online):
+            artifact.path.parent.mkdir(parents=True, exist_ok=True)
+            artifact.path.write_bytes(artifact.name.encode() * 100)
+        bundle = Path(self.tmp.name) / 'face_models.tar.gz'
+        bundle_artifacts(bundle, artifacts=self._artifacts(self.online))
+        return bundle
+
+    def _verify(self, checksums):
+        from .face_artifacts import verify_artifacts
+
+        with mock.patch('employees.face_artifacts.required_artifacts', return_value=self._artifacts(self.offline)):
+            return verify_artifacts(checksums=checksums)
+
+    def test_bundle_and_stage(self):
+        from .face_artifacts import file_sha256, read_manifest, stage_artifacts
+
+        bundle = self._bundle()
+        with mock.patch.dict('os.environ', {'DEEPFACE_HOME': str(self.offline)}):
+            self.assertEqual(len(self._verify(checksums=False)), 2)  # chưa có file nào
+            manifest = stage_artifacts(bundle, artifacts=self._artifacts(self.offline))
+            self.assertEqual(read_manifest(), manifest)
+            for artifact in self._artifacts(self.offline):
+                entry = manifest['artifacts'][artifact.name]
+                self.assertTrue(entry['verified'])
+                self.assertEqual(entry['sha256'], file_sha256(artifact.path))
+            self.assertEqual(self._verify(checksums=True), [])
+
+    def test_checksum_mismatch_leaves_no_file(self):
+        import tarfile
+
+        from .face_artifacts import ArtifactError, MANIFEST_NAME, stage_artifacts
+
+        bundle = self._bundle()
+        source = Path(self.tmp.name) / 'source'
+        with tarfile.open(bundle) as archive:
+            archive.extractall(source)
+        (source / 'facenet512_weights.h5').write_bytes(b'x' * 2100)  # cùng kích thước, khác nội dung
+        with mock.patch.dict('os.environ', {'DEEPFACE_HOME': str(self.offline)}):
+            with self.assertRaisesRegex(ArtifactError, 'facenet512_weights.h5'):
+                stage_artifacts(source, artifacts=self._artifacts(self.offline))
+            weights = self.offline / '.deepface' / 'weights'
+            self.assertEqual(sorted(path.name for path in weights.iterdir()), [])
+
+            (source / MANIFEST_NAME).unlink()
+            with self.assertRaisesRegex(ArtifactError, 'checksum'):
+                stage_artifacts(source, artifacts=self._artifacts(self.offline))
+
+    def test_verify_detects_modified_files(self):
+        from .face_artifacts import stage_artifacts
+
+        bundle = self._bundle()
+        with mock.patch.dict('os.environ', {'DEEPFACE_HOME': str(self.offline)}):
+            stage_artifacts(bundle, artifacts=self._artifacts(self.offline))
+            retinaface, facenet = self._artifacts(self.offline)
+            facenet.path.write_bytes(b'x' * facenet.path.stat().st_size)
+            # Cùng kích thước: chỉ phát hiện được khi tính lại SHA-256
+            self.assertEqual(self._verify(checksums=False), [])
+            self.assertEqual(len(self._verify(checksums=True)), 1)
+            retinaface.path.write_bytes(b'short')
+            self.assertIn('kích thước', self._verify(checksums=False)[0])
+            retinaface.path.unlink()
+            self.assertTrue(self._verify(checksums=False)[0].startswith('thiếu retinaface.h5'))
+
+
+class BackendImportTests(SimpleTestCase):
+    """Chỉ các backend suy luận (face_backends, face_onnx) được import framework học sâu"""
+
+    frameworks = ('deepface', 'tensorflow', 'tf_keras', 'keras', 'torch', 'tf2onnx', 'onnxruntime', 'onnx')
+    backend_modules = ('face_backends.py', 'face_onnx.py')
+
+    def test_frameworks_are_imported_only_by_backends(self):
+        root = Path(settings.BASE_DIR)
+        # Các package của dự án (bỏ qua virtualenv hay thư mục khác nằm trong backend/)
+        packages = [package.parent for package in root.glob('*/__init__.py')]
+        offenders = []
+        for path in sorted(path for package in packages for path in package.rglob('*.py')):
+            # Test được import DeepFace trực tiếp để đối chiếu (chỉ chạy khi đã cài, xem skipUnless)
+            if path.name in self.backend_modules or path.name == 'tests.py' or 'migrations' in path.parts:
+                continue
+            for node in ast.walk(ast.parse(path.read_text(encoding='utf-8'))):
+                if isinstance(node, ast.Import):
+                    names = [alias.name for alias in node.names]
+                elif isinstance(node, ast.ImportFrom) and node.level == 0:
+                    names = [node.module or '']
+                else:
+                    continue
+                if any(name.split('.')[0] in self.frameworks for name in names):
+                    offenders.append(f"{path.relative_to(root)}:{node.lineno}")
+        self.assertEqual(offenders, [])
+
+
+class StartupRoleTests(SimpleTestCase):
+    """Chỉ tiến trình phục vụ yêu cầu mới kiểm tra file trọng số và nạp mô hình khi khởi động"""
+
+    def _serves(self, argv, **env):
+        from .apps import _serves_requests
+
+        environ = {key: value for key, value in env.items() if value is not None}
+        with mock.patch('sys.argv', argv), mock.patch.dict('os.environ', environ, clear=True):
+            return _serves_requests()
+
+    def test_opt_in(self):
+        self.assertTrue(self._serves(['/usr/bin/gunicorn', '-c', 'gunicorn.conf.py'], FACE_SERVES_REQUESTS='True'))
+        self.assertTrue(self._serves(['manage.py', 'runserver'], RUN_MAIN='true'))
+        self.assertTrue(self._serves(['manage.py', 'runserver', '--noreload']))
+
+    def test_other_processes_do_not_load_models(self):
+        self.assertFalse(self._serves(['/usr/bin/gunicorn', 'face_checkin.wsgi']))
+        self.assertFalse(self._serves(['manage.py', 'runserver']))  # tiến trình cha của autoreloader
+        self.assertFalse(self._serves(['manage.py', 'migrate']))
+        self.assertFalse(self._serves(['-c']))
+        self.assertFalse(self._serves(['/usr/bin/celery', '-A', 'face_checkin', 'worker']))
+
+    def test_prefork_warmup_runs_in_workers(self):
+        from django.apps import apps
+
+        from . import face_preload
+
+        config = apps.get_app_config('employees')
+        environ = {'FACE_SERVES_REQUESTS': 'True', 'FACE_WARMUP_AFTER_FORK': 'True'}
+        for warmup_on_startup in (True, False):
+            options = {**getattr(settings, 'FACE_RECOGNITION', {}), 'WARMUP_ON_STARTUP': warmup_on_startup}
+            with override_settings(FACE_RECOGNITION=options), mock.patch.dict('os.environ', environ), \
+                    mock.patch('employees.face_artifacts.check_artifacts_on_startup'), \
+                    mock.patch('employees.face_warmup.start_warmup') as start_warmup:
+                config.ready()  # master
+                start_warmup.assert_not_called()
+                face_preload.after_fork()  # worker
+                self.assertEqual(start_warmup.called, warmup_on_startup)
+
+
+class OnnxPreprocessingTests(SimpleTestCase):
+    """prepare_batch đưa khuôn mặt vào mô hình ONNX giống hệt DeepFace.represent với detector_backend='skip'"""
+
+    def _asymmetric_crop(self):
+        # Nửa trên xanh dương, nửa dưới đỏ (BGR), không vuông: sai thứ tự kênh hay vị trí viền đều lộ ra
+        crop = np.zeros((120, 90, 3), dtype=np.uint8)
+        crop[:60] = (255, 0, 0)
+        crop[60:] = (0, 0, 255)
+        crop[:, :10] = (0, 255, 0)
+        return crop
+
+    def test_converts_bgr_to_rgb_and_pads(self):
+        from .face_onnx import prepare_batch
+
+        batch = prepare_batch([self._asymmetric_crop()], (160, 160))
+        self.assertEqual(batch.shape, (1, 160, 160, 3))
+        face = batch[0]
+        # Thu nhỏ 120x90 -> 160x120: viền đen 20 cột mỗi bên
+        self.assertEqual(face[:, :20].max(), 0.0)
+        self.assertEqual(face[:, 140:].max(), 0.0)
+        np.testing.assert_allclose(face[20, 80], (0.0, 0.0, 1.0))  # xanh dương ở kênh B của RGB
+        np.testing.assert_allclose(face[140, 80], (1.0, 0.0, 0.0))  # đỏ ở kênh R
+        np.testing.assert_allclose(face[80, 25], (0.0, 1.0, 0.0))
+
+    def test_normalizes_each_face(self):
+        from .face_onnx import prepare_batch
+
+        scaled = np.full((50, 50, 3), 0.5, dtype=np.float32)  # đã chia 255
+        batch = prepare_batch([self._asymmetric_crop(), scaled], (160, 160))
+        self.assertAlmostEqual(float(batch[1].max()), 0.5, places=6)
+        self.assertAlmostEqual(float(batch[0].max()), 1.0, places=6)
+
+    @unittest.skipUnless(importlib.util.find_spec('deepface'), 'Cần deepface và TensorFlow (requirements-tensorflow.txt)')
+    def test_matches_deepface_preprocessing(self):
+        from deepface.modules import preprocessing
+
+        from .face_onnx import prepare_batch
+
+        rng = np.random.default_rng(0)
+        crops = [self._asymmetric_crop()] + [
+            rng.integers(0, 256, shape + (3,), dtype=np.uint8) for shape in ((203, 171), (97, 120))
+        ]
+        batch = prepare_batch(crops, (160, 160))
+        for crop, prepared in zip(crops, batch):
+            # Các bước của DeepFace.represent khi detector_backend='skip'
+            expected = preprocessing.resize_image(img=crop[:, :, ::-1], target_size=(160, 160))
+            expected = preprocessing.normalize_input(img=expected, normalization='base')
+            np.testing.assert_allclose(prepared, expected[0], atol=1e-6)
+
+
+@unittest.skipUnless(importlib.util.find_spec('deepface'), 'Cần deepface và TensorFlow (requirements-tensorflow.txt)')
+class KerasEmbedderParityTests(SimpleTestCase):
+    """Embedding của một khuôn mặt không phụ thuộc vào việc MicroBatcher có gom lô hay không"""
+
+    def test_single_and_batch_embeddings_match(self):
+        from .face_backends import KerasEmbedder
+
+        rng = np.random.default_rng(0)
+        crops = [rng.integers(0, 256, shape + (3,), dtype=np.uint8) for shape in ((160, 160), (203, 171), (97, 120))]
+        embedder = KerasEmbedder()
+        batch = np.asarray(embedder.embed(crops))
+        for crop, batched in zip(crops, batch):
+            single = np.asarray(embedder.embed_one(crop))
+            cosine = single @ batched / (np.linalg.norm(single) * np.linalg.norm(batched))
+            self.assertGreater(cosine, 0.9999)
+            np.testing.assert_allclose(single, batched, rtol=1e-3, atol=1e-4)
@@ -5,7 +5,6 @@ from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, IsAdminUser, AllowAny
 # import face_recognition
 import numpy as np
-import pickle
 from django.conf import settings
 from django.http import HttpResponse
 from django.utils import timezone
@@ -28,7 +27,11 @@ from .serializers import (
     DepartmentSerializer, ShiftSerializer, FaceDataSerializer,
     UserProfileSerializer
 )
-from .anti_spoofing import LivenessDetector
+from .face_encoding import decode_embedding, encode_embedding
+from .face_gallery import get_face_gallery
+from .face_service import RecognitionBusy, RecognitionTimeout, analyze_upload, get_recognition_service
+from .face_templates import enforce_template_cap
+from .face_settings import face_setting
 
 class UserProfileViewSet(viewsets.ModelViewSet):
     queryset = UserProfile.objects.all()
@@ -481,8 +484,8 @@ class EmployeeViewSet(viewsets.ModelViewSet):
         for face in face_data:
             # Giải mã dữ liệu để lấy thông tin bổ sung
             try:
-                face_encoding_data = pickle.loads(face.face_encoding)
-                liveness_score = face_encoding_data.get('liveness_score', 'N/A')
+                record = decode_embedding(face.face_encoding)
+                liveness_score = record.liveness_score if record and record.liveness_score is not None else 'N/A'
             except:
                 liveness_score = 'N/A'
             
@@ -553,134 +556,101 @@ class EmployeeViewSet(viewsets.ModelViewSet):
         image_file = request.FILES['image']
         
         try:
-            from PIL import Image
-            import io
-            import cv2
-            from deepface import DeepFace
-            
             logger = logging.getLogger(__name__)
             logger.info(f"Bắt đầu đăng ký khuôn mặt cho nhân viên {employee.first_name} {employee.last_name}")
             
-            # Kiểm tra và xóa dữ liệu khuôn mặt cũ nếu có
-            try:
-                existing_face_data = FaceData.objects.get(employee=employee)
-                logger.info(f"Xóa dữ liệu khuôn mặt cũ cho nhân viên {employee.first_name} {employee.last_name}")
-                existing_face_data.delete()
-            except FaceData.DoesNotExist:
-                # Không có dữ liệu khuôn mặt cũ, tiếp tục
-                pass
+            # Mặc định thêm mẫu mới bên cạnh các mẫu cũ; replace=true để thay toàn bộ mẫu cũ
+            replace_existing = str(request.data.get('replace', '')).lower() in ('1', 'true', 'yes')
             
-            # Đọc ảnh từ request
-            image_stream = io.BytesIO(image_file.read())
-            image_file.seek(0)  # Đặt lại con trỏ file để có thể đọc lại sau
+            # Phát hiện khuôn mặt một lần, dùng lại vùng khuôn mặt cho anti-spoofing và embedding
+            # (chạy trên tiến trình suy luận, ảnh được giải mã trong bộ nhớ)
+            analysis = analyze_upload(image_file)
             
-            # Chuyển đổi sang định dạng numpy array
-            pil_image = Image.open(image_stream)
-            img_array = np.array(pil_image)
+            if analysis.face_count == 0:
+                return Response(
+                    {'error': 'Không phát hiện khuôn mặt trong hình ảnh. Vui lòng thử lại với ánh sáng tốt hơn và đảm bảo khuôn mặt nhìn rõ vào camera.'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
             
-            # Lưu ảnh tạm thời để DeepFace xử lý
-            temp_image_path = "temp_face_img.jpg"
-            cv2.imwrite(temp_image_path, cv2.cvtColor(img_array, cv2.COLOR_RGB2BGR))
+            if analysis.face_count > 1:
+                return Response(
+                    {'error': 'Phát hiện nhiều khuôn mặt trong hình ảnh. Vui lòng cung cấp hình ảnh với chỉ một khuôn mặt.'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
             
-            try:
-                # Sử dụng DeepFace để phát hiện khuôn mặt với anti-spoofing
-                try:
-                    face_objs = DeepFace.extract_faces(
-                        img_path=temp_image_path, 
-                        detector_backend="retinaface",
-                        anti_spoofing=True
-                    )
-                except Exception as spoof_error:
-                    logger.warning(f"Không thể sử dụng anti-spoofing: {str(spoof_error)}")
-                    # Nếu anti-spoofing gặp lỗi, thử lại không sử dụng anti-spoofing
-                    face_objs = DeepFace.extract_faces(
-                        img_path=temp_image_path, 
-                        detector_backend="retinaface",
-                        anti_spoofing=False
-                    )
-                    # Giả định khuôn mặt là thật
-                    for i in range(len(face_objs)):
-                        face_objs[i]["is_real"] = True
-                        face_objs[i]["liveness_score"] = 0.9
-                    
-                logger.info(f"Số khuôn mặt phát hiện được: {len(face_objs)}")
-                
-                if len(face_objs) == 0:
-                    return Response(
-                        {'error': 'Không phát hiện khuôn mặt trong hình ảnh. Vui lòng thử lại với ánh sáng tốt hơn và đảm bảo khuôn mặt nhìn rõ vào camera.'},
-                        status=status.HTTP_400_BAD_REQUEST
-                    )
-                
-                if len(face_objs) > 1:
-                    return Response(
-                        {'error': 'Phát hiện nhiều khuôn mặt trong hình ảnh. Vui lòng cung cấp hình ảnh với chỉ một khuôn mặt.'},
-                        status=status.HTTP_400_BAD_REQUEST
-                    )
-                
-                # Kiểm tra khuôn mặt thật/giả
-                is_real_face = face_objs[0].get("is_real", True)
-                liveness_score = face_objs[0].get("liveness_score", 0.9)
-                
-                logger.info(f"Kết quả kiểm tra khuôn mặt thật/giả: {is_real_face}, điểm: {liveness_score:.2f}")
-                
-                # Không cho phép đăng ký với khuôn mặt giả
-                if not is_real_face:
-                    return Response(
-                        {
-                            'error': 'Phát hiện khuôn mặt không phải khuôn mặt thật. Vui lòng sử dụng khuôn mặt thật để đăng ký.',
-                            'liveness_score': liveness_score,
-                            'details': {'is_real': is_real_face}
-                        },
-                        status=status.HTTP_400_BAD_REQUEST
-                    )
-                
-                # Trích xuất đặc trưng khuôn mặt sử dụng DeepFace
-                embedding_objs = DeepFace.represent(
-                    img_path=temp_image_path,
-                    detector_backend="retinaface",
-                    model_name="Facenet512"
+            # Ảnh không đạt chất lượng ở bước lọc nhanh: chưa kết luận được khuôn mặt thật hay giả
+            if analysis.quality_issue:
+                return Response(
+                    {
+                        'error': 'Ảnh khuôn mặt chưa đạt chất lượng (quá nhỏ, bị mờ hoặc thiếu chi tiết). Vui lòng đứng gần camera hơn, giữ yên và thử lại với ánh sáng tốt hơn.',
+                        'quality_issue': analysis.quality_issue,
+                        'liveness_score': analysis.liveness_score
+                    },
+                    status=status.HTTP_400_BAD_REQUEST
                 )
-                
-                if len(embedding_objs) == 0:
-                    return Response(
-                        {'error': 'Không thể trích xuất đặc trưng khuôn mặt. Vui lòng thử lại với ảnh chất lượng tốt hơn.'},
-                        status=status.HTTP_400_BAD_REQUEST
-                    )
-                
-                # Lấy embedding (vector đặc trưng) từ kết quả
-                face_embedding = embedding_objs[0]["embedding"]
-                
-                # Lưu dữ liệu khuôn mặt
-                face_data = FaceData(
-                    employee=employee,
-                    face_encoding=pickle.dumps({
-                        'encoding': face_embedding,
-                        'employee_id': employee.employee_id,  # Changed from employee.id to employee.employee_id
-                        'liveness_score': liveness_score
-                    }),
-                    image=image_file
+            
+            is_real_face = analysis.is_real
+            liveness_score = analysis.liveness_score
+            
+            # Không cho phép đăng ký với khuôn mặt giả
+            if not is_real_face:
+                return Response(
+                    {
+                        'error': 'Phát hiện khuôn mặt không phải khuôn mặt thật. Vui lòng sử dụng khuôn mặt thật để đăng ký.',
+                        'liveness_score': liveness_score,
+                        'details': {'is_real': is_real_face}
+                    },
+                    status=status.HTTP_400_BAD_REQUEST
                 )
-                face_data.save()
-                
-                # Xóa ảnh tạm thời sau khi đã hoàn thành mọi xử lý
-                import os
-                if os.path.exists(temp_image_path):
-                    os.remove(temp_image_path)
-                
-                return Response({
-                    'success': True,
-                    'message': f'Đã đăng ký khuôn mặt thành công cho {employee.first_name} {employee.last_name}',
-                    'face_data_id': face_data.id,
-                    'liveness_score': liveness_score,
-                    'details': {'is_real': is_real_face}
-                })
-            except Exception as e:
-                # Xóa ảnh tạm thời trong trường hợp lỗi
-                import os
-                if os.path.exists(temp_image_path):
-                    os.remove(temp_image_path)
-                raise e
-                
+            
+            if analysis.embedding is None:
+                return Response(
+                    {'error': 'Không thể trích xuất đặc trưng khuôn mặt. Vui lòng thử lại với ảnh chất lượng tốt hơn.'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            
+            face_embedding = analysis.embedding
+            
+            # Lưu dữ liệu khuôn mặt
+            face_data = FaceData(
+                employee=employee,
+                face_encoding=encode_embedding(
+                    face_embedding,
+                    model_name=face_setting('MODEL_NAME'),
+                    dtype=face_setting('EMBEDDING_DTYPE'),
+                    liveness_score=liveness_score
+                ),
+                image=image_file
+            )
+            face_data.save()
+            
+            # Chỉ xóa mẫu cũ sau khi mẫu mới đã được lưu thành công
+            if replace_existing:
+                logger.info(f"Xóa dữ liệu khuôn mặt cũ cho nhân viên {employee.first_name} {employee.last_name}")
+                FaceData.objects.filter(employee=employee).exclude(id=face_data.id).delete()
+            evicted_ids = enforce_template_cap(employee, keep_id=face_data.id)
+            
+            return Response({
+                'success': True,
+                'message': f'Đã đăng ký khuôn mặt thành công cho {employee.first_name} {employee.last_name}',
+                'face_data_id': face_data.id,
+                'total_templates': FaceData.objects.filter(employee=employee).count(),
+                'evicted_face_data_ids': evicted_ids,
+                'liveness_score': liveness_score,
+                'details': {'is_real': is_real_face}
+            })
+        except RecognitionBusy as e:
+            logger.warning(f"Từ chối yêu cầu nhận diện: {str(e)}")
+            return Response(
+                {'error': 'Hệ thống nhận diện đang quá tải. Vui lòng thử lại sau giây lát.'},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE
+            )
+        except RecognitionTimeout as e:
+            logger.warning(f"Quá thời gian nhận diện: {str(e)}")
+            return Response(
+                {'error': 'Hệ thống nhận diện phản hồi quá chậm. Vui lòng thử lại.'},
+                status=status.HTTP_504_GATEWAY_TIMEOUT
+            )
         except Exception as e:
             import traceback
             logger.error(f"Lỗi khi đăng ký khuôn mặt: {str(e)}")
@@ -692,7 +662,7 @@ class EmployeeViewSet(viewsets.ModelViewSet):
     
     @action(detail=False, methods=['post'])
     def recognize_face(self, request):
-        """Nhận diện khuôn mặt từ ảnh sử dụng DeepFace"""
+        """Nhận diện khuôn mặt từ ảnh sử dụng DeepFace (truyền employee_id để chỉ xác minh 1:1)"""
         if 'image' not in request.FILES:
             return Response(
                 {'error': 'Không tìm thấy hình ảnh trong yêu cầu'},
@@ -702,196 +672,122 @@ class EmployeeViewSet(viewsets.ModelViewSet):
         image_file = request.FILES['image']
         
         try:
-            from PIL import Image
-            import io
-            import cv2
-            from deepface import DeepFace
-            from scipy.spatial.distance import cosine
-            import os
-            
             logger = logging.getLogger(__name__)
             logger.info("Bắt đầu quá trình nhận diện khuôn mặt")
             
-            # Đọc ảnh từ request
-            image_stream = io.BytesIO(image_file.read())
+            # Phát hiện khuôn mặt một lần, dùng lại vùng khuôn mặt cho anti-spoofing và embedding
+            # (chạy trên tiến trình suy luận, ảnh được giải mã trong bộ nhớ)
+            analysis = analyze_upload(image_file)
             
-            # Chuyển đổi sang định dạng numpy array
-            pil_image = Image.open(image_stream)
-            img_array = np.array(pil_image)
+            if analysis.face_count == 0:
+                return Response(
+                    {'error': 'Không phát hiện khuôn mặt trong hình ảnh'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
             
-            # Lưu ảnh tạm thời để DeepFace xử lý
-            temp_image_path = "temp_face_img.jpg"
-            cv2.imwrite(temp_image_path, cv2.cvtColor(img_array, cv2.COLOR_RGB2BGR))
+            if analysis.face_count > 1:
+                return Response(
+                    {'error': 'Phát hiện nhiều khuôn mặt trong hình ảnh. Vui lòng chỉ đưa một khuôn mặt vào khung hình.'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
             
-            try:
-                # Sử dụng DeepFace để phát hiện khuôn mặt
-                try:
-                    face_objs = DeepFace.extract_faces(
-                        img_path=temp_image_path, 
-                        detector_backend="retinaface",
-                        anti_spoofing=True
-                    )
-                except Exception as spoof_error:
-                    logger.warning(f"Không thể sử dụng anti-spoofing: {str(spoof_error)}")
-                    # Nếu anti-spoofing gặp lỗi, thử lại không sử dụng anti-spoofing
-                    face_objs = DeepFace.extract_faces(
-                        img_path=temp_image_path, 
-                        detector_backend="retinaface",
-                        anti_spoofing=False
-                    )
-                    # Giả định khuôn mặt là thật
-                    for i in range(len(face_objs)):
-                        face_objs[i]["is_real"] = True
-                        face_objs[i]["liveness_score"] = 0.9
-                
-                logger.info(f"Số khuôn mặt phát hiện được: {len(face_objs)}")
-                
-                if len(face_objs) == 0:
-                    # Xóa ảnh tạm thời
-                    if os.path.exists(temp_image_path):
-                        os.remove(temp_image_path)
-                    return Response(
-                        {'error': 'Không phát hiện khuôn mặt trong hình ảnh'},
-                        status=status.HTTP_400_BAD_REQUEST
-                    )
-                
-                if len(face_objs) > 1:
-                    # Xóa ảnh tạm thời
-                    if os.path.exists(temp_image_path):
-                        os.remove(temp_image_path)
-                    return Response(
-                        {'error': 'Phát hiện nhiều khuôn mặt trong hình ảnh. Vui lòng chỉ đưa một khuôn mặt vào khung hình.'},
-                        status=status.HTTP_400_BAD_REQUEST
-                    )
-                
-                # Kiểm tra khuôn mặt thật/giả
-                is_real_face = face_objs[0].get("is_real", True)
-                liveness_score = face_objs[0].get("liveness_score", 0.9)
-                
-                logger.info(f"Kết quả kiểm tra khuôn mặt thật/giả: {is_real_face}, điểm: {liveness_score:.2f}")
-                
-                if not is_real_face:
-                    # Xóa ảnh tạm thời
-                    if os.path.exists(temp_image_path):
-                        os.remove(temp_image_path)
-                    return Response(
-                        {
-                            'error': 'Phát hiện khuôn mặt không phải khuôn mặt thật.',
-                            'liveness_score': liveness_score,
-                            'details': {'is_real': is_real_face}
-                        },
-                        status=status.HTTP_400_BAD_REQUEST
-                    )
-                
-                # Trích xuất đặc trưng khuôn mặt từ ảnh đầu vào
-                embedding_objs = DeepFace.represent(
-                    img_path=temp_image_path,
-                    detector_backend="retinaface",
-                    model_name="Facenet512"
+            # Ảnh không đạt chất lượng ở bước lọc nhanh: chưa kết luận được khuôn mặt thật hay giả
+            if analysis.quality_issue:
+                return Response(
+                    {
+                        'error': 'Ảnh khuôn mặt chưa đạt chất lượng (quá nhỏ, bị mờ hoặc thiếu chi tiết). Vui lòng đứng gần camera hơn, giữ yên và thử lại với ánh sáng tốt hơn.',
+                        'quality_issue': analysis.quality_issue,
+                        'liveness_score': analysis.liveness_score
+                    },
+                    status=status.HTTP_400_BAD_REQUEST
                 )
+            
+            if not analysis.is_real:
+                return Response(
+                    {
+                        'error': 'Phát hiện khuôn mặt không phải khuôn mặt thật.',
+                        'liveness_score': analysis.liveness_score,
+                        'details': {'is_real': analysis.is_real}
+                    },
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            
+            if analysis.embedding is None:
+                return Response(
+                    {'error': 'Không thể trích xuất đặc trưng khuôn mặt. Vui lòng thử lại với ảnh chất lượng tốt hơn.'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            
+            unknown_face_embedding = analysis.embedding
+            
+            # Lấy gallery embedding khuôn mặt đã đăng ký (xây dựng một lần cho mỗi tiến trình)
+            gallery = get_face_gallery()
+            
+            if len(gallery) == 0:
+                return Response(
+                    {'error': 'Không có dữ liệu khuôn mặt nào trong hệ thống'},
+                    status=status.HTTP_404_NOT_FOUND
+                )
+            
+            logger.info(f"Số lượng dữ liệu khuôn mặt trong gallery: {len(gallery)}")
+            
+            # Có employee_id: chỉ xác minh 1:1 với các mẫu của nhân viên đó.
+            # Không có: tìm khuôn mặt khớp nhất bằng một phép nhân ma trận-vector trên toàn bộ gallery
+            employee_id_hint = request.data.get('employee_id')
+            if employee_id_hint:
+                best_match = gallery.verify(unknown_face_embedding, employee_id_hint)
+            else:
+                matches = gallery.search(unknown_face_embedding, top_k=1)
+                best_match = matches[0] if matches else None
+            best_match_distance = best_match.distance if best_match else float('inf')  # Càng thấp càng tốt
+            
+            # Ngưỡng cosine distance mặc định là 0.4
+            # Với cosine distance, giá trị càng thấp càng giống nhau
+            threshold = face_setting('DISTANCE_THRESHOLD')
+            
+            logger.info(f"Best match distance: {best_match_distance}, threshold: {threshold}")
+            
+            if best_match is not None and best_match_distance < threshold:
+                employee = Employee.objects.get(employee_id=best_match.employee_id)
                 
-                # Xóa ảnh tạm thời sau khi sử dụng
-                if os.path.exists(temp_image_path):
-                    os.remove(temp_image_path)
-                
-                if len(embedding_objs) == 0:
-                    return Response(
-                        {'error': 'Không thể trích xuất đặc trưng khuôn mặt. Vui lòng thử lại với ảnh chất lượng tốt hơn.'},
-                        status=status.HTTP_400_BAD_REQUEST
-                    )
-                
-                unknown_face_embedding = embedding_objs[0]["embedding"]
-                
-                # Lấy tất cả dữ liệu khuôn mặt đã đăng ký
-                all_face_data = FaceData.objects.all()
-                
-                if not all_face_data:
-                    return Response(
-                        {'error': 'Không có dữ liệu khuôn mặt nào trong hệ thống'},
-                        status=status.HTTP_404_NOT_FOUND
-                    )
-                
-                logger.info(f"Số lượng dữ liệu khuôn mặt trong CSDL: {all_face_data.count()}")
-                
-                # Tìm khuôn mặt khớp nhất
-                best_match = None
-                best_match_distance = float('inf')  # Càng thấp càng tốt với face_distance
-                
-                # So sánh khuôn mặt đầu vào với tất cả khuôn mặt đã đăng ký
-                for face_data in all_face_data:
-                    try:
-                        # Giải mã dữ liệu khuôn mặt
-                        stored_data = pickle.loads(face_data.face_encoding)
-                        
-                        # Kiểm tra cấu trúc dữ liệu
-                        if not isinstance(stored_data, dict):
-                            logger.warning(f"Dữ liệu khuôn mặt không hợp lệ cho ID: {face_data.id}")
-                            continue
-                        
-                        if 'encoding' not in stored_data:
-                            logger.warning(f"Không tìm thấy encoding trong dữ liệu khuôn mặt ID: {face_data.id}")
-                            continue
-                        
-                        # Lấy vector đặc trưng đã lưu
-                        stored_face_embedding = stored_data['encoding']
-                        
-                        # Tính khoảng cách cosine giữa hai vector đặc trưng
-                        unknown_embedding_array = np.array(unknown_face_embedding)
-                        stored_embedding_array = np.array(stored_face_embedding)
-                        
-                        # Tính cosine distance
-                        cosine_distance = cosine(unknown_embedding_array, stored_embedding_array)
-                        
-                        logger.info(f"Khoảng cách cosine với khuôn mặt ID {face_data.id}: {cosine_distance}")
-                        
-                        # Cập nhật best match (khoảng cách càng nhỏ thì càng giống nhau)
-                        if cosine_distance < best_match_distance:
-                            best_match = face_data
-                            best_match_distance = cosine_distance
-                        
-                    except Exception as e:
-                        logger.error(f"Lỗi khi so sánh khuôn mặt: {str(e)}")
-                        continue
-                
-                # Ngưỡng cosine distance mặc định là 0.4
-                # Với cosine distance, giá trị càng thấp càng giống nhau
-                threshold = 0.4
-                
-                logger.info(f"Best match distance: {best_match_distance}, threshold: {threshold}")
+                # Lấy thông tin nhân viên
+                employee_data = {
+                    'id': employee.employee_id,
+                    'employee_id': employee.employee_id,
+                    'first_name': employee.first_name,
+                    'last_name': employee.last_name,
+                    'full_name': f"{employee.first_name} {employee.last_name}",
+                    'department': employee.department.name if employee.department else None,
+                    'match_confidence': round((1 - best_match_distance) * 100, 2)  # Đổi thành phần trăm độ tin cậy
+                }
                 
-                if best_match is not None and best_match_distance < threshold:
-                    employee = best_match.employee
-                    
-                    # Lấy thông tin nhân viên
-                    employee_data = {
-                        'id': employee.employee_id,
-                        'employee_id': employee.employee_id,
-                        'first_name': employee.first_name,
-                        'last_name': employee.last_name,
-                        'full_name': f"{employee.first_name} {employee.last_name}",
-                        'department': employee.department.name if employee.department else None,
-                        'match_confidence': round((1 - best_match_distance) * 100, 2)  # Đổi thành phần trăm độ tin cậy
-                    }
-                    
-                    return Response({
-                        'success': True,
-                        'message': f'Đã nhận diện thành công: {employee.first_name} {employee.last_name}',
-                        'employee': employee_data
-                    })
-                else:
-                    return Response({
-                        'success': False,
-                        'message': 'Không tìm thấy khuôn mặt phù hợp trong cơ sở dữ liệu',
-                        'best_match_distance': best_match_distance,
-                        'threshold': threshold
-                    }, status=status.HTTP_404_NOT_FOUND)
-                
-            except Exception as e:
-                # Xóa ảnh tạm thời trong trường hợp lỗi
-                if os.path.exists(temp_image_path):
-                    os.remove(temp_image_path)
-                raise e
-        
+                return Response({
+                    'success': True,
+                    'message': f'Đã nhận diện thành công: {employee.first_name} {employee.last_name}',
+                    'employee': employee_data,
+                    'mode': 'verify' if employee_id_hint else 'identify'
+                })
+            else:
+                return Response({
+                    'success': False,
+                    'message': 'Không tìm thấy khuôn mặt phù hợp trong cơ sở dữ liệu',
+                    'best_match_distance': best_match_distance,
+                    'threshold': threshold,
+                    'mode': 'verify' if employee_id_hint else 'identify'
+                }, status=status.HTTP_404_NOT_FOUND)
+            
+        except RecognitionBusy as e:
+            logger.warning(f"Từ chối yêu cầu nhận diện: {str(e)}")
+            return Response(
+                {'error': 'Hệ thống nhận diện đang quá tải. Vui lòng thử lại sau giây lát.'},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE
+            )
+        except RecognitionTimeout as e:
+            logger.warning(f"Quá thời gian nhận diện: {str(e)}")
+            return Response(
+                {'error': 'Hệ thống nhận diện phản hồi quá chậm. Vui lòng thử lại.'},
+                status=status.HTTP_504_GATEWAY_TIMEOUT
+            )
         except Exception as e:
             import traceback
             logger.error(f"Lỗi khi nhận diện khuôn mặt: {str(e)}")
@@ -901,6 +797,153 @@ class EmployeeViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
+    
+    @action(detail=False, methods=['post'], permission_classes=[IsAdminUser])
+    def recognize_faces_batch(self, request):
+        """
+        Nhận diện nhiều khuôn mặt trong một yêu cầu (cổng soát vé, kiểm tra camera giám sát)
+        
+        Nhận danh sách ảnh (trường images) và/hoặc embedding đã tính sẵn (trường embeddings, JSON
+        dạng [[...], ...]). Khuôn mặt trong ảnh đi qua cùng pipeline với recognize_face (lọc nhanh,
+        anti-spoofing) trên tiến trình suy luận, tối đa BATCH_MAX_FACES khuôn mặt mỗi yêu cầu. Mọi
+        khuôn mặt được so khớp cùng lúc bằng một phép nhân ma trận-ma trận với gallery và trả về
+        top-k ứng viên cho từng khuôn mặt.
+        
+        Chỉ dành cho admin: endpoint nhận embedding tùy ý nên có thể dùng để tra danh tính trong gallery.
+        """
+        logger = logging.getLogger(__name__)
+        images = request.FILES.getlist('images')
+        
+        try:
+            embeddings = request.data.get('embeddings') or []
+            if isinstance(embeddings, str):
+                embeddings = json.loads(embeddings)
+            with np.errstate(over='ignore'):
+                embeddings = [np.asarray(embedding, dtype=np.float32) for embedding in embeddings]
+            top_k = int(request.data.get('top_k', face_setting('GALLERY_TOP_K')))
+        except (TypeError, ValueError) as e:
+            return Response(
+                {'error': f'Dữ liệu embeddings hoặc top_k không hợp lệ: {str(e)}'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        # NaN/Infinity (json.loads chấp nhận) hoặc giá trị vượt quá float32 làm hỏng điểm của cả lô
+        if not all(np.isfinite(embedding).all() for embedding in embeddings):
+            return Response(
+                {'error': 'Embedding chứa giá trị không hợp lệ (NaN hoặc vô cùng)'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if not 1 <= top_k <= 50:
+            return Response(
+                {'error': 'top_k phải nằm trong khoảng 1-50'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        max_probes = face_setting('BATCH_MAX_PROBES')
+        if not images and not embeddings:
+            return Response(
+                {'error': 'Cần gửi ít nhất một ảnh (images) hoặc một embedding (embeddings)'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if len(images) + len(embeddings) > max_probes:
+            return Response(
+                {'error': f'Mỗi yêu cầu tối đa {max_probes} ảnh/embedding'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        dim = face_setting('EMBEDDING_DIM')
+        probes, results = [], []
+        
+        # Embedding gửi sẵn: chỉ cần kiểm tra kích thước
+        for i, embedding in enumerate(embeddings):
+            result = {'source': 'embedding', 'index': i}
+            if embedding.shape != (dim,):
+                result['error'] = f'Embedding có {embedding.size} chiều, cần {dim} chiều'
+            else:
+                probes.append(embedding)
+                result['probe'] = len(probes) - 1
+            results.append(result)
+        
+        # Ảnh: phát hiện, kiểm tra và trích xuất đặc trưng mọi khuôn mặt trên tiến trình suy luận
+        if images:
+            max_faces = face_setting('BATCH_MAX_FACES')
+            try:
+                analyzed = get_recognition_service().analyze_batch([image_file.read() for image_file in images], max_faces)
+            except RecognitionBusy as e:
+                logger.warning(f"Từ chối yêu cầu nhận diện theo lô: {str(e)}")
+                return Response(
+                    {'error': 'Hệ thống nhận diện đang quá tải. Vui lòng thử lại sau giây lát.'},
+                    status=status.HTTP_503_SERVICE_UNAVAILABLE
+                )
+            except RecognitionTimeout as e:
+                logger.warning(f"Quá thời gian nhận diện theo lô: {str(e)}")
+                return Response(
+                    {'error': 'Hệ thống nhận diện phản hồi quá chậm. Vui lòng thử lại.'},
+                    status=status.HTTP_504_GATEWAY_TIMEOUT
+                )
+            
+            for i, (image_file, (face_count, analyses, error)) in enumerate(zip(images, analyzed)):
+                base = {'source': 'image', 'index': i, 'image': image_file.name}
+                if error is not None or face_count == 0:
+                    results.append({**base, 'error': f'Không phát hiện khuôn mặt: {error}' if error else 'Không phát hiện khuôn mặt'})
+                    continue
+                
+                for face_index, analysis in enumerate(analyses):
+                    result = {
+                        **base,
+                        'face_index': face_index,
+                        'facial_area': analysis.facial_area,
+                        'liveness_score': analysis.liveness_score
+                    }
+                    if analysis.quality_issue:
+                        result['error'] = 'Khuôn mặt chưa đạt chất lượng (quá nhỏ, bị mờ hoặc thiếu chi tiết)'
+                        result['quality_issue'] = analysis.quality_issue
+                    elif not analysis.is_real:
+                        result['error'] = 'Phát hiện khuôn mặt không phải khuôn mặt thật'
+                    elif analysis.embedding is None:
+                        result['error'] = 'Không thể trích xuất đặc trưng khuôn mặt'
+                    else:
+                        probes.append(np.asarray(analysis.embedding, dtype=np.float32))
+                        result['probe'] = len(probes) - 1
+                    results.append(result)
+                
+                if face_count > len(analyses):
+                    results.append({
+                        **base,
+                        'skipped_faces': face_count - len(analyses),
+                        'error': f'Bỏ qua {face_count - len(analyses)} khuôn mặt: mỗi yêu cầu tối đa {max_faces} khuôn mặt'
+                    })
+        
+        # So khớp toàn bộ probe cùng lúc
+        threshold = face_setting('DISTANCE_THRESHOLD')
+        matches = get_face_gallery().search_batch(np.stack(probes), top_k=top_k, per_employee=True) if probes else []
+        for result in results:
+            probe = result.pop('probe', None)
+            if probe is None:
+                continue
+            result['matches'] = [
+                {
+                    'employee_id': match.employee_id,
+                    'face_data_id': match.face_data_id,
+                    'similarity': round(match.similarity, 4),
+                    'distance': round(match.distance, 4),
+                    'is_match': match.distance < threshold
+                }
+                for match in matches[probe]
+            ]
+        
+        logger.info(f"Nhận diện theo lô: {len(images)} ảnh, {len(embeddings)} embedding, {len(probes)} khuôn mặt")
+        return Response({
+            'success': True,
+            'threshold': threshold,
+            'top_k': top_k,
+            'total_faces': len(probes),
+            'results': results
+        })
+
+    @action(detail=False, methods=['get'], permission_classes=[IsAdminUser])
+    def recognition_stats(self, request):
+        """Số liệu hàng đợi và độ trễ suy luận khuôn mặt của tiến trình web xử lý yêu cầu này"""
+        return Response(get_recognition_service().stats())
 
 class RegistrationAPIView(APIView):
     permission_classes = [AllowAny]  # Cho phép bất kỳ ai truy cập
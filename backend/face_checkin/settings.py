@@ -137,6 +137,33 @@ PASSWORD_VALIDATION = {
     'SAMPLE_PASSWORD': 'P@ssw0rd2025'  # Mật khẩu mẫu
 }
 
+# Cấu hình nhận diện khuôn mặt (giá trị mặc định nằm trong employees/face_settings.py)
+FACE_RECOGNITION = {
+    'MODEL_NAME': 'Facenet512',
+    'GALLERY_TOP_K': 5,  # Số ứng viên lấy từ gallery cho mỗi lần điểm danh
+    'GALLERY_INDEX': 'brute_force',  # 'ivf' cho kết quả như vét cạn, chỉ nhanh hơn khi embedding tụ thành cụm chặt
+    'GALLERY_COMPRESSION': 'none',  # 'int8' / 'pca' / 'pq' cho máy chủ kiosk ít bộ nhớ
+    'GALLERY_SNAPSHOT_DIR': os.getenv('FACE_GALLERY_SNAPSHOT_DIR') or None,  # Snapshot gallery dùng chung giữa các worker
+    'MAX_TEMPLATES_PER_EMPLOYEE': 5,  # Số mẫu khuôn mặt tối đa mỗi nhân viên (kính, râu, ánh sáng khác nhau)
+    'TEMPLATE_EVICTION': 'oldest',  # 'redundant' để giữ các mẫu khác biệt nhau nhất
+    'SHIFT_TIER_WINDOW_MINUTES': 60,  # Giờ cao điểm: tìm trước nhân viên vào/tan ca trong khoảng này
+    'DETECTION_MAX_SIDE': 640,  # Khung hình webcam được thu nhỏ về cạnh dài 640px để phát hiện khuôn mặt
+    'DETECTION_BACKEND': os.getenv('FACE_DETECTION_BACKEND', 'deepface'),  # 'yunet' để không cần TensorFlow
+    'DETECTOR_CASCADE': ['yunet', 'retinaface'],  # YuNet trước, RetinaFace khi YuNet không chắc chắn
+    'ANTI_SPOOFING_BACKEND': os.getenv('FACE_ANTI_SPOOFING_BACKEND', 'fasnet'),  # 'none' để không cần PyTorch
+    'LIVENESS_PREGATE': os.getenv('FACE_LIVENESS_PREGATE', 'False') == 'True',  # Loại nhanh khuôn mặt quá nhỏ/mờ/phẳng; bật sau khi hiệu chỉnh ngưỡng
+    'EMBEDDING_BACKEND': os.getenv('FACE_EMBEDDING_BACKEND', 'keras'),  # 'onnx' sau khi chạy export_embedding_model
+    'EMBEDDING_ONNX_THREADS': int(os.getenv('FACE_EMBEDDING_ONNX_THREADS', '0')),  # 1 khi chạy gunicorn.conf.py (dùng chung mô hình sau fork)
+    'INFERENCE_WORKERS': int(os.getenv('FACE_INFERENCE_WORKERS', '0')),  # Tiến trình giữ sẵn mô hình cho mỗi worker web, 0 = chạy trong luồng request
+    'INFERENCE_QUEUE_DEPTH': 16,  # Ảnh chờ xử lý tối đa trước khi trả về 503
+    'INFERENCE_TIMEOUT_SECONDS': 10.0,  # Thời gian chờ tối đa cho mỗi ảnh
+    'EMBEDDING_BATCH_SIZE': 16,  # Gom khuôn mặt của các kiosk gửi cùng lúc thành lô tối đa 16
+    'EMBEDDING_BATCH_WAIT_MS': 5.0,  # ... hoặc chờ tối đa 5 ms kể từ khuôn mặt đầu tiên
+    'MODEL_ARTIFACTS_CHECK': os.getenv('FACE_MODEL_ARTIFACTS_CHECK') or None,  # 'size'/'sha256' ở nhà máy không có mạng
+    'WARMUP_ON_STARTUP': os.getenv('FACE_WARMUP_ON_STARTUP', 'False') == 'True',  # Nạp mô hình khi worker khởi động
+    'DISTANCE_THRESHOLD': 0.4,  # Ngưỡng cosine distance cho recognize_face
+}
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/5.1/topics/i18n/
@@ -185,6 +212,7 @@ CORS_ALLOW_HEADERS = [
     'user-agent',
     'x-csrftoken',
     'x-requested-with',
+    'x-kiosk-key',
 ]
 
 # Rest Framework Configuration
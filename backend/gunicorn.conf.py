@@ -0,0 +1,68 @@
+"""
+Cấu hình gunicorn cho môi trường production (prefork, nạp trước trong master)
+
+    gunicorn -c gunicorn.conf.py face_checkin.wsgi
+
+Master import ứng dụng (preload_app) và chỉ nạp trước những phần an toàn khi fork: OpenCV, mô hình
+ONNX (EMBEDDING_ONNX_THREADS=1) và gallery khuôn mặt (employees.face_preload), rồi mới fork worker;
+các worker dùng chung những trang nhớ này theo cơ chế copy-on-write. TensorFlow/PyTorch/DeepFace
+không được import ở master (runtime của chúng không an toàn khi fork), vì vậy khi đã có file
+face_models/facenet512.onnx (export_embedding_model) chế độ này mặc định dùng embedding ONNX
+(FACE_EMBEDDING_BACKEND=onnx) để mô hình embedding được nạp một lần cho mọi worker; đặt
+FACE_EMBEDDING_BACKEND=keras để giữ mô hình Keras riêng trong từng worker.
+
+FACE_WARMUP_ON_STARTUP=True: từng worker nạp mô hình ngay sau khi fork (master không chạy warmup),
+/api/health/ trả về 503 cho tới khi worker nạp xong; ngược lại mô hình được nạp ở yêu cầu nhận
+diện đầu tiên. So sánh bộ nhớ từng worker khi có và không nạp trước bằng
+"python manage.py measure_prefork_memory --workers 4".
+
+Số worker và luồng:
+- GUNICORN_WORKERS (mặc định 2): mỗi worker giữ một bộ mô hình và suy luận trên khoảng một nhân
+  CPU; đặt bằng số nhân CPU dành cho backend, giảm nếu thiếu RAM (mỗi worker với mô hình Keras
+  có riêng TensorFlow và mô hình, với ONNX mô hình được dùng chung).
+- GUNICORN_THREADS (mặc định 4): luồng xử lý yêu cầu của mỗi worker; ảnh của các luồng được gom
+  lô embedding chung (EMBEDDING_BATCH_SIZE), các API không nhận diện không phải chờ mô hình.
+- FACE_INFERENCE_WORKERS (mặc định 0, như khi chạy ngoài gunicorn): suy luận chạy ngay trong
+  worker. Đặt lớn hơn 0 thì mỗi worker có thêm nhóm tiến trình suy luận riêng, được tạo bằng
+  'spawn' nên không dùng chung được bộ nhớ với master; số bản mô hình là GUNICORN_WORKERS nhân
+  FACE_INFERENCE_WORKERS.
+"""
+import os
+
+# Phải đặt trước khi nạp settings của Django (preload_app import ứng dụng ngay trong master)
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'face_checkin.settings_docker')
+os.environ.setdefault('FACE_EMBEDDING_ONNX_THREADS', '1')
+if os.path.exists(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'face_models', 'facenet512.onnx')):
+    os.environ.setdefault('FACE_EMBEDDING_BACKEND', 'onnx')
+# Warmup (FACE_WARMUP_ON_STARTUP) chạy trong từng worker sau khi fork (post_fork), không chạy ở master
+os.environ['FACE_WARMUP_AFTER_FORK'] = 'True'
+# Đánh dấu tiến trình phục vụ yêu cầu: employees.apps kiểm tra file trọng số ngay khi master import
+# ứng dụng (trước khi fork), các lệnh quản lý không làm việc này
+os.environ['FACE_SERVES_REQUESTS'] = 'True'
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:8000')
+workers = int(os.getenv('GUNICORN_WORKERS', '2'))
+threads = int(os.getenv('GUNICORN_THREADS', '4'))
+worker_class = 'gthread'
+preload_app = True
+# Lần nhận diện đầu tiên của worker có thể chờ nạp mô hình
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '120'))
+graceful_timeout = 30
+# Tạo lại worker định kỳ để giới hạn bộ nhớ tăng dần; worker mới fork từ master đã nạp sẵn
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', '2000'))
+max_requests_jitter = 200
+accesslog = '-'
+errorlog = '-'
+
+
+def when_ready(server):
+    # Chạy trong master sau khi ứng dụng đã được import, trước khi fork worker đầu tiên
+    from employees.face_preload import preload_for_fork
+
+    preload_for_fork()
+
+
+def post_fork(server, worker):
+    from employees.face_preload import after_fork
+
+    after_fork()